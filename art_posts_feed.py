@@ -0,0 +1,362 @@
+"""
+Синхронизация кэша art_posts по потоку изменений Firebase.
+
+Вместо перекачки всего art_posts/<канал> раз в POSTS_CACHE_TTL кэш может
+подписаться на изменения (db.reference(...).listen) и накатывать их на месте.
+Здесь только логика без состояния кэша (оно живёт в gpt_helper):
+разбор снимка art_posts, применение изменений к списку постов, перевод событий
+Firebase в такие изменения и сама подписка. FakeFirebase — локальная замена
+Firebase с тем же интерфейсом reference/get/set/update/delete/listen,
+чтобы синхронизацию можно было проверить и замерить без сети (benchmark_feed.py).
+"""
+import copy
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def posts_from_data(data):
+    """Список постов из снимка art_posts/<канал> (dict или list, как отдаёт Firebase)."""
+    posts_list = []
+    if isinstance(data, dict):
+        for pid, pdata in data.items():
+            if isinstance(pdata, dict):
+                try:
+                    pdata['post_id'] = int(pid)
+                    posts_list.append(pdata)
+                except ValueError:
+                    continue
+    elif isinstance(data, list):
+        for idx, pdata in enumerate(data):
+            if isinstance(pdata, dict) and pdata:
+                pdata['post_id'] = idx
+                posts_list.append(pdata)
+    return posts_list
+
+
+def _split_path(path):
+    return [part for part in str(path).split('/') if part]
+
+
+def _set_path(node, parts, value):
+    """Копия node, где по пути parts лежит value (None — удалить), как при записи в Firebase."""
+    node = dict(node) if isinstance(node, dict) else {}
+    key = parts[0]
+    if len(parts) > 1:
+        value = _set_path(node.get(key), parts[1:], value) or None  # Пустые узлы Firebase не хранит
+    if value is None:
+        node.pop(key, None)
+    else:
+        node[key] = value
+    return node
+
+
+def apply_post_changes(posts, changes, merge=False):
+    """
+    Новый список постов с изменениями changes: {post_id: данные поста или None (удаление)}.
+    merge=True — данные дописываются к полям существующего поста (как update в Firebase:
+    ключ может быть путём "analysis/br", None удаляет поле), посты, которых нет в списке,
+    пропускаются. Исходный список и посты не меняются; если ничего не изменилось,
+    возвращается сам posts.
+    """
+    positions = {str(post.get('post_id')): doc for doc, post in enumerate(posts)}
+    updated = list(posts)
+    removed = set()
+    changed = False
+    for post_id, data in changes.items():
+        try:
+            post_id = int(post_id)
+        except (TypeError, ValueError):
+            continue  # Такие ключи при загрузке тоже отбрасываются
+        doc = positions.get(str(post_id))
+
+        if data is None or (not merge and not isinstance(data, dict)):
+            if doc is not None:
+                removed.add(doc)
+                changed = True
+            continue
+        if merge:
+            if doc is None:
+                continue
+            post = updated[doc]
+            for field, value in data.items():
+                parts = _split_path(field)
+                if parts:
+                    post = _set_path(post, parts, value)
+        else:
+            post = dict(data)
+        post['post_id'] = post_id
+
+        if doc is None:
+            positions[str(post_id)] = len(updated)
+            updated.append(post)
+        elif updated[doc] != post:
+            updated[doc] = post
+            removed.discard(doc)
+        else:
+            continue  # Эхо собственной записи: пост уже такой
+        changed = True
+
+    if not changed:
+        return posts
+    if removed:
+        updated = [post for doc, post in enumerate(updated) if doc not in removed]
+    return updated
+
+
+def event_to_changes(event_type, path, data):
+    """
+    Переводит событие Firebase по art_posts/<канал> в список пакетов (changes, merge)
+    для apply_post_changes. None — событие заменяет весь канал (put в корень).
+    """
+    parts = _split_path(path)
+    if not parts:
+        if event_type == 'put':
+            return None
+        # patch в корне: ключи — посты целиком или пути вида "123/analysis"
+        replaced = {}
+        merged = {}
+        for key, value in (data or {}).items():
+            post_id, _, field = str(key).strip('/').partition('/')
+            if field:
+                merged.setdefault(post_id, {})[field] = value
+            else:
+                replaced[post_id] = value
+        batches = []
+        if replaced:
+            batches.append((replaced, False))
+        if merged:
+            batches.append((merged, True))
+        return batches
+
+    post_id, field = parts[0], '/'.join(parts[1:])
+    if event_type == 'put':
+        if not field:
+            return [({post_id: data}, False)]
+        return [({post_id: {field: data}}, True)]
+    if not isinstance(data, dict):
+        return []
+    prefix = field + '/' if field else ''
+    return [({post_id: {prefix + str(key).strip('/'): value for key, value in data.items()}}, True)]
+
+
+class PostsChangeFeed:
+    """
+    Подписка на art_posts/<канал>. reference — db.reference(...) или FakeFirebase.reference(...).
+    on_replace(data) получает канал целиком (первое событие подписки и put в корень),
+    on_changes(changes, merge) — изменения отдельных постов.
+    События приходят в потоке слушателя Firebase.
+    """
+
+    def __init__(self, reference, on_replace, on_changes):
+        self.reference = reference
+        self.on_replace = on_replace
+        self.on_changes = on_changes
+        self.registration = None
+        self.synced = False
+        self.events = 0
+        self.errors = 0
+        self.last_event_at = None
+        self.last_apply_ms = None
+
+    def start(self):
+        self.registration = self.reference.listen(self._on_event)
+        return self
+
+    def close(self):
+        registration, self.registration = self.registration, None
+        self.synced = False
+        if registration is not None:
+            registration.close()
+
+    @property
+    def live(self):
+        """Подписка активна и полный снимок канала уже получен — опрос по TTL не нужен."""
+        return self.registration is not None and self.synced
+
+    def _on_event(self, event):
+        started = time.perf_counter()
+        try:
+            batches = event_to_changes(event.event_type, event.path, event.data)
+            if batches is None:
+                self.on_replace(event.data)
+                self.synced = True
+            else:
+                for changes, merge in batches:
+                    self.on_changes(changes, merge)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"[FEED] Ошибка применения события {event.event_type} {event.path}: {e}")
+        finally:
+            self.events += 1
+            self.last_event_at = time.time()
+            self.last_apply_ms = round((time.perf_counter() - started) * 1000, 3)
+
+    def stats(self):
+        return {
+            "live": self.live,
+            "events": self.events,
+            "errors": self.errors,
+            "last_event_at": self.last_event_at,
+            "last_apply_ms": self.last_apply_ms,
+        }
+
+
+class FakeEvent:
+    """Событие в формате firebase_admin.db.Event."""
+
+    def __init__(self, event_type, path, data):
+        self.event_type = event_type
+        self.path = path
+        self.data = data
+
+
+class _FakeListener:
+    """Слушатель FakeFirebase: события доставляются по порядку в отдельном потоке, как у Firebase."""
+
+    def __init__(self, firebase, parts, callback):
+        self.firebase = firebase
+        self.parts = parts
+        self.callback = callback
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="fake-firebase-listener", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            event = self.queue.get()
+            try:
+                if event is None:
+                    return
+                self.callback(event)
+            except Exception as e:
+                logger.error(f"[FAKE FIREBASE] Ошибка в слушателе: {e}")
+            finally:
+                self.queue.task_done()
+
+    def close(self):
+        self.firebase._remove_listener(self)
+        self.queue.put(None)
+
+
+class FakeReference:
+    """Аналог firebase_admin.db.Reference поверх FakeFirebase."""
+
+    def __init__(self, firebase, parts):
+        self.firebase = firebase
+        self.parts = parts
+
+    @property
+    def key(self):
+        return self.parts[-1] if self.parts else None
+
+    def child(self, path):
+        return FakeReference(self.firebase, self.parts + _split_path(path))
+
+    def get(self):
+        return self.firebase._get(self.parts)
+
+    def set(self, value):
+        self.firebase._write(self.parts, value)
+
+    def update(self, value):
+        if not isinstance(value, dict) or not value:
+            raise ValueError("Value argument must be a non-empty dictionary.")
+        self.firebase._update(self.parts, value)
+
+    def delete(self):
+        self.firebase._write(self.parts, None)
+
+    def listen(self, callback):
+        return self.firebase._add_listener(self.parts, callback)
+
+
+class FakeFirebase:
+    """
+    Локальная замена Firebase Realtime Database: дерево в памяти и события
+    put/patch для слушателей. reference() повторяет db.reference(), так что
+    types.SimpleNamespace(reference=fake.reference) подставляется вместо db.
+    """
+
+    def __init__(self, data=None):
+        self._root = copy.deepcopy(data) if data else {}
+        self._lock = threading.RLock()
+        self._listeners = []
+
+    def reference(self, path='/'):
+        return FakeReference(self, _split_path(path))
+
+    def wait_idle(self):
+        """Ждёт, пока все слушатели обработают уже отправленные события."""
+        for listener in list(self._listeners):
+            listener.queue.join()
+
+    def _node(self, parts):
+        node = self._root
+        for part in parts:
+            if not isinstance(node, dict) or part not in node:
+                return None
+            node = node[part]
+        return node
+
+    def _get(self, parts):
+        with self._lock:
+            return copy.deepcopy(self._node(parts))
+
+    def _store(self, parts, value):
+        """Запись на месте; пустые узлы убираются, как в Firebase."""
+        if not parts:
+            self._root = value if isinstance(value, dict) else {}
+            return
+        trail = [self._root]
+        for part in parts[:-1]:
+            node = trail[-1].get(part)
+            if not isinstance(node, dict):
+                if value is None:
+                    return
+                node = trail[-1][part] = {}
+            trail.append(node)
+        if value is None or value == {}:
+            trail[-1].pop(parts[-1], None)
+        else:
+            trail[-1][parts[-1]] = copy.deepcopy(value)
+        for depth in range(len(trail) - 1, 0, -1):
+            if trail[depth]:
+                break
+            trail[depth - 1].pop(parts[depth - 1], None)
+
+    def _write(self, parts, value):
+        with self._lock:
+            self._store(parts, value)
+            self._notify(parts, 'put', value)
+
+    def _update(self, parts, value):
+        with self._lock:
+            for key, item in value.items():
+                self._store(parts + _split_path(key), item)
+            self._notify(parts, 'patch', value)
+
+    def _notify(self, parts, event_type, data):
+        for listener in self._listeners:
+            depth = len(listener.parts)
+            if parts[:depth] == listener.parts:
+                path = '/' + '/'.join(parts[depth:])
+                listener.queue.put(FakeEvent(event_type, path, copy.deepcopy(data)))
+            elif listener.parts[:len(parts)] == parts:
+                # Запись выше подписки: слушатель получает своё поддерево целиком
+                listener.queue.put(FakeEvent('put', '/', copy.deepcopy(self._node(listener.parts))))
+
+    def _add_listener(self, parts, callback):
+        with self._lock:
+            listener = _FakeListener(self, parts, callback)
+            listener.queue.put(FakeEvent('put', '/', copy.deepcopy(self._node(parts))))
+            self._listeners.append(listener)
+            return listener
+
+    def _remove_listener(self, listener):
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
@@ -17,7 +17,7 @@ import requests
 from flask import Response, stream_with_context
 import random
 import hashlib
-import re
+import numpy as np
 
 import time  # <--- ДОБАВЛЕНО
 
@@ -70,20 +70,17 @@ def get_image_from_telegram(post_id, custom_channel_id=None, req_id="Unknown"):
     target_channel = custom_channel_id if custom_channel_id else DEFAULT_CHANNEL_ID
     
     # 0. ПРОВЕРКА БАЗЫ ДАННЫХ
-    # ИЗМЕНЕНИЕ: Используем базу ТОЛЬКО если это основной канал
-    db_data = None
-    
-    # Приводим к общему виду для сравнения
-    is_main_channel = (target_channel.lower() == '@anemonn' or target_channel == 'default_world')
-    
-    if is_main_channel:
-        from gpt_helper import get_art_post
-        # Пытаемся достать из базы только для Anemonn
-        db_data = get_art_post('@anemonn', post_id)
-    else:
-        logger.info(f"[{req_id}] Channel {target_channel} is NOT Anemonn. Skipping DB, using Forwarding.")
-
-    # Если нашли в базе (только для Anemonn), возвращаем ссылку
+    # Пост берётся из кэша art_posts канала (любого, у которого есть записи в базе),
+    # без запроса к базе на каждую картинку
+    from gpt_helper import get_cached_art_post, is_valid_channel_id
+    if not is_valid_channel_id(target_channel):
+        logger.warning(f"[{req_id}] Invalid channel id {target_channel[:80]!r}")
+        return None
+    db_data = get_cached_art_post(target_channel, post_id)
+    if not db_data:
+        logger.info(f"[{req_id}] Post {post_id} of {target_channel} is not in DB. Using Forwarding.")
+
+    # Если нашли в базе, возвращаем ссылку
     if db_data:
         logger.info(f"[{req_id}] DB HIT for {post_id}. Using database record.")
         
@@ -269,7 +266,9 @@ def api_resolve_image():
     req_id = str(uuid.uuid4())[:8]
     
     post_id = request.args.get('post_id')
-    channel_id = request.args.get('channel_id')
+    channel_id = _read_channel_id()
+    if channel_id is None:
+        return jsonify({"found": False, "error": "Invalid channel_id"}), 400
     # Читаем флаг прокси (строка 'true' -> bool)
     use_proxy = request.args.get('use_proxy') == 'true'
     
@@ -326,7 +325,7 @@ def api_resolve_image():
                 # Fallback при ошибке файловой системы
         # -------------------------------------
 
-        return jsonify({
+        return Response(dumps_json({
             "found": True,
             "url": img_data['url'],
             "width": img_data['width'],
@@ -334,7 +333,7 @@ def api_resolve_image():
             "caption": img_data.get('caption', ''),
             "date": img_data.get('date', ''),
             "post_link": img_data.get('post_link', '')
-        })
+        }), mimetype='application/json')
     
     logger.warning(f"[{req_id}] Not found response sent.")
     return jsonify({"found": False})
@@ -628,298 +627,331 @@ def api_locate_post():
 
     return jsonify({"found": False, "message": "Not found near current location"}), 404
 
-def normalize_text(text):
-    """Приводит текст к нижнему регистру и меняет ё на е."""
-    if not text: return ""
-    return str(text).lower().replace('ё', 'е')
+# Нормализация и стемминг вынесены в gallery_search (там же инвертированный индекс)
+from gallery_search import (
+    normalize_text, tokenize,
+    ResultSetCache, signature_digest, encode_cursor, decode_cursor, FACET_NAMES,
+    dumps_json, SUGGEST_LIMIT, RESULT_WINDOW, top_k_descending,
+)
 
-def get_word_stem(word):
-    """
-    Простой стеммер для русского языка.
-    Отсекает окончания, но бережно относится к коротким словам.
-    """
-    if len(word) <= 3:
-        return word
-    
-    # Список основных окончаний (от длинных к коротким, чтобы сначала отрезать 'ая', а не 'а')
-    endings = [
-        'ами', 'ями', 'ов', 'ев', 'ей', 'ом', 'ем', 'ах', 'ях', 'ую', 'юю', 
-        'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ый', 'ий', 'ой', 'ся', 'сь',
-        'а', 'я', 'о', 'е', 'ь', 'ы', 'и', 'у', 'ю'
-    ]
-    
-    for end in endings:
-        if word.endswith(end):
-            # Проверка: если отрезать окончание, останется ли корень длиннее 2 букв?
-            # Это защищает слова типа "дом" (чтобы не отрезать 'ом' и получить 'д')
-            if len(word) - len(end) >= 2:
-                return word[:-len(end)]
-    return word
-
-def smart_match(query, text_fields):
+# --- ОБНОВЛЕННЫЙ ЭНДПОИНТ ПОИСКА ---
+
+# Упорядоченные выдачи поиска: сигнатура запроса -> первые документы и их число (курсорная пагинация)
+SEARCH_RESULTS_CACHE = ResultSetCache()
+
+
+class StageTimer:
     """
-    Проверяет, соответствует ли запрос полям текста.
-    query: строка запроса от пользователя
-    text_fields: список строк, где ищем (caption, ai_des, ai_style)
+    Замер этапов обработки запроса: mark(name) закрывает этап, начатый
+    предыдущей отметкой (или созданием таймера). Итог — заголовок Server-Timing и строка для лога.
     """
-    # 1. Нормализация и разбивка запроса на слова
-    norm_query = normalize_text(query)
-    # Используем regex, чтобы разбить "привет, мир!" на ["привет", "мир"]
-    q_words = re.findall(r'\w+', norm_query)
-    
-    if not q_words:
-        return True # Пустой запрос - показываем всё
 
-    # 2. Нормализация и разбивка текста поста
-    full_text = " ".join([normalize_text(t) for t in text_fields])
-    t_words = set(re.findall(r'\w+', full_text)) # set для быстрого поиска
-    
-    # 3. Логика сравнения
-    # Мы считаем, что пост подходит, если ВСЕ слова из запроса найдены в посте
-    for q_word in q_words:
-        found_word = False
-        
-        # А) Точное совпадение (с учетом е/ё)
-        # Это решает проблему "кот" != "который", так как мы сравниваем слово целиком
-        if q_word in t_words:
-            found_word = True
-        
-        # Б) Если точного нет, пробуем искать по корню (стемминг)
-        else:
-            q_stem = get_word_stem(q_word)
-            # Если слово короткое (<=3), стемминг не применяем, ищем только точно
-            if len(q_word) > 3:
-                for t_word in t_words:
-                    if len(t_word) > 3 and get_word_stem(t_word) == q_stem:
-                        found_word = True
-                        break
-        
-        if not found_word:
-            return False # Если хоть одно слово из запроса не найдено
+    def __init__(self):
+        self.started = self._last = time.perf_counter()
+        self.stages = []
 
-    return True
+    def mark(self, name):
+        now = time.perf_counter()
+        self.stages.append((name, (now - self._last) * 1000))
+        self._last = now
 
-# --- ОБНОВЛЕННЫЙ ЭНДПОИНТ ПОИСКА ---
+    def total_ms(self):
+        return (time.perf_counter() - self.started) * 1000
 
-@app.route('/api/anemone/search', methods=['GET'])
-def api_search_gallery():
-    from gpt_helper import get_all_art_posts_cached
-    
-    query = request.args.get('q', '').strip()
-    color_filter = request.args.get('color', '').lower().strip()
-    similar_to = request.args.get('similar_to', '').strip()
-    offset = int(request.args.get('offset', 0))
-    limit = int(request.args.get('limit', 50))
-    channel_id = '@anemonn'
-    
-    # --- НОВЫЕ ПАРАМЕТРЫ ФИЛЬТРАЦИИ ---
-    dom_color = request.args.get('dom_color', '').lower().strip()
-    sec_color = request.args.get('sec_color', '').lower().strip()
-    
+    def server_timing(self):
+        parts = [f"{name};dur={ms:.2f}" for name, ms in self.stages]
+        parts.append(f"total;dur={self.total_ms():.2f}")
+        return ", ".join(parts)
+
+    def summary(self):
+        return " ".join(f"{name}={ms:.1f}ms" for name, ms in self.stages) + f" total={self.total_ms():.1f}ms"
+
+
+def _read_channel_id():
+    """
+    channel_id из запроса (по умолчанию основной канал) или None, если он не похож на канал:
+    id попадает в путь art_posts/<канал> в базе, ключ кэша и имя файла снимка.
+    """
+    from gpt_helper import is_valid_channel_id
+    channel_id = request.args.get('channel_id') or DEFAULT_CHANNEL_ID
+    return channel_id if is_valid_channel_id(channel_id) else None
+
+
+def _read_search_filters():
+    """Параметры фильтрации из запроса (общие для /search и /facets)."""
     def safe_float(val):
         try: return float(val) if val else None
         except: return None
-        
-    br_min = safe_float(request.args.get('br_min'))
-    br_max = safe_float(request.args.get('br_max'))
-    sat_min = safe_float(request.args.get('sat_min'))
-    sat_max = safe_float(request.args.get('sat_max'))
-    date_from = request.args.get('date_from', '').strip()
-    date_to = request.args.get('date_to', '').strip()
-
-    # --- ДОБАВИТЬ ЭТИ ДВЕ СТРОКИ ---
+
+    return {
+        'color_filter': request.args.get('color', '').lower().strip(),
+        'dom_color': request.args.get('dom_color', '').lower().strip(),
+        'sec_color': request.args.get('sec_color', '').lower().strip(),
+        'style': normalize_text(request.args.get('style', '')).strip(),
+        'br_min': safe_float(request.args.get('br_min')),
+        'br_max': safe_float(request.args.get('br_max')),
+        'sat_min': safe_float(request.args.get('sat_min')),
+        'sat_max': safe_float(request.args.get('sat_max')),
+        'date_from': request.args.get('date_from', '').strip(),
+        'date_to': request.args.get('date_to', '').strip(),
+    }
+
+
+def _filtered_docs(search_index, query, similar_to, filters, timer=None):
+    """Документы (позиции в search_index.posts), прошедшие запрос и фильтры, в порядке кэша."""
+    color_filter = filters['color_filter']
+    br_min, br_max = filters['br_min'], filters['br_max']
+    date_from, date_to = filters['date_from'], filters['date_to']
+
     # Перевод значений UI (0.0 - 1.0) в реальный перевернутый диапазон БД (0.8 - 0.45)
     db_br_max_allowed = 0.8 - (0.35 * br_min) if br_min is not None else 0.8
     db_br_min_allowed = 0.8 - (0.35 * br_max) if br_max is not None else 0.45
     
-    all_posts = get_all_art_posts_cached(channel_id)
-    filtered = []
-    
-    target_post = None
-    t_br, t_sat = 0.0, 0.0
-    
+    # Текстовый запрос — пересечение списков инвертированного индекса
+    # (пост подходит, если в нём есть все слова запроса: точно или, для слов
+    # длиннее 3 букв, по совпадению основы)
+    candidate_docs = search_index.match(query) if query and not similar_to else None
+    if timer:
+        timer.mark('match')
+
     if similar_to:
-        target_post = next((p for p in all_posts if str(p.get('post_id')) == similar_to), None)
-        if target_post:
-            t_analysis = target_post.get('analysis', {})
-            t_br = float(t_analysis.get('br', 0))
-            t_sat = float(t_analysis.get('sat', 0))
-    
-    for p in all_posts:
-        if p.get('status') != 'ok' or p.get('type') != 'photo':
-            continue
-            
-        if not similar_to:
-            if query:
-                text_content = [
-                    str(p.get('caption', '')),
-                    str(p.get('ai_des_ru', '')),
-                    str(p.get('ai_style_ru', ''))
-                ]
-                if not smart_match(query, text_content):
-                    continue
-            
-            analysis = p.get('analysis', {})
-            p_dom = str(analysis.get('dom_color', '')).lower()
-            p_sec = str(analysis.get('sec_color', '')).lower()
-            p_ter = str(analysis.get('ter_color', '')).lower() # <--- ДОБАВЛЕНО
-            p_br = float(analysis.get('br', 0))
-            p_sat = float(analysis.get('sat', 0))
-            
-            # Обновленный color_filter
-            if color_filter and color_filter not in ['black', 'white']:
-                if p_dom != color_filter and p_sec != color_filter and p_ter != color_filter:
-                    continue
-            
-            # --- ПРИМЕНЕНИЕ НОВЫХ ФИЛЬТРОВ ---
-            if dom_color and p_dom != dom_color: continue
-            if sec_color and p_sec != sec_color and p_ter != sec_color: continue
-            if br_min is not None and p_br > db_br_max_allowed: continue
-            if br_max is not None and p_br < db_br_min_allowed: continue
-            if sat_min is not None and p_sat < sat_min: continue
-            if sat_max is not None and p_sat > sat_max: continue
-            
-            p_date = p.get('date', 0)
-            if date_from or date_to:
-                try:
-                    if date_from:
-                        dt_from = datetime.strptime(date_from, '%Y-%m-%d').timestamp()
-                        if p_date < dt_from: continue
-                    if date_to:
-                        dt_to = datetime.strptime(date_to, '%Y-%m-%d').timestamp() + 86399 # Конец дня
-                        if p_date > dt_to: continue
-                except Exception:
-                    pass
-        else:
-            # Жесткий фильтр (continue) удален. 
-            # Теперь все картинки попадают в список, а функция сортировки 
-            # сама выстроит их в идеальный градиент по системе штрафов.
+        # Жесткий фильтр удален: все картинки попадают в список, а функция
+        # сортировки сама выстроит их в идеальный градиент по системе штрафов.
+        mask = search_index.columns.photo_ok
+    else:
+        # Границы дат разбираются один раз на запрос. Если date_from не разобрать,
+        # фильтр по датам не применяется вовсе, как и раньше.
+        dt_from = dt_to = None
+        try:
+            if date_from:
+                dt_from = datetime.strptime(date_from, '%Y-%m-%d').timestamp()
+            if date_to:
+                dt_to = datetime.strptime(date_to, '%Y-%m-%d').timestamp() + 86399 # Конец дня
+        except Exception:
             pass
-        
-        filtered.append(p)
 
-    # Логика сортировки остается без изменений
+        # Все фильтры — одной векторной маской по колонкам кэша
+        mask = search_index.columns.filter_mask(
+            color=color_filter if color_filter not in ['black', 'white'] else None,
+            dom_color=filters['dom_color'],
+            sec_color=filters['sec_color'],
+            style=filters['style'],
+            br_range=(
+                db_br_min_allowed if br_max is not None else None,
+                db_br_max_allowed if br_min is not None else None,
+            ),
+            sat_min=filters['sat_min'],
+            sat_max=filters['sat_max'],
+            date_from=dt_from,
+            date_to=dt_to,
+        )
+
+    if candidate_docs is None:
+        docs = np.flatnonzero(mask)
+    else:
+        docs = candidate_docs[mask[candidate_docs]]
+    if timer:
+        timer.mark('filter')
+    return docs
+
+
+def _evaluate_search(search_index, query, similar_to, relevance_mode, filters, window, timer=None):
+    """
+    Выдача /api/anemone/search: фильтры по всему кэшу постов и первые window
+    документов (позиций в search_index.posts) в порядке выдачи.
+    Возвращает (документы окна, полное число результатов).
+    """
+    columns = search_index.columns
+    color_filter = filters['color_filter']
+    sec_color = filters['sec_color']
+
+    target_post = search_index.find_post(similar_to) if similar_to else None
+    filtered_docs = _filtered_docs(search_index, query, similar_to, filters, timer)
+    total = len(filtered_docs)
+
     if similar_to and target_post:
-        t_cap = str(target_post.get('caption', '')).strip().lower()
-        t_analysis = target_post.get('analysis', {})
-        t_dom = str(t_analysis.get('dom_color', '')).lower()
-        t_sec = str(t_analysis.get('sec_color', '')).lower()
-        t_ter = str(t_analysis.get('ter_color', '')).lower()
-        t_br = float(t_analysis.get('br', 0))
-        t_sat = float(t_analysis.get('sat', 0))
-        
-        # Составляем список целевых цветов с весами (dom=3, sec=2, ter=1)
-        t_colors = []
-        if t_dom: t_colors.append((t_dom, 3))
-        if t_sec: t_colors.append((t_sec, 2))
-        if t_ter: t_colors.append((t_ter, 1))
-
-        def similar_sort_key(item):
-            if str(item.get('post_id')) == similar_to: 
-                return -10000.0  # Оригинал всегда самый первый
-                
-            i_cap = str(item.get('caption', '')).strip().lower()
-            i_analysis = item.get('analysis', {})
-            i_dom = str(i_analysis.get('dom_color', '')).lower()
-            i_sec = str(i_analysis.get('sec_color', '')).lower()
-            i_ter = str(i_analysis.get('ter_color', '')).lower()
-            i_br = float(i_analysis.get('br', 0))
-            i_sat = float(i_analysis.get('sat', 0))
-            
-            # 1. Перекрестный подсчет совпадения цветов
-            i_colors_dict = {}
-            if i_dom: i_colors_dict[i_dom] = 3
-            if i_sec and i_sec not in i_colors_dict: i_colors_dict[i_sec] = 2
-            if i_ter and i_ter not in i_colors_dict: i_colors_dict[i_ter] = 1
-            
-            match_score = 0
-            for color, target_weight in t_colors:
-                item_weight = i_colors_dict.get(color, 0)
-                match_score += target_weight * item_weight
-                
-            # Максимальный match_score = (3*3 + 2*2 + 1*1) = 14
-            # Превращаем в штраф: чем меньше совпадений, тем больше штраф
-            color_penalty = (14 - match_score) * 2.0 
-            
-            # 2. Штраф за отклонения по br и sat
-            # Умножаем на коэффициенты, чтобы сбалансировать вес с цветами
-            metrics_penalty = abs(t_br - i_br) * 20.0 + abs(t_sat - i_sat) * 10.0
-            
-            total_penalty = color_penalty + metrics_penalty
-            
-            # 3. Бонус за одинаковый caption (перекрывает другие отклонения)
-            if t_cap and i_cap == t_cap:
-                total_penalty -= 100.0
-                
-            return total_penalty
+        # Векторный k-NN по колонкам кэша: упорядочиваются только первые window
+        # постов, рейтинг с большим k similar_ranking досчитает сам.
+        ranked_docs, _ = search_index.similar_ranking(similar_to, min(window, total))
+        if timer:
+            timer.mark('sort')
+        return ranked_docs, total
+
+    # Ключи сортировки — по колонкам кэша; при равенстве порядок кэша сохраняется
+    date = columns.date[filtered_docs]
+    if relevance_mode:
+        # BM25 по подписи и AI-полям, затем свежесть
+        keys = [search_index.relevance_scores(query, filtered_docs), date]
+
+    elif color_filter in ('white', 'black'):
+        br = columns.br[filtered_docs]
+        sat = columns.sat[filtered_docs]
+        keys = [-br - sat if color_filter == 'white' else br - sat]
 
-        # Сортируем по ВОЗРАСТАНИЮ штрафа (меньше штраф = больше похоже)
-        filtered.sort(key=similar_sort_key)
-        
     elif color_filter:
-        def color_sort_key(item):
-            analysis = item.get('analysis', {})
-            sat = float(analysis.get('sat', 0))
-            br = float(analysis.get('br', 0))
-            dom = str(analysis.get('dom_color', '')).lower()
-            sec = str(analysis.get('sec_color', '')).lower()
-            ter = str(analysis.get('ter_color', '')).lower()
-            
-            if color_filter == 'white': 
-                return (-br - sat)
-            elif color_filter == 'black': 
-                return (br - sat)
-            else:
-                # Вес цвета в зависимости от позиции
-                weight = 0
-                if dom == color_filter: weight += 3
-                if sec == color_filter: weight += 1.5
-                if ter == color_filter: weight += 0.5
-                
-                # 1. Разбиваем насыщенность на корзины (шаг 0.1: 0.9, 0.8, 0.7 и т.д.)
-                # Это группирует картинки с похожей насыщенностью вместе
-                sat_bucket = int(sat * 10)
-                
-                # 2. "Змейка" яркости для бесшовных переходов
-                # Так как глобальная сортировка reverse=True (по убыванию):
-                # Для нечетных корзин br сортируется от 0.78 к 0.44 (от тёмных к светлым).
-                # Для четных корзин мы инвертируем br (-br), что даст сортировку от светлых к тёмным.
-                # Итог: тёмные -> светлые -> светлые -> тёмные -> тёмные -> светлые...
-                if sat_bucket % 2 == 0:
-                    smooth_br = -br
-                else:
-                    smooth_br = br
-                
-                # Возвращаем кортеж. Приоритет: 1. Совпадение цвета, 2. Корзина насыщенности, 3. Плавная яркость
-                return (weight, sat_bucket, smooth_br)
+        code = columns.color_code(color_filter)
+        # Вес цвета в зависимости от позиции
+        weight = (
+            3 * (columns.dom[filtered_docs] == code)
+            + 1.5 * (columns.sec[filtered_docs] == code)
+            + 0.5 * (columns.ter[filtered_docs] == code)
+        )
+        # 1. Насыщенность разбивается на корзины (шаг 0.1: 0.9, 0.8, 0.7 и т.д.),
+        # это группирует картинки с похожей насыщенностью вместе
+        sat_bucket = np.trunc(columns.sat[filtered_docs] * 10)
+        # 2. "Змейка" яркости для бесшовных переходов: порядок убывающий, поэтому
+        # в нечётных корзинах br идёт от 0.78 к 0.44 (от тёмных к светлым),
+        # а в чётных br инвертируется (-br) — от светлых к тёмным.
+        # Итог: тёмные -> светлые -> светлые -> тёмные -> тёмные -> светлые...
+        br = columns.br[filtered_docs]
+        smooth_br = np.where(sat_bucket % 2 == 0, -br, br)
+        # Приоритет: 1. Совпадение цвета, 2. Корзина насыщенности, 3. Плавная яркость
+        keys = [weight, sat_bucket, smooth_br]
 
-        filtered.sort(key=color_sort_key, reverse=True)
     else:
-        def default_sort_key(item):
-            # Если выбран sec_color в фильтрах, даем приоритет (1) совпадению именно с sec_color, а не ter_color (0)
-            priority = 1 if sec_color and str(item.get('analysis', {}).get('sec_color', '')).lower() == sec_color else 0
-            return (priority, item.get('date', 0))
-            
-        filtered.sort(key=default_sort_key, reverse=True)
+        # Если выбран sec_color в фильтрах, даем приоритет (1) совпадению именно с sec_color, а не ter_color (0)
+        if sec_color:
+            priority = columns.sec[filtered_docs] == columns.color_code(sec_color)
+        else:
+            priority = np.zeros(total)
+        keys = [priority, date]
 
-    total = len(filtered)
-    chunk = filtered[offset : offset + limit]
+    ordered_docs = filtered_docs[top_k_descending(keys, window)]
+    if timer:
+        timer.mark('sort')
+    return ordered_docs, total
+
+@app.route('/api/anemone/search', methods=['GET'])
+def api_search_gallery():
+    from gpt_helper import get_art_posts_index
     
-    result_items = []
-    for item in chunk:
-        result_items.append({
-            "post_id": item.get('post_id'),
-            "file_id": item.get('file_id'),
-            "caption": item.get('caption'),
-            "post_link": f"https://t.me/{item.get('channel_id', 'anemonn').replace('@', '')}/{item.get('post_id')}",
-            "original_link": item.get('original_link'),
-            "ai_des": item.get('ai_des_ru'),
-            "ai_style": item.get('ai_style_ru'),
-            "date": datetime.fromtimestamp(item.get('date', 0)).strftime('%d.%m.%Y') if item.get('date') else "",
-            "analysis": item.get('analysis')
-        })
+    timer = StageTimer()
+    query = request.args.get('q', '').strip()
+    similar_to = request.args.get('similar_to', '').strip()
+    sort_mode = request.args.get('sort', '').lower().strip()
+    offset = int(request.args.get('offset', 0))
+    limit = int(request.args.get('limit', 50))
+    channel_id = _read_channel_id()
+    if channel_id is None:
+        return jsonify({"error": "Invalid channel_id"}), 400
+    filters = _read_search_filters()
+
+    search_index = get_art_posts_index(channel_id)
+    timer.mark('cache')
+    relevance_mode = bool(sort_mode == 'relevance' and query and not similar_to)
+
+    # Сигнатура запроса: всё, от чего зависит порядок выдачи. Упорядоченный список
+    # документов кэшируется по ней, и следующие страницы — просто срезы.
+    signature = (
+        channel_id,
+        bool(query), tuple(sorted(set(tokenize(query)))) if not similar_to else (),
+        similar_to, relevance_mode,
+    ) + tuple(sorted(filters.items()))
+    digest = signature_digest(signature)
+    cursor = decode_cursor(request.args.get('cursor', '').strip())
+    if cursor and cursor[0] == digest:
+        # Курсор той же выдачи главнее offset; если кэш постов с тех пор
+        # обновился, выдача пересчитывается и продолжается с той же позиции
+        offset = cursor[2]
+
+    # В кэше — только начало выдачи; страница за его концом расширяет окно вдвое
+    needed = offset + limit
+    cached = SEARCH_RESULTS_CACHE.get(signature, search_index.version)
+    if cached is not None and (len(cached[0]) >= needed or len(cached[0]) == cached[1]):
+        ordered_docs, total = cached
+        timer.mark('results_hit')
+    else:
+        window = max(needed, RESULT_WINDOW, 2 * len(cached[0]) if cached is not None else 0)
+        ordered_docs, total = SEARCH_RESULTS_CACHE.put(
+            signature, search_index.version,
+            *_evaluate_search(search_index, query, similar_to, relevance_mode, filters, window, timer),
+        )
+
+    page_docs = ordered_docs[offset : offset + limit].tolist()
+    next_position = offset + len(page_docs)
+    next_cursor = encode_cursor(digest, search_index.version, next_position) if next_position < total else None
+
+    # Ответ склеивается из JSON-фрагментов постов, подготовленных при загрузке кэша
+    items = b','.join(search_index.item_fragment(doc) for doc in page_docs)
+    body = b'{"cursor":%s,"items":[%s],"total":%d}' % (dumps_json(next_cursor), items, total)
+    timer.mark('serialize')
+
+    logger.info(
+        f"[SEARCH] q='{query}' similar_to='{similar_to}' offset={offset} "
+        f"total={total} items={len(page_docs)} | {timer.summary()}"
+    )
+    response = Response(body, mimetype='application/json')
+    response.headers['Server-Timing'] = timer.server_timing()
+    return response
+
+
+@app.route('/api/anemone/cache_metrics', methods=['GET'])
+def api_gallery_cache_metrics():
+    """Метрики кэша постов (возраст, длительность загрузок и сборок индекса) и кэша выдач."""
+    from gpt_helper import get_posts_cache_metrics
+
+    return jsonify({
+        "posts_cache": get_posts_cache_metrics(),
+        "results_cache": SEARCH_RESULTS_CACHE.stats(),
+    })
+
+
+@app.route('/api/anemone/suggest', methods=['GET'])
+def api_gallery_suggest():
+    """
+    Автодополнение строки поиска: последнее (недописанное) слово запроса
+    дополняется словами словаря галереи, самые частые — первыми.
+    """
+    from gpt_helper import get_art_posts_index
+
+    query = normalize_text(request.args.get('q', ''))
+    limit = min(int(request.args.get('limit', SUGGEST_LIMIT)), 50)
+    words = tokenize(query)
+    # Пробел в конце — слово дописано, дополнять нечего
+    if not words or not query.endswith(words[-1]):
+        return jsonify({"suggestions": []})
+
+    channel_id = _read_channel_id()
+    if channel_id is None:
+        return jsonify({"error": "Invalid channel_id"}), 400
+
+    head = ' '.join(words[:-1])
+    search_index = get_art_posts_index(channel_id)
+    suggestions = [
+        {"text": f"{head} {word}" if head else word, "word": word, "count": count}
+        for word, count in search_index.suggest(words[-1], limit)
+    ]
+    return jsonify({"suggestions": suggestions})
+
+
+@app.route('/api/anemone/facets', methods=['GET'])
+def api_gallery_facets():
+    """
+    Счётчики значений фасетов (цвета, стиль, год, месяц) для текущего запроса:
+    те же параметры q и фильтров, что у /api/anemone/search.
+    limit — сколько самых частых значений отдавать на каждый фасет.
+    """
+    from gpt_helper import get_art_posts_index
+
+    query = request.args.get('q', '').strip()
+    similar_to = request.args.get('similar_to', '').strip()
+    limit = int(request.args.get('limit', 50))
+    channel_id = _read_channel_id()
+    if channel_id is None:
+        return jsonify({"error": "Invalid channel_id"}), 400
+    filters = _read_search_filters()
 
-    return jsonify({"total": total, "items": result_items})
+    search_index = get_art_posts_index(channel_id)
+    docs = _filtered_docs(search_index, query, similar_to, filters)
+    counts = search_index.columns.facets.counts(docs)
+
+    return jsonify({
+        "total": len(docs),
+        "facets": {
+            name: [{"value": value, "count": count} for value, count in counts[name][:limit]]
+            for name in FACET_NAMES
+        },
+    })
 
 
 
@@ -1217,6 +1249,22 @@ def run():
     logger.info("Starting Waitress server with 6 threads...")
     serve(app, host="0.0.0.0", port=80, threads=7)
 
+def warm_gallery_cache():
+    """
+    Прогрев кэша галереи при старте (из снимка на диске, если он есть), чтобы первый запрос не ждал.
+    С ART_POSTS_CHANGE_FEED=1 кэш заполняет и дальше обновляет поток изменений: первое его
+    событие — весь канал, поэтому отдельная загрузка из базы не запускается.
+    """
+    from gpt_helper import POSTS_CHANGE_FEED, get_art_posts_index, start_posts_change_feed
+    try:
+        if POSTS_CHANGE_FEED:
+            start_posts_change_feed('@anemonn')
+        else:
+            get_art_posts_index('@anemonn')
+    except Exception as e:
+        logger.error(f"Ошибка прогрева кэша галереи: {e}")
+
 def keep_alive():
+    Thread(target=warm_gallery_cache, daemon=True).start()
     t = Thread(target=run)
     t.start()
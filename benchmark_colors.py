@@ -0,0 +1,341 @@
+"""
+Бенчмарк горячего пути цветового анализа (палитровая сортировка и ingest).
+
+Замеряет время и пиковую память для analyze_image_colors,
+calculate_normalized_brightness, get_smart_colors, hue_finele и четырёх
+sort_images_by_* на детерминированных синтетических изображениях
+(несколько размеров и палитр: gray, saturated, dark, mixed). Telegram не нужен:
+скачивание в сортировках подменяется выдачей заранее сжатых JPEG, а модули бота,
+которых нет в окружении (Telegram, Gemini, Firebase...), — заглушками, как в
+benchmark_feed.py. bot.py требует Python 3.12+.
+
+Заодно сверяет результаты всех функций со снимком — выходные данные должны
+совпасть с ним байт в байт. Эталон benchmark_colors_baseline.json в репозитории
+снят с кода до векторизации цветового анализа (тогда ещё целиком в bot.py),
+так что сверка проверяет именно переписанные функции.
+
+Использование:
+    python benchmark_colors.py                 # сравнить с эталоном
+    python benchmark_colors.py --threshold 0.3 # допустимое замедление — 30%
+    python benchmark_colors.py --save          # перезаписать эталон текущим кодом
+
+Код выхода 1 — регресс по времени/памяти сверх порога, расхождение результатов,
+нет файла эталона или сортировки не удалось замерить.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from PIL import Image
+
+# Отдельный кэш признаков, чтобы не трогать рабочий color_cache.sqlite3.
+# Должно быть выставлено до импорта color_analysis.
+_BENCH_DIR = tempfile.mkdtemp(prefix="color_bench_")
+os.environ.setdefault("COLOR_CACHE_PATH", os.path.join(_BENCH_DIR, "color_cache.sqlite3"))
+
+from benchmark_feed import stub_modules  # noqa: E402
+from color_analysis import (  # noqa: E402
+    analyze_image_colors,
+    calculate_normalized_brightness,
+    get_smart_colors,
+    get_smart_colors_batch,
+    hue_finele,
+    smart_color_inputs,
+)
+
+DEFAULT_BASELINE = "benchmark_colors_baseline.json"
+DEFAULT_THRESHOLD = 0.2  # 20% замедления или роста памяти — уже регресс
+MEMORY_FLOOR = 1024 * 1024  # Пик памяти меньше 1 МБ регрессом не считается (шум мелких аллокаций)
+# Пересчёт умных цветов архива замеряется на распределениях всех случаев, повторённых столько раз
+SMART_ARCHIVE_REPEAT = 20
+
+IMAGE_SIZES = ((150, 150), (640, 480), (1600, 1200))
+PALETTES = ("gray", "saturated", "dark", "mixed")
+HUE_CRITERIA = ("red", "orange", "yellow", "green", "cyan", "blue", "purple", "dark", "warm")
+# Зависимости bot.py и его модулей, не нужные сортировкам
+BOT_MODULES = (
+    "aiohttp", "bs4", "ddgs", "dotenv", "duckduckgo_search", "gallery_dl",
+    "google", "google.genai", "google.genai.types", "httpx", "huggingface_hub", "imagekitio",
+    "matplotlib", "matplotlib.offsetbox", "matplotlib.patches", "matplotlib.pyplot",
+    "pytz", "qrcode", "telegram", "telegram.constants", "telegram.error", "telegram.ext",
+    "telegram.helpers", "tweepy", "vk_api", "vk_api.utils", "wikipedia", "wikipediaapi",
+)
+SORT_CRITERIA = {
+    "sort_images_by_priority": ("light", "dark"),
+    "sort_images_by_hue": ("red", "blue"),
+    "sort_images_by_color_priority": ("light", "dark"),
+    "sort_images_by_warm": ("warm",),
+}
+
+
+def make_image(palette, size, seed):
+    """Детерминированное синтетическое изображение заданной палитры."""
+    width, height = size
+    rng = np.random.default_rng(seed)
+
+    if palette == "gray":
+        level = rng.integers(0, 256, (height, width, 1), dtype=np.uint8)
+        pixels = np.repeat(level, 3, axis=2)
+    elif palette == "saturated":
+        hsv = np.stack([
+            rng.integers(0, 256, (height, width), dtype=np.uint8),
+            rng.integers(200, 256, (height, width), dtype=np.uint8),
+            rng.integers(150, 256, (height, width), dtype=np.uint8),
+        ], axis=2)
+        return Image.fromarray(hsv, "HSV").convert("RGB")
+    elif palette == "dark":
+        pixels = rng.integers(0, 70, (height, width, 3), dtype=np.uint8)
+    elif palette == "mixed":
+        # Крупные цветные блоки поверх градиента с шумом — ближе к реальным фото
+        gradient = np.linspace(0, 255, width, dtype=np.float64)
+        pixels = np.empty((height, width, 3), dtype=np.float64)
+        pixels[...] = gradient[None, :, None]
+        for _ in range(12):
+            x0, y0 = rng.integers(0, width), rng.integers(0, height)
+            x1, y1 = x0 + rng.integers(width // 8, width // 2), y0 + rng.integers(height // 8, height // 2)
+            pixels[y0:y1, x0:x1] = rng.integers(0, 256, 3)
+        pixels += rng.normal(0, 12, pixels.shape)
+        pixels = np.clip(pixels, 0, 255).astype(np.uint8)
+    else:
+        raise ValueError(f"Неизвестная палитра: {palette}")
+
+    return Image.fromarray(pixels, "RGB")
+
+
+def build_cases():
+    """Все сочетания размер x палитра: (имя, изображение, JPEG-байты)."""
+    cases = []
+    for seed, (size, palette) in enumerate((s, p) for s in IMAGE_SIZES for p in PALETTES):
+        image = make_image(palette, size, seed)
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=90)
+        cases.append((f"{palette}_{size[0]}x{size[1]}", image, buffer.getvalue()))
+    return cases
+
+
+def measure(func, repeat, inner=1):
+    """
+    Лучшее время из repeat замеров (в каждом func вызывается inner раз)
+    и пиковая память (tracemalloc) отдельного запуска.
+    Возвращает (результат, секунды, байты).
+    """
+    result = func()  # прогрев
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(inner):
+            func()
+        best = min(best, time.perf_counter() - started)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, best, peak
+
+
+def to_snapshot(value):
+    """Нормализует результат к виду, который одинаково сохраняется и читается из JSON."""
+    return json.loads(json.dumps(value, sort_keys=True))
+
+
+def bench_analysis(cases, repeat):
+    results = {}
+    timings = {}
+    distributions = {}
+
+    def run_all():
+        return [analyze_image_colors(image, "red") for _, image, _ in cases]
+
+    outputs, seconds, peak = measure(run_all, repeat)
+    timings["analyze_image_colors"] = (seconds, peak)
+    for (name, _, _), output in zip(cases, outputs):
+        distributions[name] = output
+    results["analyze_image_colors"] = to_snapshot(distributions)
+
+    def run_brightness():
+        return {
+            name: calculate_normalized_brightness(b_dist, s_dist)
+            for name, (b_dist, s_dist, _) in distributions.items()
+        }
+
+    brightness, seconds, peak = measure(run_brightness, repeat, inner=1000)
+    timings["calculate_normalized_brightness"] = (seconds, peak)
+    results["calculate_normalized_brightness"] = to_snapshot(brightness)
+
+    smart = {
+        name: get_smart_colors(b_dist, s_dist, h_dist, brightness[name])
+        for name, (b_dist, s_dist, h_dist) in distributions.items()
+    }
+    results["get_smart_colors"] = to_snapshot({
+        name: {"colors": list(value[:3]), "dom_weights": value[4]} for name, value in smart.items()
+    })
+
+    # Одиночный get_smart_colors — обёртка над пакетной версией, ради которой он и переписан
+    # (пересчёт цветов всего архива), поэтому по времени сравнивается пакет изображений
+    archive = list(distributions.items()) * SMART_ARCHIVE_REPEAT
+
+    def run_smart_batch():
+        inputs = smart_color_inputs(
+            [dists[0] for _, dists in archive], [dists[1] for _, dists in archive],
+            [dists[2] for _, dists in archive], [brightness[name] for name, _ in archive],
+        )
+        return get_smart_colors_batch(inputs)
+
+    triples, seconds, peak = measure(run_smart_batch, repeat, inner=10)
+    timings["get_smart_colors_batch"] = (seconds, peak)
+    results["get_smart_colors_batch"] = to_snapshot(
+        {name: list(triple) for (name, _), triple in zip(archive, triples)}
+    )
+
+    def run_hue():
+        return {
+            name: {criterion: hue_finele(h_dist, criterion) for criterion in HUE_CRITERIA}
+            for name, (_, _, h_dist) in distributions.items()
+        }
+
+    hues, seconds, peak = measure(run_hue, repeat, inner=100)
+    timings["hue_finele"] = (seconds, peak)
+    results["hue_finele"] = to_snapshot(hues)
+
+    return results, timings
+
+
+def bench_sorters(cases, repeat):
+    """
+    Сортировки из bot.py целиком: кэш признаков -> «скачивание» -> пул процессов -> порядок.
+    Каждый запуск использует новые file_unique_id, поэтому кэш не срабатывает
+    и замеряется полный анализ. None — bot.py не импортируется даже с заглушками.
+    """
+    stub_modules(BOT_MODULES)
+    try:
+        import bot
+    except Exception as e:
+        print(f"❌ Не удалось импортировать bot.py для sort_images_by_*: {e!r}\n")
+        return None
+
+    payloads = {name: data for name, _, data in cases}
+
+    async def fake_download(session, url):
+        return payloads[url]
+
+    bot.download_image_bytes = fake_download
+
+    results = {}
+    timings = {}
+    run_counter = iter(range(10 ** 9))
+
+    for func_name, criteria in SORT_CRITERIA.items():
+        sorter = getattr(bot, func_name)
+
+        def run_all():
+            outputs = {}
+            run_id = next(run_counter)
+            for criterion in criteria:
+                media = [
+                    {"file_id": name, "file_unique_id": f"bench-{run_id}-{criterion}-{name}"}
+                    for name in payloads
+                ]
+                ordered = asyncio.run(sorter(media, criterion))
+                outputs[criterion] = [item["file_id"] for item in ordered]
+            return outputs
+
+        output, seconds, peak = measure(run_all, repeat)
+        timings[func_name] = (seconds, peak)
+        results[func_name] = to_snapshot(output)
+
+    return results, timings
+
+
+def compare(current, baseline, threshold):
+    """Печатает таблицу и возвращает список проблем (регрессы и расхождения)."""
+    problems = []
+    print(f"{'функция':<34}{'время, мс':>12}{'эталон':>12}{'память, КБ':>13}{'эталон':>12}")
+    for name, (seconds, peak) in current["timings"].items():
+        base = (baseline or {}).get("timings", {}).get(name)
+        base_seconds, base_peak = base if base else (None, None)
+        print(
+            f"{name:<34}{seconds * 1000:>12.2f}"
+            f"{(f'{base_seconds * 1000:.2f}' if base else '-'):>12}"
+            f"{peak / 1024:>13.1f}"
+            f"{(f'{base_peak / 1024:.1f}' if base else '-'):>12}"
+        )
+        if not base:
+            continue
+        if seconds > base_seconds * (1 + threshold):
+            problems.append(f"{name}: время {seconds * 1000:.2f} мс > эталона {base_seconds * 1000:.2f} мс")
+        if peak > max(base_peak * (1 + threshold), MEMORY_FLOOR):
+            problems.append(f"{name}: память {peak / 1024:.1f} КБ > эталона {base_peak / 1024:.1f} КБ")
+
+    if baseline:
+        for name, snapshot in current["snapshots"].items():
+            expected = baseline.get("snapshots", {}).get(name)
+            if expected is not None and expected != snapshot:
+                problems.append(f"{name}: результаты отличаются от эталонного снимка")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк цветового анализа и палитровой сортировки")
+    parser.add_argument("--save", action="store_true", help="записать текущие замеры и результаты как эталон")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="путь к файлу эталона")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="допустимый рост времени/памяти относительно эталона (0.2 = 20%%)")
+    parser.add_argument("--repeat", type=int, default=5, help="число замеров, берётся лучший")
+    parser.add_argument("--no-sort", action="store_true", help="не замерять sort_images_by_* из bot.py")
+    args = parser.parse_args()
+
+    cases = build_cases()
+    snapshots, timings = bench_analysis(cases, args.repeat)
+    sorters_failed = False
+    if not args.no_sort:
+        sorted_results = bench_sorters(cases, args.repeat)
+        if sorted_results is None:
+            sorters_failed = True
+        else:
+            snapshots.update(sorted_results[0])
+            timings.update(sorted_results[1])
+
+    current = {"timings": timings, "snapshots": snapshots}
+    if sorters_failed and args.save:
+        print("❌ Эталон не записан: без sort_images_by_* он неполный (или запустите с --no-sort)")
+        return 1
+
+    if args.save:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(current, f, ensure_ascii=False, indent=1, sort_keys=True)
+        compare(current, None, args.threshold)
+        print(f"\n💾 Эталон сохранён в {args.baseline}")
+        return 0
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    problems = compare(current, baseline, args.threshold)
+    if baseline is None:
+        problems.append(f"эталон {args.baseline} не найден (запишите его с --save)")
+    if sorters_failed:
+        problems.append("sort_images_by_* не замерены: bot.py не импортируется (или запустите с --no-sort)")
+    if problems:
+        print("\n❌ Обнаружены проблемы:")
+        for problem in problems:
+            print(f"  - {problem}")
+        return 1
+
+    print("\n✅ Регрессий нет")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
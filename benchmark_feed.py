@@ -0,0 +1,232 @@
+"""
+Бенчмарк синхронизации кэша art_posts по потоку изменений (art_posts_feed).
+
+Поднимает FakeFirebase с синтетическим архивом (корпус из benchmark_search)
+и гоняет настоящий кэш постов gpt_helper: db подменяется на FakeFirebase,
+канал подписывается start_posts_change_feed(reference=...), а правки пишутся
+в «базу» так же, как это делают бот и пересчёт цветов: пост целиком (set),
+поля через update с путями "post/field" (update_art_posts_fields), вложенные
+поля, удаления и новые посты. События применяют _replace_posts_cache
+и _patch_posts_cache вместе с патчем поискового индекса.
+
+Замеряет полную перезагрузку канала (как при опросе по TTL), начальную
+синхронизацию, задержку от записи до применения в кэше и получение индекса
+после правок. Проверяет, что при живой подписке опрос по TTL не запускается,
+а в конце сверяет кэш и индекс со снимком «базы» — расхождение означает
+ошибку синхронизации (код выхода 1).
+
+Telegram, Gemini и настоящий Firebase не нужны: модули, которых нет
+в окружении, подменяются пустыми заглушками (используется только кэш постов).
+
+Использование:
+    python benchmark_feed.py                      # 20k постов, 500 правок
+    python benchmark_feed.py --posts 20000 100000 --edits 2000
+"""
+import argparse
+import importlib.util
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import types
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "benchmark")
+os.environ.setdefault("ART_POSTS_SNAPSHOT_DIR", tempfile.mkdtemp(prefix="benchmark_feed_"))
+
+from art_posts_feed import FakeFirebase, posts_from_data  # noqa: E402
+from benchmark_search import COLORS, STYLES, VOCABULARY, make_corpus, percentile  # noqa: E402
+from gallery_search import GallerySearchIndex  # noqa: E402
+
+DEFAULT_SIZES = (20000,)
+DEFAULT_EDITS = 500
+CHANNEL = "@anemonn"
+
+# Зависимости бота, которые кэшу постов не нужны
+_BOT_MODULES = ("google", "google.genai", "google.genai.types", "aiohttp", "telegram", "telegram.ext")
+
+
+class _StubModule(types.ModuleType):
+    """
+    Заглушка модуля: любой атрибут — снова заглушка, вызов ничего не делает,
+    async with (например, aiohttp.ClientSession()) отдаёт её же.
+    """
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        value = _StubModule(f"{self.__name__}.{name}")
+        setattr(self, name, value)
+        return value
+
+    def __call__(self, *args, **kwargs):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+def _missing(name):
+    try:
+        return importlib.util.find_spec(name) is None
+    except ImportError:
+        return True
+
+
+def stub_modules(names):
+    """
+    Подменяет заглушками модули names, которых нет в окружении, и всегда — firebase_admin
+    (ключа сервиса нет; кому нужна база, подставляет FakeFirebase вместо db).
+    """
+    stubs = ["firebase_admin", "firebase_admin.credentials", "firebase_admin.db"]
+    stubs += [name for name in names if _missing(name.split(".")[0]) or _missing(name)]
+    for name in stubs:
+        sys.modules[name] = _StubModule(name)
+
+
+def load_gpt_helper():
+    """Импортирует настоящий gpt_helper (недостающие модули бота — заглушки)."""
+    stub_modules(_BOT_MODULES)
+    import gpt_helper
+    return gpt_helper
+
+
+def make_edits(size, count, seed):
+    """Смесь правок: (вид, функция записи write(reference канала, gpt_helper))."""
+    rng = random.Random(seed)
+    next_id = [size]
+
+    def words(n):
+        return " ".join(rng.choice(VOCABULARY) for _ in range(n))
+
+    edits = []
+    for _ in range(count):
+        kind = rng.choices(("set", "fields", "nested", "delete", "new"), weights=(3, 4, 2, 1, 1))[0]
+        post_id = rng.randrange(size)
+        if kind == "set":
+            data = {
+                "status": "ok", "type": "photo", "file_id": f"file-{post_id}", "channel_id": "@anemonn",
+                "date": 1_600_000_000 + post_id * 3600, "caption": words(3), "ai_des_ru": words(12),
+                "ai_style_ru": rng.choice(STYLES),
+                "analysis": {"br": 0.5, "sat": 0.5, "dom_color": rng.choice(COLORS)},
+            }
+            edits.append((kind, lambda ref, helper, p=post_id, d=data: ref.child(str(p)).set(d)))
+        elif kind == "fields":
+            # Как /recolor: запись в базу и патч своего кэша, событие потока — эхо
+            fields = {"caption": words(2), "ai_style_ru": rng.choice(STYLES)}
+            edits.append((kind, lambda ref, helper, p=post_id, f=fields: helper.update_art_posts_fields(CHANNEL, {p: f})))
+        elif kind == "nested":
+            color = rng.choice(COLORS)
+            edits.append((kind, lambda ref, helper, p=post_id, c=color: ref.child(f"{p}/analysis/dom_color").set(c)))
+        elif kind == "delete":
+            edits.append((kind, lambda ref, helper, p=post_id: ref.child(str(p)).delete()))
+        else:
+            post_id = next_id[0]
+            next_id[0] += 1
+            data = {"status": "ok", "type": "photo", "file_id": f"file-{post_id}", "caption": words(4),
+                    "date": 1_600_000_000 + post_id * 3600, "analysis": {"br": 0.6}}
+            edits.append((kind, lambda ref, helper, p=post_id, d=data: ref.child(str(p)).set(d)))
+    return edits
+
+
+def wait_synced(feed, timeout=60.0):
+    """Ждёт первого события подписки (полный снимок канала)."""
+    deadline = time.monotonic() + timeout
+    while not feed.live:
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.001)
+    return True
+
+
+def bench_size(size, args, helper):
+    print(f"\n=== {size} постов, {args.edits} правок ===")
+    corpus = make_corpus(size, args.seed)
+    channel = {str(post.pop("post_id")): post for post in corpus}
+    firebase = FakeFirebase({"art_posts": {"anemonn": channel}})
+    helper.db = types.SimpleNamespace(reference=firebase.reference)
+    ref = firebase.reference("art_posts/anemonn")
+    helper.reset_posts_cache(CHANNEL)
+
+    def metrics():
+        return helper.get_posts_cache_metrics()["channels"]["anemonn"]
+
+    started = time.perf_counter()
+    helper.get_art_posts_index(CHANNEL)
+    print(f"полная перезагрузка (опрос по TTL): {(time.perf_counter() - started) * 1000:.1f} мс")
+
+    started = time.perf_counter()
+    feed = helper.start_posts_change_feed(CHANNEL, reference=ref)
+    if not wait_synced(feed):
+        print("❌ Подписка не получила снимок канала")
+        helper.stop_posts_change_feed(CHANNEL)
+        return False
+    firebase.wait_idle()
+    helper.get_art_posts_index(CHANNEL)  # Снимок из подписки заменил посты — индекс собирается заново
+    print(f"начальная синхронизация с индексом: {(time.perf_counter() - started) * 1000:.1f} мс")
+
+    # При живой подписке устаревший кэш не перечитывается из базы
+    helper.POSTS_CACHE_TTLS["anemonn"] = 0
+    before = metrics()
+    helper.get_all_art_posts_cached(CHANNEL)
+    after = metrics()
+    helper.POSTS_CACHE_TTLS.pop("anemonn", None)
+    ttl_skipped = not after["refreshing"] and after["stale_served"] == before["stale_served"]
+    print(f"опрос по TTL при живой подписке: {'пропущен' if ttl_skipped else 'ЗАПУЩЕН'}")
+
+    base = metrics()
+    latencies = {}
+    for kind, write in make_edits(size, args.edits, args.seed):
+        started = time.perf_counter()
+        write(ref, helper)
+        firebase.wait_idle()  # Событие доставлено и применено к кэшу
+        latencies.setdefault(kind, []).append((time.perf_counter() - started) * 1000)
+
+    print(f"{'правка':<10}{'n':>6}{'p50, мс':>10}{'p95, мс':>10}{'max, мс':>10}")
+    for kind, values in latencies.items():
+        print(f"{kind:<10}{len(values):>6}{percentile(values, 0.5):>10.3f}"
+              f"{percentile(values, 0.95):>10.3f}{max(values):>10.3f}")
+
+    started = time.perf_counter()
+    search_index = helper.get_art_posts_index(CHANNEL)
+    elapsed = (time.perf_counter() - started) * 1000
+    done = metrics()
+    print(
+        f"индекс после правок: {elapsed:.1f} мс (патчей индекса: {done['index_patches'] - base['index_patches']}, "
+        f"полных сборок: {done['index_builds'] - base['index_builds']})"
+    )
+    print(f"событий: {feed.events}, ошибок: {feed.errors}")
+    helper.stop_posts_change_feed(CHANNEL)
+
+    expected = sorted(posts_from_data(ref.get()), key=lambda post: post["post_id"])
+    actual = sorted(helper.get_all_art_posts_cached(CHANNEL), key=lambda post: post["post_id"])
+    rebuilt = GallerySearchIndex(search_index.posts)
+    index_ok = all(
+        list(search_index.match(word)) == list(rebuilt.match(word)) for word in VOCABULARY + list(STYLES)
+    )
+    if expected != actual or feed.errors or not index_ok or not ttl_skipped:
+        print("❌ Кэш разошёлся со снимком базы" if index_ok else "❌ Индекс разошёлся с полной сборкой")
+        return False
+    print("✅ Кэш и индекс совпадают со снимком базы")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк синхронизации кэша art_posts по потоку изменений")
+    parser.add_argument("--posts", type=int, nargs="+", default=list(DEFAULT_SIZES), help="размеры корпуса")
+    parser.add_argument("--edits", type=int, default=DEFAULT_EDITS, help="число правок")
+    parser.add_argument("--seed", type=int, default=1, help="зерно генератора корпуса и правок")
+    args = parser.parse_args()
+
+    helper = load_gpt_helper()
+    logging.disable(logging.INFO)
+    ok = all([bench_size(size, args, helper) for size in args.posts])
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,215 @@
+"""
+Бенчмарк /api/anemone/search на синтетическом архиве art_posts.
+
+Генерирует детерминированный корпус постов заданного размера (подписи,
+AI-описания и стили из общего словаря, цвета и яркость как у color_analysis)
+и прогоняет через тестовый клиент Flask смесь запросов: текст, BM25,
+опечатки, цвет, фильтры, similar_to и листание курсором. Для каждого типа
+печатает p50/p95/max задержки и средние времена этапов из Server-Timing.
+
+Firebase не нужен: вместо gpt_helper подключается источник индекса
+по синтетическому корпусу.
+
+Использование:
+    python benchmark_search.py                       # 20k постов
+    python benchmark_search.py --posts 20000 100000  # несколько размеров
+    python benchmark_search.py --requests 100 --warm # без сброса кэша выдач
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+import types
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "benchmark")
+
+from gallery_search import GallerySearchIndex  # noqa: E402
+
+DEFAULT_SIZES = (20000,)
+DEFAULT_REQUESTS = 50  # запросов каждого типа
+
+COLORS = ("red", "orange", "yellow", "green", "cyan", "blue", "purple", "black", "white", "gray")
+STYLES = ("Масло", "Акрил", "Акварель", "Digital Art", "Скетч", "Пастель", "Тушь", "Гуашь")
+VOCABULARY = (
+    "кот кошка кошки котёнок дом дома домик море морской волна небо облака закат рассвет "
+    "лес лесной дерево ёлка сосна лиса лисица заяц птица ворона девушка портрет лицо руки "
+    "цветы цветок роза букет город улица ночь фонарь дождь снег зима весна лето осень "
+    "горы река озеро мост окно чашка чай книга свеча луна звёзды космос дракон замок"
+).split()
+TYPOS = ("кошкп", "акварль", "портерт", "лесноы", "небеас", "дерево", "закта", "фонрь")
+
+
+def make_corpus(size, seed):
+    """Детерминированный корпус постов в формате art_posts."""
+    rng = random.Random(seed)
+    start = 1_600_000_000
+    posts = []
+    for post_id in range(size):
+        analysis = {
+            "br": round(rng.uniform(0.45, 0.8), 3),
+            "sat": round(rng.random(), 3),
+            "dom_color": rng.choice(COLORS),
+            "sec_color": rng.choice(COLORS),
+            "ter_color": rng.choice(COLORS),
+        }
+        posts.append({
+            "post_id": post_id,
+            "status": "ok" if rng.random() < 0.97 else "error",
+            "type": "photo" if rng.random() < 0.95 else "text",
+            "file_id": f"file-{post_id}",
+            "channel_id": "@anemonn",
+            "date": start + post_id * 3600 + rng.randint(0, 3599),
+            "caption": " ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(0, 6))),
+            "ai_des_ru": " ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(8, 25))),
+            "ai_style_ru": rng.choice(STYLES),
+            "analysis": analysis,
+        })
+    return posts
+
+
+def install_corpus(posts, version=1):
+    """
+    Подменяет gpt_helper модулем, отдающим индекс по синтетическому корпусу.
+    version — версия кэша постов: у каждого корпуса своя, иначе кэш выдач
+    отдаст документы предыдущего корпуса.
+    """
+    index = GallerySearchIndex(posts, version=version)
+    module = types.ModuleType("gpt_helper")
+    module.get_art_posts_index = lambda channel_id: index
+    module.get_all_art_posts_cached = lambda channel_id: posts
+    module.is_valid_channel_id = lambda channel_id: True
+    sys.modules["gpt_helper"] = module
+    return index
+
+
+def query_mix(size, count, seed):
+    """{тип запроса: [параметры, ...]} — детерминированная смесь запросов."""
+    rng = random.Random(seed)
+
+    def words(n):
+        return " ".join(rng.choice(VOCABULARY) for _ in range(n))
+
+    return {
+        "text": [{"q": words(rng.randint(1, 2))} for _ in range(count)],
+        "relevance": [{"q": words(rng.randint(1, 3)), "sort": "relevance"} for _ in range(count)],
+        "typo": [{"q": rng.choice(TYPOS)} for _ in range(count)],
+        "color": [{"color": rng.choice(COLORS)} for _ in range(count)],
+        "filters": [{
+            "dom_color": rng.choice(COLORS),
+            "br_min": "0.2", "br_max": "0.9",
+            "sat_min": f"{rng.uniform(0, 0.5):.2f}",
+            "date_from": "2021-01-01",
+        } for _ in range(count)],
+        "text+color": [{"q": words(1), "color": rng.choice(COLORS)} for _ in range(count)],
+        "similar_to": [{"similar_to": str(rng.randrange(size))} for _ in range(count)],
+        "default": [{} for _ in range(count)],
+    }
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def parse_server_timing(header):
+    stages = {}
+    for part in filter(None, (p.strip() for p in (header or "").split(","))):
+        name, _, duration = part.partition(";dur=")
+        if duration:
+            stages[name] = float(duration)
+    return stages
+
+
+def run_requests(client, params_list, limit, reset_results):
+    """Задержки (мс) и суммы этапов Server-Timing по списку запросов."""
+    import background
+
+    latencies = []
+    stage_totals = {}
+    for params in params_list:
+        if reset_results:
+            background.SEARCH_RESULTS_CACHE.clear()
+        started = time.perf_counter()
+        response = client.get("/api/anemone/search", query_string=dict(params, limit=limit))
+        latencies.append((time.perf_counter() - started) * 1000)
+        if response.status_code != 200:
+            raise RuntimeError(f"{params}: HTTP {response.status_code}")
+        for name, ms in parse_server_timing(response.headers.get("Server-Timing")).items():
+            stage_totals[name] = stage_totals.get(name, 0.0) + ms
+    return latencies, stage_totals
+
+
+def run_scroll(client, params_list, limit, pages):
+    """Листание курсором: первая страница + pages следующих, замеряются только следующие."""
+    latencies = []
+    stage_totals = {}
+    for params in params_list:
+        cursor = client.get("/api/anemone/search", query_string=dict(params, limit=limit)).get_json()["cursor"]
+        for _ in range(pages):
+            if not cursor:
+                break
+            started = time.perf_counter()
+            response = client.get("/api/anemone/search", query_string=dict(params, limit=limit, cursor=cursor))
+            latencies.append((time.perf_counter() - started) * 1000)
+            cursor = response.get_json()["cursor"]
+            for name, ms in parse_server_timing(response.headers.get("Server-Timing")).items():
+                stage_totals[name] = stage_totals.get(name, 0.0) + ms
+    return latencies, stage_totals
+
+
+def report(name, latencies, stage_totals):
+    stages = " ".join(
+        f"{stage}={ms / len(latencies):.2f}" for stage, ms in stage_totals.items() if stage != "total"
+    )
+    print(
+        f"{name:<14}{len(latencies):>6}{percentile(latencies, 0.5):>10.2f}"
+        f"{percentile(latencies, 0.95):>10.2f}{max(latencies):>10.2f}   {stages}"
+    )
+
+
+def bench_size(size, args, version=1):
+    print(f"\n=== {size} постов ===")
+    started = time.perf_counter()
+    posts = make_corpus(size, args.seed)
+    generated = time.perf_counter()
+    install_corpus(posts, version)
+    print(f"корпус: {generated - started:.2f} с, индекс: {time.perf_counter() - generated:.2f} с")
+
+    import background
+    background.SEARCH_RESULTS_CACHE.clear()  # Выдачи предыдущего размера к этому корпусу не относятся
+    client = background.app.test_client()
+    mix = query_mix(size, args.requests, args.seed)
+
+    print(f"{'тип':<14}{'n':>6}{'p50, мс':>10}{'p95, мс':>10}{'max, мс':>10}   этапы (среднее, мс)")
+    for name, params_list in mix.items():
+        client.get("/api/anemone/search", query_string=dict(params_list[0], limit=args.limit))  # прогрев
+        latencies, stage_totals = run_requests(client, params_list, args.limit, not args.warm)
+        report(name, latencies, stage_totals)
+
+    latencies, stage_totals = run_scroll(client, mix["text"][:10] + mix["default"][:5], args.limit, args.pages)
+    if latencies:
+        report("scroll", latencies, stage_totals)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк /api/anemone/search на синтетическом архиве")
+    parser.add_argument("--posts", type=int, nargs="+", default=list(DEFAULT_SIZES), help="размеры корпуса")
+    parser.add_argument("--requests", type=int, default=DEFAULT_REQUESTS, help="запросов каждого типа")
+    parser.add_argument("--limit", type=int, default=20, help="размер страницы (как в gallery.js)")
+    parser.add_argument("--pages", type=int, default=5, help="страниц курсором в режиме scroll")
+    parser.add_argument("--seed", type=int, default=1, help="зерно генератора корпуса и запросов")
+    parser.add_argument("--warm", action="store_true",
+                        help="не сбрасывать кэш выдач между запросами (повторные запросы — из кэша)")
+    args = parser.parse_args()
+
+    # Построчный лог каждого запроса только мешает таблице
+    logging.disable(logging.INFO)
+    for version, size in enumerate(args.posts, start=1):
+        bench_size(size, args, version)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -13764,6 +13764,8 @@ async def publish_to_telegram_scheduled(context: CallbackContext):
                 'channel_id': str(chat_id),
                 'message_id': new_post_id,
                 'file_id': new_file_id,
+                'file_unique_id': best_photo.file_unique_id,
+                'analysis_file_id': select_analysis_photo(msg.photo, 'fast').file_id,
                 'caption': post_caption,
                 'date_timestamp': post_date,
                 'original_link': main_original_link
@@ -14978,6 +14980,8 @@ async def handle_publish_button(update: Update, context: CallbackContext) -> Non
                         'channel_id': str(chat_id),
                         'message_id': new_post_id,
                         'file_id': new_file_id,
+                        'file_unique_id': best_photo.file_unique_id,
+                        'analysis_file_id': select_analysis_photo(msg.photo, 'fast').file_id,
                         'caption': post_caption,
                         'date_timestamp': post_date,
                         'original_link': main_original_link
@@ -15943,20 +15947,21 @@ import requests
 from PIL import Image
 from io import BytesIO
 import numpy as np
-from colorsys import rgb_to_hsv
 
 
 
 
 
-async def download_image(session, url):
+async def download_image_bytes(session, url):
     async with session.get(url) as response:
         if response.status == 200:
-            data = await response.read()
-            return Image.open(BytesIO(data))
+            return await response.read()
         else:
             raise Exception(f"Failed to download image: {url}")
 
+async def download_image(session, url):
+    return Image.open(BytesIO(await download_image_bytes(session, url)))
+
 async def download_images(image_urls):
     async with aiohttp.ClientSession() as session:
         tasks = [download_image(session, url) for url in image_urls]
@@ -15985,414 +15990,118 @@ SORT_OPTIONS = [
 
 
 
-def analyze_image_colors(image, criterion):
-    """
-    Анализирует изображение и возвращает распределения.
-    """
-    img = image.convert('RGB').resize((150, 150), Image.Resampling.LANCZOS)
-    arr = np.array(img).reshape(-1, 3)
-    hsv_pixels = [rgb_to_hsv(r / 255, g / 255, b / 255) for r, g, b in arr]
-    total_pixels = len(hsv_pixels)
-
-    # --- ТОЧНЫЙ ПОПИКСЕЛЬНЫЙ АНАЛИЗ АХРОМАТИКИ ---
-    # Белый: строго ВЫСОКАЯ яркость (>= 0.75) И НИЗКАЯ насыщенность (< 0.3)
-    exact_white_pixels = sum(1 for _, s, v in hsv_pixels if v >= 0.75 and s < 0.3)
-    # Черный: строго НИЗКАЯ яркость (< 0.33)
-    exact_black_pixels = sum(1 for _, _, v in hsv_pixels if v < 0.33)
-    # Серый: средняя яркость и низкая насыщенность
-    exact_gray_pixels = sum(1 for _, s, v in hsv_pixels if 0.33 <= v < 0.75 and s < 0.3)
-
-
-    dark_high_sat_pixels = sum(1 for _, s, v in hsv_pixels if v < 0.33 and s >= 0.3)
-    bright_high_sat_pixels = sum(1 for _, s, v in hsv_pixels if v >= 0.75 and s >= 0.3)
-
-    dark_low_sat_pixels = sum(1 for _, s, v in hsv_pixels if v < 0.33 and s < 0.3)
-    bright_low_sat_pixels = sum(1 for _, s, v in hsv_pixels if v >= 0.75 and s < 0.3)
-
-
-    # Глобальный анализ яркости
-    brightness = [v for _, _, v in hsv_pixels]
-    dark_pixels = sum(1 for v in brightness if v < 0.33)
-    medium_pixels = sum(1 for v in brightness if 0.33 <= v < 0.75)
-    bright_pixels = sum(1 for v in brightness if v >= 0.75)
-    total_brightness = sum(brightness) / len(brightness)
-    total_bright = 1 - total_brightness
-
-    brightness_distribution = {
-        "dark": dark_pixels / total_pixels,
-        "medium": medium_pixels / total_pixels,
-        "bright": bright_pixels / total_pixels,
-        "total_bright": total_bright,
-        # Прокидываем точные попиксельные пересечения наружу
-        "exact_white": exact_white_pixels / total_pixels,
-        "exact_black": exact_black_pixels / total_pixels,
-        "exact_gray": exact_gray_pixels / total_pixels,
-        "dark_high_sat": dark_high_sat_pixels / total_pixels,
-        "bright_high_sat": bright_high_sat_pixels / total_pixels,
-        "dark_low_sat": dark_low_sat_pixels / total_pixels,
-        "bright_low_sat": bright_low_sat_pixels / total_pixels,
-    }
-
-    # Анализ насыщенности
-    saturation = [s for _, s, _ in hsv_pixels]
-    gray_pixels = sum(1 for s in saturation if s < 0.3)
-    medium_saturation_pixels = sum(1 for s in saturation if 0.3 <= s < 0.75)
-    high_saturation_pixels = sum(1 for s in saturation if s >= 0.75)
-
-    saturation_distribution = {
-        "gray": gray_pixels / total_pixels,
-        "medium": medium_saturation_pixels / total_pixels,
-        "high": high_saturation_pixels / total_pixels,
-    }
+# Цветовой анализ вынесен в color_analysis (векторизован на NumPy)
+from color_analysis import (
+    analyze_image_colors,
+    hue_finele,
+    calculate_normalized_brightness,
+    gaussian_weight,
+    get_smart_colors,
+    ImageColorFeatures,
+    get_feature_cache,
+    feature_cache_key,
+    select_analysis_photo,
+    analyze_images_colors_batch,
+)
 
-    # Анализ оттенков
-    hue_distribution = {
-        "red": [0, 0, 0, 0, 0, 0],  # [hv, mv, lv, hs, ms, ls]
-        "orange": [0, 0, 0, 0, 0, 0],
-        "yellow": [0, 0, 0, 0, 0, 0],
-        "green": [0, 0, 0, 0, 0, 0],
-        "cyan": [0, 0, 0, 0, 0, 0],
-        "blue": [0, 0, 0, 0, 0, 0],
-        "purple": [0, 0, 0, 0, 0, 0],
-    }
-    color_boundaries = {
-        "red": (340 / 360, 5 / 360),
-        "orange": (5/ 360, 45 / 360),
-        "yellow": (45 / 360, 75 / 360),  
-        "green": (75 / 360, 170 / 360),  
-        "cyan": (170 / 360, 200 / 360),
-        "blue": (200 / 360, 250 / 360),
-        "purple": (250 / 360, 340 / 360),
-    }
 
 
 
 
 
-    overlap_margin = 10 / 360  # Граница перекрытия в градусах (5°)
 
-    for h, s, v in hsv_pixels:
-        for color, (lower, upper) in color_boundaries.items():
-            is_in_range = lower <= h < upper or (lower > upper and (h >= lower or h < upper))
-            is_in_overlap = (lower - overlap_margin <= h < lower) or (upper <= h < upper + overlap_margin)
 
-            if is_in_range or is_in_overlap:
-                index = 0 if v >= 0.66 else 1 if v >= 0.33 else 2
-                hue_distribution[color][index] += 1
 
-                sat_index = 3 if s >= 0.5 else 4 if s >= 0.2 else 5
-                hue_distribution[color][sat_index] += 1
+# Ширина конвейера сортировки: одновременных скачиваний и обработчиков анализа.
+# Пиковая память ограничена числом изображений «в полёте», а не размером поста.
+SORT_DOWNLOAD_CONCURRENCY = 4
+SORT_ANALYSIS_WORKERS = 2
 
-    hue_distribution = {
-        color: {
-            "hv": round(100 * hv / total_pixels, 2),
-            "mv": round(100 * mv / total_pixels, 2),
-            "lv": round(100 * lv / total_pixels, 2),
-            "hs": round(100 * hs / total_pixels, 2),
-            "ms": round(100 * ms / total_pixels, 2),
-            "ls": round(100 * ls / total_pixels, 2),
-        }
-        for color, (hv, mv, lv, hs, ms, ls) in hue_distribution.items()
-    }
 
-    # Расчёт веса
-    for color, data in hue_distribution.items():
-        brightness_weight = (
-            -3.0 * brightness_distribution["dark"] +
-            2.0 * brightness_distribution["medium"] +
-            0.5 * brightness_distribution["bright"]
-        )
-        saturation_weight = (
-            -3.0 * saturation_distribution["gray"] +
-            1.0 * saturation_distribution["medium"] +
-            3.0 * saturation_distribution["high"]
-        )
-        
-        if brightness_distribution["bright"] > 0.8:
-            saturation_weight += 1.5 * saturation_distribution["gray"]
-            data["ls"], data["ms"] = -0.2 * data["ls"], 3.0 * data["ms"]
-            
-        if saturation_distribution["gray"] > 0.85:
-            if brightness_distribution["dark"] > 0.3 and brightness_distribution["bright"] < 0.7:
-                data["hs"], data["ms"], data["ls"] = (
-                    16.0 * data["hs"],
-                    15.0 * data["ms"],
-                    0.5 * data["ls"]
-                )
-                
-        color_mass = data["hs"] + data["ms"] + data["ls"]
-        
-        # ИСПРАВЛЕНИЕ 1: Снижаем порог отсечения мелких деталей до 0.2%
-        if color_mass < 0.2:
-            data["tw"] = 0
-            continue
-
-        global_bonus = (brightness_weight + saturation_weight)
-        
-        # ИСПРАВЛЕНИЕ 2: Защищаем цвет от влияния серого фона.
-        # Если фон депрессивный (global_bonus < 0), мы не штрафуем цвет, 
-        # а наоборот, даем небольшой бонус за его собственную насыщенность (hs, ms)
-        if global_bonus < 0:
-            color_bonus = (data["hs"] * 1.5 + data["ms"] * 0.5) 
-        else:
-            color_bonus = global_bonus * (color_mass / 100.0)
-
-        # ИСПРАВЛЕНИЕ 3: Смягчаем штрафы за "тёмность" цвета (-2 * lv заменено на -0.5 * lv)
-        # Шарф в тенях все еще должен оставаться красным.
-        data["tw"] = round(max(0, (
-            5.0 * data["hs"] + 3.0 * data["ms"] + 0.5 * data["ls"] + 
-            2.0 * data["mv"] - 0.5 * data["lv"] + 
-            10.0 * color_bonus
-        )), 2)
-
-    # Проверка, если все значения tw равны 0
-    # Проверка, если все значения tw равны 0
-    if all(data["tw"] == 0 for data in hue_distribution.values()):
-        for color, data in hue_distribution.items():
-            # Собираем значения hs, ms, ls
-            values = [data["hs"], data["ms"], data["ls"]]
-            
-            # Проверяем наличие положительных значений
-            positive_values = [v for v in values if v > 0]
-            
-            if positive_values:
-                # Если есть положительные значения, берём максимальное из них
-                data["tw"] = max(positive_values)
-            else:
-                # Если все значения отрицательные, берём наименьшее по модулю (наибольшее отрицательное) и делаем его положительным
-                data["tw"] = abs(min(values))
-
-    return brightness_distribution, saturation_distribution, hue_distribution
-
-def hue_finele(hue_distribution, criterion):
+async def analyze_media_features(media, mode=None, on_progress=None):
     """
-    Вычисляет итоговый оттенок (hue) изображения на основе данных распределения оттенков.
-
-    :param hue_distribution: Словарь с данными о распределении оттенков.
-    :param criterion: Критерий, к которому будет ближе финальный оттенок.
-    :return: Финальное значение оттенка (hue) изображения.
+    Возвращает ImageColorFeatures для каждого изображения поста.
+    Признаки сначала ищутся в постоянном кэше (по file_unique_id), и только
+    для отсутствующих изображения скачиваются и анализируются.
+    Все критерии сортировки работают поверх этих признаков.
+
+    Скачивание и анализ идут конвейером: загрузки (не больше
+    SORT_DOWNLOAD_CONCURRENCY одновременно) складываются в ограниченную очередь,
+    из которой обработчики отправляют байты в пул процессов. Байты изображения
+    освобождаются сразу после извлечения признаков.
+
+    :param mode: Режим декодирования "exact" или "fast" (см. color_analysis.ANALYSIS_MODES).
+    :param on_progress: Необязательная корутина on_progress(done, total),
+                        вызывается по мере готовности изображений.
+    :return: Список пар (item, features).
     """
-    # Отбираем топ-3 цвета по значению tw
-    top_colors = sorted(
-        ((color, data["tw"]) for color, data in hue_distribution.items() if data["tw"] > 0),
-        key=lambda x: x[1],
-        reverse=True
-    )[:3]
-
-
-    if len(top_colors) < 1:
-        return None  # Если нет данных о цветах, возвращаем None
-
-    # Определение hue для каждого цвета
-    hue_positions = {
-        "red": 0,
-        "orange": 30,
-        "yellow": 60,
-        "green": 130,
-        "cyan": 180,
-        "blue": 230,
-        "purple": 280
-    }
-
-    # Проверка и обработка criterion
-    if criterion in ["dark", "light"]:
-
-        hue_criterion = None  # Устанавливаем в None, чтобы избежать ошибок
-    elif criterion in ["saturated", "desaturated", "warm"]:
-
-        hue_criterion = hue_positions["red"]
-    else:
-        if criterion not in hue_positions:
-            raise ValueError(f"🚫 Неверный критерий сортировки: {criterion}")
-        hue_criterion = hue_positions[criterion]
-
-
-    # Проверяем разницу между первыми двумя цветами
-    if hue_criterion is not None and len(top_colors) > 1 and (
-        abs(top_colors[0][1] - top_colors[1][1]) <= 20 or top_colors[1][1] > 150
-    ):
-        # Определяем ближайший к hue_criterion
-        color1, value1 = top_colors[0]
-        color2, value2 = top_colors[1]
-        hue1 = hue_positions[color1]
-        hue2 = hue_positions[color2]
-
-        # Вычисляем расстояния до hue_criterion
-        dist1 = abs((hue1 - hue_criterion) % 360)
-        dist2 = abs((hue2 - hue_criterion) % 360)
-        if dist1 > 180:
-            dist1 = 360 - dist1
-        if dist2 > 180:
-            dist2 = 360 - dist2
-
-        # Определяем базовый цвет по близости к hue_criterion
-        if dist1 <= dist2:
-            base_color, base_value = color1, value1
-            secondary_color = (color2, value2)
-        else:
-            base_color, base_value = color2, value2
-            secondary_color = (color1, value1)
-
-        # Перемещаем второй цвет в логику обработки дополнительных цветов
-        additional_colors = [secondary_color] + top_colors[2:]
-    else:
-        base_color, base_value = top_colors[0]
-        additional_colors = top_colors[1:]
-
-    base_hue = hue_positions[base_color]
-
-    # Учитываем вес базового цвета на основе значения tw
-    base_weight = base_value / 1000  # Нормализуем вес в диапазоне [0, 1]
-
-
-    # Обработка дополнительных цветов
-    adjustments = []
-    for color, value in additional_colors:
-        if color in hue_positions:
-            delta_hue = (hue_positions[color] - base_hue) % 360
-            if delta_hue > 180:
-                delta_hue -= 360  # Приведение к диапазону [-180, 180]
-
-            # Определяем делитель для расчёта shift_degree
-            divisor = 100 if value > base_value + 100 else 10
-
-            # Рассчитываем градус смещения с учетом tw
-            shift_degree = (value / divisor) * (1 - base_weight * 0.35)  # Вес базового цвета уменьшает влияние других цветов
-            adjustments.append((delta_hue, shift_degree))
-
-    # Если оба смещения направлены в одну сторону, учитываем только первое
-    if len(adjustments) > 1:
-        if all(adj[0] > 0 for adj in adjustments) or all(adj[0] < 0 for adj in adjustments):
-            adjustments = [max(adjustments, key=lambda x: abs(x[1]))]
-
-    # Применяем корректировку
-    final_hue_adjustment = sum(delta * (weight / abs(delta)) for delta, weight in adjustments)
-    final_hue = (base_hue + final_hue_adjustment) % 360
-    return round(final_hue, 2)
-
-
-
-
-
-
-import math
-
-def calculate_normalized_brightness(brightness_distribution, saturation_distribution):
-    # Веса для распределений яркости
-    brightness_weights = {
-        "dark": 0.3,       # Уменьшаем итоговое значение
-        "medium": 0.2,      # Нейтральное влияние
-        "bright": -0.1      # Увеличиваем итоговое значение
-    }
-    # Веса для распределений насыщенности
-    saturation_weights = {
-        "gray": -0.1,        # Увеличиваем итоговое значение (считаем серость ярче)
-        "medium": 0.2,      # Нейтральное влияние
-        "high": 0.3        # Уменьшаем итоговое значение (высокая насыщенность воспринимается темнее)
-    }
-
-    # Рассчитываем взвешенную сумму яркости
-    weighted_brightness = sum(
-        brightness_distribution[key] * weight
-        for key, weight in brightness_weights.items()
-    )
-    # Рассчитываем взвешенную сумму насыщенности
-    weighted_saturation = sum(
-        saturation_distribution[key] * weight
-        for key, weight in saturation_weights.items()
-    )
-
-    # Сумма всех весов
-    total_weights_sum = sum(brightness_weights.values()) + sum(saturation_weights.values())
-
-    # Итоговая нормализованная яркость
-    raw_brightness = (brightness_distribution["total_bright"] + weighted_brightness + weighted_saturation) * total_weights_sum
-
-    # Применяем логистическую функцию для экспоненциальной нормализации
-    def logistic_function(x):
-        return 1 / (1 + math.exp(-x))
+    items = [item for item in media if 'file_id' in item]
+    cache = get_feature_cache()
+    # SQLite — в отдельном потоке, чтобы не блокировать цикл событий
+    features = await asyncio.to_thread(cache.get_many, [feature_cache_key(item) for item in items], mode)
+    missing = [i for i, f in enumerate(features) if f is None]
+
+    total = len(items)
+    done = total - len(missing)
+    if on_progress:
+        await on_progress(done, total)
+
+    if missing:
+        queue = asyncio.Queue(maxsize=SORT_ANALYSIS_WORKERS)
+        download_slots = asyncio.Semaphore(SORT_DOWNLOAD_CONCURRENCY)
+
+        async def producer(session, i):
+            # Слот освобождается только когда байты переданы в очередь: пока обработчики
+            # отстают, новые скачивания ждут, и в памяти не больше
+            # SORT_DOWNLOAD_CONCURRENCY + размер очереди + SORT_ANALYSIS_WORKERS изображений
+            async with download_slots:
+                data = await download_image_bytes(session, items[i]['file_id'])
+                await queue.put((i, data))
+
+        async def consumer():
+            nonlocal done
+            while True:
+                i, data = await queue.get()
+                try:
+                    # Анализ пикселей идёт в пуле процессов, цикл событий только ждёт результат
+                    item_features = (await analyze_images_colors_batch([data], mode))[0]
+                    del data
+                    if item_features is not None:
+                        features[i] = item_features
+                        await asyncio.to_thread(cache.put, feature_cache_key(items[i]), item_features, mode)
+                    done += 1
+                    if on_progress:
+                        await on_progress(done, total)
+                finally:
+                    queue.task_done()
 
-    # Ограничиваем значение в пределах от 0 до 1
-    normalized_brightness = logistic_function(raw_brightness)
-    normalized_brightness = max(0, min(1, normalized_brightness))
+        async with aiohttp.ClientSession() as session:
+            consumers = [asyncio.create_task(consumer()) for _ in range(SORT_ANALYSIS_WORKERS)]
+            producers = [asyncio.create_task(producer(session, i)) for i in missing]
+            try:
+                # Скачивание изображений асинхронно
+                try:
+                    await asyncio.gather(*producers)
+                except Exception as e:
+                    raise RuntimeError(f"Error downloading images: {e}")
+                await queue.join()
+            finally:
+                for task in producers + consumers:
+                    task.cancel()
+                await asyncio.gather(*producers, *consumers, return_exceptions=True)
 
-    return normalized_brightness
+    return [(item, f) for item, f in zip(items, features) if f is not None]
 
 
 # Сортирует изображения по яркости
-async def sort_images_by_priority(media, criterion):
+async def sort_images_by_priority(media, criterion, mode=None, on_progress=None):
     """
     Сортирует изображения по яркости: от светлого к тёмному (light) или наоборот (dark).
     """
-    # Подготовка списка URL
-    image_urls = [item['file_id'] for item in media if 'file_id' in item]
-
-    # Скачивание изображений асинхронно
-    try:
-        downloaded_images = await download_images(image_urls)  # Используем await здесь
-    except Exception as e:
-        raise RuntimeError(f"Error downloading images: {e}")
-
-    # Анализируем изображения и определяем hue для каждого
-    analyzed_images = []
-
-    for item, image in zip(media, downloaded_images):
-        if image is not None:
-            brightness_distribution, saturation_distribution, hue_distribution = analyze_image_colors(image, criterion)
-
-
-            top_colors = sorted(
-                ((color, data["tw"]) for color, data in hue_distribution.items() if data["tw"] > 0),
-                key=lambda x: x[1],
-                reverse=True
-            )[:3]
-
-
-            color_weights = {
-                'yellow': -0.02,
-                'blue': 0.01,
-                'green': -0.003,
-                'cyan': -0.005,
-                'red': 0.002,
-                'purple': 0.005,
-                'orange': -0.007
-            }
-
-
-            brightness_distribution, saturation_distribution, _ = analyze_image_colors(image, criterion)
-            normalized_brightness = calculate_normalized_brightness(
-                brightness_distribution, saturation_distribution
-            )
-          
-            # Корректировка по цветам
-            color_adjustment = 0
-            total_weight = sum(weight for _, weight in top_colors)
-            for color, weight in top_colors:
-                if color in color_weights:
-                    influence = color_weights[color] * (weight / total_weight)
-                    color_adjustment += influence
-
-            # Ограничение влияния цветов на диапазон [-0.2, +0.2]
-            color_adjustment = max(min(color_adjustment, 0.2), -0.2)
-
-            # Влияние серых пикселей
-            gray_ratio = saturation_distribution['gray']
-            middle_ratio = saturation_distribution['medium']
-            if (gray_ratio > 0.85 or middle_ratio > 0.8) and brightness_distribution['bright'] > 0.85:
-                # Если много серых пикселей или средняя насыщенность при высокой яркости, усиливаем яркость
-                color_adjustment *= (1 - gray_ratio)  # Уменьшаем влияние цветовой корректировки
-                normalized_brightness += 0.2 * gray_ratio  # Усиливаем базовую яркость
-
-            # Итоговая яркость
-            finale_brightness = max(min(normalized_brightness + color_adjustment, 1), 0)
-
-            if criterion == 'light':
-                # Обратная сортировка для 'dark'
-                finale_brightness = 1 - finale_brightness
-
-
-            # Добавляем данные изображения и его итоговую яркость
-            analyzed_images.append((item, finale_brightness))
+    analyzed_images = [
+        (item, features.brightness_score(criterion))
+        for item, features in await analyze_media_features(media, mode, on_progress)
+    ]
 
     # Сортировка по убыванию итоговой яркости
     sorted_images = sorted(analyzed_images, key=lambda x: x[1], reverse=True)
@@ -16405,31 +16114,22 @@ async def sort_images_by_priority(media, criterion):
 
 
 # сортировка по цветам
-async def sort_images_by_hue(media, criterion):
+async def sort_images_by_hue(media, criterion, mode=None, on_progress=None):
     """
     Сортирует изображения по оттенкам (hue), используя критерий для начального порядка.
     
     :param media: Список словарей с медиа-данными, включая URL изображений.
     :param criterion: Критерий цвета для первого изображения (например, 'red', 'blue', и т.д.).
+    :param mode: Режим декодирования для анализа ("exact" или "fast").
+    :param on_progress: Корутина on_progress(done, total) для отображения прогресса.
     :return: Список отсортированных идентификаторов файлов.
     """
-    # Подготовка списка URL
-    image_urls = [item['file_id'] for item in media if 'file_id' in item]
-
-    # Скачивание изображений асинхронно
-    try:
-        downloaded_images = await download_images(image_urls)  # Используем await здесь
-    except Exception as e:
-        raise RuntimeError(f"Error downloading images: {e}")
-    
     # Анализируем изображения и определяем hue для каждого
     analyzed_images = []
-    for item, image in zip(media, downloaded_images):
-        if image is not None:
-            hue_distribution = analyze_image_colors(image, criterion)[2]  # Передаем Image напрямую
-            final_hue = hue_finele(hue_distribution, criterion)
-            if final_hue is not None:
-                analyzed_images.append((item, final_hue))
+    for item, features in await analyze_media_features(media, mode, on_progress):
+        final_hue = features.final_hue(criterion)
+        if final_hue is not None:
+            analyzed_images.append((item, final_hue))
 
 
     # Проверка результатов анализа
@@ -16481,120 +16181,15 @@ async def sort_images_by_hue(media, criterion):
     return [item[0] for item in sorted_images]
 
 
-import math
-def gaussian_weight(hue, target, sigma):
-    return math.exp(-((hue - target) ** 2) / (2 * sigma ** 2))
 # сортировка по насыщенности
-async def sort_images_by_color_priority(media, criterion):
+async def sort_images_by_color_priority(media, criterion, mode=None, on_progress=None):
     """
     Сортирует изображения по насыщенности: от насыщенного и светлого к тёмному (light) или наоборот (dark).
     """
-    # Подготовка списка URL
-    image_urls = [item['file_id'] for item in media if 'file_id' in item]
-
-    # Скачивание изображений асинхронно
-    try:
-        downloaded_images = await download_images(image_urls)  # Используем await здесь
-    except Exception as e:
-        raise RuntimeError(f"Error downloading images: {e}")
-
-    # Анализируем изображения и определяем насыщенность для каждого
-    analyzed_images = []
-
-    for item, image in zip(media, downloaded_images):
-        if image is not None:
-            # Анализ изображения
-            brightness_distribution, saturation_distribution, hue_distribution = analyze_image_colors(image, criterion)
-            final_hue = hue_finele(hue_distribution, criterion)
-
-
-
-            # Вычисляем averaged_saturation
-            gray_weight = -0.8  # Серым придаём больший вес
-            medium_weight = 4.4  # Средние пиксели имеют меньший вес
-            high_weight = 10.7  # Насыщенные пиксели имеют больший вес
-
-            brightness_boost_factor = brightness_distribution['bright']  # Используем яркость напрямую
-            if brightness_boost_factor > 0:
-                medium_weight *= 1.5 + brightness_boost_factor 
-                high_weight *= 2 + brightness_boost_factor 
-            else:
-                # Для низкой яркости можно оставить исходные значения или уменьшить веса
-                medium_weight *= 0.9
-                high_weight *= 0.9
-                       
-            averaged_saturation = (
-                saturation_distribution['gray'] * gray_weight +
-                saturation_distribution['medium'] * medium_weight +
-                saturation_distribution['high'] * high_weight
-            ) / (gray_weight + medium_weight + high_weight)
-
-            # Корректируем averaged_saturation в зависимости от яркости
-            bright_boost = 1.2  # Усиление при ярких пикселях
-            middle_boost = 1.1  # Усиление при средних пикселях            
-            dark_damp = 0.1  # Ослабление при тёмных пикселях
-
-            # Дополнительный коэффициент нелинейного ослабления для "dark"
-            dark_penalty_scale = 2.0  # Множитель для усиления влияния высокой "dark"
-            dark_adjustment = brightness_distribution['dark'] ** dark_penalty_scale
-
-            brightness_factor = ((
-                brightness_distribution['bright'] * bright_boost +
-                brightness_distribution['medium'] * middle_boost +
-                brightness_distribution['dark'] * (1 - dark_damp) -
-                dark_adjustment  # Учитываем нелинейное влияние "dark"
-            ) / (bright_boost + middle_boost + dark_damp)) - (
-                ((brightness_distribution['bright'] * 2) + brightness_distribution['medium'] + brightness_distribution['dark']) / 6.5
-            )
-
-
-            # Суммируем значения для учета их в одной переменной
-            combined_value = (saturation_distribution['gray']) + (brightness_distribution['dark']) - (saturation_distribution['medium'] / 2) - (saturation_distribution['high'] / 2) 
-
-            # Используем сдвиг для того, чтобы снижение начиналось при значении примерно 1
-            shift_start = 1  # Начало сильного сдвига
-            shift_factor = 4  # Сила сдвига, можно настроить            
-            final_brightness_factor = brightness_factor / (1 + math.exp((combined_value - shift_start) * shift_factor))
-            # Ограничиваем итоговую насыщенность в пределах [0, 1]
-         
-            averaged_saturation = max(0, min(1, averaged_saturation + final_brightness_factor))
-
-
-            # Усиление для теплых и холодных оттенков
-            warm_hue_boost = 0.04
-            cold_hue_damp = 0.04
-            max_adjustment = 0.1
-
-            # Стандартное отклонение для гауссовой функции (ширина изменения)
-            sigma = 30  # Чем меньше значение, тем резче спад влияния
-
-            # Рассчитываем вес в зависимости от final_hue
-            if (0 <= final_hue <= 140) or (330 <= final_hue <= 360):  # Тёплые оттенки
-                weight_90 = gaussian_weight(final_hue, 90, sigma) if final_hue <= 140 else 0
-                weight_350 = gaussian_weight(final_hue, 350, sigma) if final_hue >= 330 else 0
-                weight = max(weight_90, weight_350)  # Выбираем наибольшее влияние
-                adjustment = warm_hue_boost * weight
-                finale_Saturation = averaged_saturation + min(max_adjustment, adjustment)
-
-            elif 140 < final_hue < 330:  # Холодные оттенки
-                weight = gaussian_weight(final_hue, 240, sigma)
-                adjustment = cold_hue_damp * weight
-                finale_Saturation = averaged_saturation - min(max_adjustment, adjustment)
-
-            else:  # Предохранитель для значений вне диапазона
-                finale_Saturation = averaged_saturation
-
-            # Ограничиваем значение finale_Saturation в пределах допустимого диапазона
-            finale_Saturation = max(0, min(1, finale_Saturation))
-
-            # Ограничиваем результат в пределах [0, 1]
-            finale_Saturation = max(0, min(1, finale_Saturation))  
-
-            if criterion == 'desaturated':
-                # Обратная сортировка для 'dark'
-                finale_Saturation = 1 - finale_Saturation
-            # Добавляем данные изображения и его итоговую насыщенность
-            analyzed_images.append((item, finale_Saturation))
+    analyzed_images = [
+        (item, features.saturation_score(criterion))
+        for item, features in await analyze_media_features(media, mode, on_progress)
+    ]
 
     # Сортировка по убыванию итоговой насыщенности
     sorted_images = sorted(analyzed_images, key=lambda x: x[1], reverse=True)
@@ -16606,51 +16201,11 @@ async def sort_images_by_color_priority(media, criterion):
 
 
 # сортировка по теплоте
-async def sort_images_by_warm(media, criterion):
-    image_urls = [item['file_id'] for item in media if 'file_id' in item]
-
-    try:
-        downloaded_images = await download_images(image_urls)
-    except Exception as e:
-        raise RuntimeError(f"Error downloading images: {e}")
-
-    analyzed_images = []
-
-    for item, image in zip(media, downloaded_images):
-        if image is not None:
-            # Анализ изображения
-            brightness_distribution, saturation_distribution, hue_distribution = analyze_image_colors(image, criterion)
-
-            # Нормализация
-            normalized_brightness = (
-                0.2 * brightness_distribution['dark'] +
-                0.5 * brightness_distribution['medium'] +
-                0.8 * brightness_distribution['bright']
-            )
-
-            normalized_saturation = (
-                0.1 * saturation_distribution['gray'] +
-                0.6 * saturation_distribution['medium'] +
-                0.9 * saturation_distribution['high']
-            )
-
-            warm_colors = ['red', 'orange', 'yellow']
-            cold_colors = ['green', 'cyan', 'blue', 'purple']
-
-            warm_tw = sum(hue_distribution[color]['tw'] for color in warm_colors)
-            cold_tw = sum(hue_distribution[color]['tw'] for color in cold_colors)
-            total_tw = sum(hue_distribution[color]['tw'] for color in hue_distribution)
-
-            final_warm = (warm_tw - cold_tw) / total_tw if total_tw > 0 else 0
-
-            # Итоговая метрика
-            score = (
-                0.6 * final_warm +  # Влияние цветов
-                0.3 * normalized_brightness +  # Влияние яркости
-                0.1 * (1 - normalized_saturation)  # Влияние насыщенности
-            )
-
-            analyzed_images.append((item, score))
+async def sort_images_by_warm(media, criterion, mode=None, on_progress=None):
+    analyzed_images = [
+        (item, features.warmth_score)
+        for item, features in await analyze_media_features(media, mode, on_progress)
+    ]
 
     # Сортировка по убыванию итогового score
     sorted_images = sorted(analyzed_images, key=lambda x: x[1], reverse=True)
@@ -16767,15 +16322,32 @@ async def sort_by_criteria(update, context):
                     text=f"Сортировка начата. Выбранный критерий: {criterion.capitalize()}\n\n"
                 )
 
+                last_progress_edit = 0.0
+
+                async def report_progress(done, total):
+                    # Не чаще раза в секунду (лимиты Telegram), финальное значение — всегда
+                    nonlocal last_progress_edit
+                    now = time.monotonic()
+                    if done < total and now - last_progress_edit < 1.0:
+                        return
+                    last_progress_edit = now
+                    try:
+                        await progress_message.edit_text(
+                            f"Сортировка начата. Выбранный критерий: {criterion.capitalize()}\n\n"
+                            f"Проанализировано изображений: {done} из {total}"
+                        )
+                    except TelegramError:
+                        pass
+
                 # Сортировка всего списка media
                 if criterion in {"dark", "light"}:
-                    sorted_media = await sort_images_by_priority(media, criterion)
+                    sorted_media = await sort_images_by_priority(media, criterion, on_progress=report_progress)
                 elif criterion in {"saturated", "desaturated"}:
-                    sorted_media = await sort_images_by_color_priority(media, criterion)
+                    sorted_media = await sort_images_by_color_priority(media, criterion, on_progress=report_progress)
                 elif criterion == "warm":
-                    sorted_media = await sort_images_by_warm(media, criterion)
+                    sorted_media = await sort_images_by_warm(media, criterion, on_progress=report_progress)
                 else:
-                    sorted_media = await sort_images_by_hue(media, criterion)
+                    sorted_media = await sort_images_by_hue(media, criterion, on_progress=report_progress)
 
                 # Завершение обновления прогресса
 
@@ -18496,354 +18068,65 @@ async def ignore_pinned_message(update: Update, context: CallbackContext):
     # Ничего не делаем, просто игнорируем событие закрепления
     pass
 
-def get_smart_colors(b_dist, s_dist, h_dist, norm_brightness):
-    # ==========================================
-    # НАСТРОЙКИ DOM (ДОМИНАНТНОГО ЦВЕТА) И БАЗОВЫХ ВЕСОВ
-    # ==========================================
-    cfg_dom = {
-        # Базовый множитель для серого. 
-        # Увеличить: серый цвет будет чаще становиться доминантным. Уменьшить: реже.
-        "base_gray_mult": 520.0,
-        
-        # Сила "штрафа" (уменьшения веса) черного цвета на светлых фотографиях.
-        # Увеличить: черный цвет будет быстрее исчезать из кандидатов на светлых фото.
-        "bright_black_penalty": 10.0,
-        
-        # Бонус к весу белого цвета, если на фото много серого (>15%).
-        # Увеличить: белый чаще будет побеждать серый при обилии нейтральных тонов.
-        "white_gray_boost": 10.0,
-        
-        # Штраф цвета за "темноту". Какая доля веса цвета сгорает из-за его темных пикселей.
-        # Увеличить: темные/грязные цвета реже будут становиться DOM. Уменьшить: будут чаще.
-        "color_dark_penalty": 0.7,
-        
-        # Штраф цвета за "светлоту". Какая доля веса сгорает из-за засвеченных пикселей.
-        # Увеличить: пастельные/светлые оттенки реже становятся DOM.
-        "color_bright_penalty": 0.1,
-        
-        # Какая доля от "отрезанного" веса темных цветных пикселей передается в Черный цвет.
-        # Увеличить: Черный быстрее набирает вес от темных синих/зеленых и т.д.
-        "color_to_black_transfer": 0.5,
-        
-        # Какая доля от "отрезанного" веса светлых цветных пикселей передается в Белый цвет.
-        # Увеличить: Белый быстрее набирает вес от светлых пастельных оттенков.
-        "color_to_white_transfer": 0.5,
-
-        # --- НОВЫЙ ПАРАМЕТР ---
-        # Бонус за насыщенность (чистоту) цвета.
-        # Увеличить: сочные/насыщенные цвета будут агрессивно обгонять тусклые и грязные оттенки.
-        # Например, при 0.8: цвет, состоящий на 100% из насыщенных пикселей, получит +80% к весу.        
-        "color_sat_boost": 1.8, 
-        # --- НОВОЕ: Множители чувствительности к насыщенности ---
-        # Значения > 1.0 позволяют цвету получать высокий бонус даже при средней насыщенности.
-        "hue_sat_multipliers": {
-            "purple": 3,
-            "pink": 2.3,
-            "blue": 1.7
-        },
-
-
-        # Минимальный порог веса для того, чтобы цвет вообще рассматривался как кандидат в DOM.
-        # Увеличить: мелкие детали никогда не станут DOM. Уменьшить: больше мусорных кандидатов.
-        "min_dom_weight": 0.9
-    }
-
-    # ==========================================
-    # НАСТРОЙКИ SEC (ВТОРИЧНОГО/VISUAL ЦВЕТА)
-    # ==========================================
-    cfg_sec = {
-        # Минимальный сырой вес для участия в расчете SEC.
-        "min_sec_weight": 0.5,
-        # --- НОВЫЙ ПАРАМЕТР ---
-        # Бонус за индивидуальную насыщенность (чистоту) SEC цвета.
-        # Увеличить: сочные/насыщенные оттенки будут получать множитель к итоговому 
-        # visual_score и легко обгонять тусклые/грязные цвета-кандидаты.
-        "color_sat_boost": 20, 
-        # --- Ч/Б на фоне Ч/Б ---
-        # Порог веса, после которого применяется штрафной множитель (чтобы ч/б было сложнее стать SEC).
-        "achro_weight_threshold": 15.0,
-        # Множитель веса (если вес больше порога выше). 
-        # Увеличить (>0.5): серому/черному будет проще стать SEC на фоне белого/черного.
-        "achro_on_achro_mult": 0.7,
-
-        # --- ЦВЕТ на фоне Ч/Б ---
-        # Множитель для цвета, если фото в основном серое (>55%).
-        # Увеличить: любые цвета на серых фото будут иметь огромный шанс стать SEC.
-        "color_on_achro_mult_mono": 2.0,
-        # Множитель для цвета на фоне ч/б в обычных условиях.
-        # Увеличить: цветные элементы будут еще сильнее доминировать над ч/б фоном.
-        "color_on_achro_mult_norm": 5.0,
-        
-        # Порог веса для определения "маленькой детали" (например, красной кнопки на сером фоне).
-        "small_color_threshold": 15.0,
-        # Доп. буст для маленьких деталей. Увеличить: мелкие яркие детали агрессивнее становятся SEC.
-        "small_color_boost": 1.5,
-        
-        # Порог кол-ва насыщенных пикселей на фото, чтобы применить глобальный буст цвета.
-        "high_sat_threshold": 0.05,
-        # Множитель для высоконасыщенных фото. Увеличить: насыщенные цвета легче перебивают тусклые.
-        "high_sat_boost": 1.2,
-
-        # --- Ч/Б на фоне ЦВЕТА ---
-        # Виртуальный базовый вес черного (умножается на долю темных неярких пикселей).
-        # Увеличить: Черный чаще будет SEC на цветных фотографиях с тенями.
-        "black_on_color_base": 200.0,
-        # Итоговый множитель черного на цветном фоне. Увеличить: черному проще пробиться в SEC.
-        "black_on_color_mult": 0.8,
-        
-        # Виртуальный базовый вес белого (умножается на долю ярких неярких пикселей).
-        # Увеличить: Белый чаще будет SEC на фото с пересветами.
-        "white_on_color_base": 1800.0,
-        # Итоговый множитель белого на цветном фоне.
-        "white_on_color_mult": 1.2,
-        
-        # Множитель серого на фоне цвета. 
-        # Увеличить: серый перестанет игнорироваться и начнет вытеснять цвета из SEC (не рекомендуется).
-        "gray_on_color_mult": 0.3,
-        # --- НОВОЕ: Множители чувствительности для SEC ---
-        # Работает аналогично DOM, помогая фиолетовому спектру пробиваться в SEC.
-        "hue_sat_multipliers": {
-            "purple": 3,
-            "pink": 2.3,
-            "blue": 1.7
-        },
-        # --- ЦВЕТ на фоне ЦВЕТА (дистанции на цветовом круге 0-360) ---
-        # Дистанция 1 (очень близкие цвета). Увеличить: больше похожих оттенков будут игнорироваться.
-        "dist_close": 20,
-        "mult_close": 0.1,   # 0.0 значит, что близкие оттенки полностью сбрасываются.
-        
-        # Дистанция 2 (соседние цвета).
-        "dist_medium": 45,
-        "mult_medium": 0.7,  # Увеличить: соседним оттенкам (например, синему на фоне голубого) легче стать SEC.
-        
-        # Дистанция 3 (средне-далекие цвета).
-        "dist_far": 65,
-        "mult_far": 0.1,    # Штрафная зона, чтобы "грязные" переходы не становились SEC.
-        
-        # Множитель для контрастных цветов (дальше dist_far) на "сером" фото.
-        "color_on_color_mult_mono": 1.0,
-        # Множитель для контрастных цветов на обычных ярких фото.
-        # Увеличить: противоположные цвета (красный-зеленый) будут всегда перебивать остальные.
-        "color_on_color_mult_norm": 2.0,
-    }
-
-    dark_ratio = b_dist.get('dark', 0)
-    bright_ratio = b_dist.get('bright', 0)
-    gray_ratio = s_dist.get('gray', 0)
-    high_sat_ratio = s_dist.get('high', 0)
-
-    # --- БАЗОВЫЕ ВЕСА АХРОМАТИКИ ---
-    base_black_weight = dark_ratio * 1.0
-    base_white_weight = bright_ratio * 1.0
-    exact_gray = b_dist.get('exact_gray', gray_ratio)
-    
-    # Корректировки яркости
-    black_weight = base_black_weight
-    if norm_brightness >= 0.65:
-        darkness_factor = (0.65 - norm_brightness) / 0.65
-        black_weight += darkness_factor * cfg_dom["bright_black_penalty"]
-
-    white_weight = base_white_weight
-    if exact_gray > 0.15:
-        white_weight += cfg_dom["white_gray_boost"]
-
-    gray_weight = exact_gray * cfg_dom["base_gray_mult"]
-
-    # ==========================================
-    # ЭТАП 1: ПОДГОТОВКА ВЕСОВ ДЛЯ DOM
-    # ==========================================
-    dom_weights = {
-        "black": black_weight,
-        "white": white_weight,
-        "gray": gray_weight
-    }
-    
-    for hue in h_dist.keys():
-        dom_weights[hue] = 0.0
-
-    for hue, data in h_dist.items():
-        original_weight = data.get('tw', 0)
-        total_hue_pixels = data.get('hv', 0) + data.get('mv', 0) + data.get('lv', 0)
-        
-        if total_hue_pixels > 0 and original_weight > 0:
-            dark_ratio_in_color = data.get('lv', 0) / total_hue_pixels
-            bright_ratio_in_color = data.get('hv', 0) / total_hue_pixels
-            sat_ratio_in_color = data.get('hs', data.get('mv', 0)) / total_hue_pixels
-            
-            sat_mult = cfg_dom["hue_sat_multipliers"].get(hue, 1.0)
-            effective_sat_ratio = min(1.0, sat_ratio_in_color * sat_mult)
-
-            pure_color_weight = original_weight * (
-                1.0 
-                - cfg_dom["color_dark_penalty"] * dark_ratio_in_color 
-                - cfg_dom["color_bright_penalty"] * bright_ratio_in_color
-            )
-            
-            pure_color_weight *= (1.0 + (cfg_dom["color_sat_boost"] * effective_sat_ratio))
-            
-            dom_weights[hue] = pure_color_weight
-            dom_weights["black"] += original_weight * cfg_dom["color_to_black_transfer"] * dark_ratio_in_color
-            dom_weights["white"] += original_weight * cfg_dom["color_to_white_transfer"] * bright_ratio_in_color
-        else:
-            dom_weights[hue] = original_weight
-
-    sorted_dom = sorted(dom_weights.items(), key=lambda x: x[1], reverse=True)
-    valid_dom_candidates = [c for c in sorted_dom if c[1] >= cfg_dom["min_dom_weight"]]
-    
-    if not valid_dom_candidates:
-        dom_color = sorted_dom[0][0] if sorted_dom else "black"
-    else:
-        dom_color = valid_dom_candidates[0][0]
-
-    # ==========================================
-    # ЭТАП 2: ПОДГОТОВКА СПИСКА ДЛЯ SEC (VISUAL)
-    # ==========================================
-    raw_combined_colors = []
-    raw_combined_colors.append({"name": "black", "weight": black_weight})
-    raw_combined_colors.append({"name": "white", "weight": white_weight})
-    raw_combined_colors.append({"name": "gray",  "weight": gray_weight})
-
-    for hue, data in h_dist.items():
-        raw_combined_colors.append({"name": hue, "weight": data.get('tw', 0)})
-
-    valid_colors = [c for c in raw_combined_colors if c['weight'] >= cfg_sec["min_sec_weight"]]
-    if not valid_colors:
-        # Теперь возвращаем 5 параметров
-        return dom_color, None, None, [], dom_weights 
-        
-    valid_colors.sort(key=lambda x: x['weight'], reverse=True)
-
-    # ==========================================
-    # ЭТАП 3: РАСЧЕТ SEC (VISUAL SCORE)
-    # ==========================================
-    achromatic_set = {"black", "white", "gray"}
-    hue_positions = {
-        "red": 0, "orange": 40, "yellow": 85, "green": 130, 
-        "cyan": 180, "blue": 240, "purple": 280, "pink": 320
-    }
-
-    is_mostly_monochrome = gray_ratio > 0.55
-    high_sat_ratio = s_dist.get('high', 0.0) 
-
-    best_sec_color = None
-    best_sec_score = -1.0
-    
-    dark_low_sat = b_dist.get("dark_low_sat", 0)
-    bright_low_sat = b_dist.get("bright_low_sat", 0)
-
-    for i in range(len(valid_colors)):
-        cand_color = valid_colors[i]['name']
-        
-        if cand_color == dom_color:
-            valid_colors[i]["visual_score"] = 0.0
-            continue
 
-        cand_weight = valid_colors[i]['weight']
-        multiplier = 0.0
 
-        if dom_color in achromatic_set:
-            if cand_color in achromatic_set:
-                if (dom_color == "black" and cand_color == "white") or \
-                   (dom_color == "white" and cand_color == "black"):
-                    multiplier = 1.0
-                elif cand_weight > cfg_sec["achro_weight_threshold"]:
-                    multiplier = cfg_sec["achro_on_achro_mult"]
-            else:
-                multiplier = cfg_sec["color_on_achro_mult_mono"] if is_mostly_monochrome else cfg_sec["color_on_achro_mult_norm"]
-                if cand_weight < cfg_sec["small_color_threshold"]:
-                    multiplier *= cfg_sec["small_color_boost"]
-                if high_sat_ratio > cfg_sec["high_sat_threshold"]:
-                    multiplier *= cfg_sec["high_sat_boost"]
 
-        else:
-            if cand_color in achromatic_set:
-                if cand_color == "black":
-                    visual_black_weight = dark_low_sat * cfg_sec["black_on_color_base"]
-                    cand_weight = visual_black_weight
-                    multiplier = cfg_sec["black_on_color_mult"]
-                elif cand_color == "white":
-                    visual_white_weight = bright_low_sat * cfg_sec["white_on_color_base"]
-                    cand_weight = visual_white_weight
-                    multiplier = cfg_sec["white_on_color_mult"]
-                else: 
-                    multiplier = cfg_sec["gray_on_color_mult"]
-            else:
-                h1 = hue_positions.get(dom_color, 0)
-                h2 = hue_positions.get(cand_color, 0)
-                dist = abs((h1 - h2) % 360)
-                if dist > 180: dist = 360 - dist
-                
-                if dist <= cfg_sec["dist_close"]:
-                    multiplier = cfg_sec["mult_close"] 
-                elif dist <= cfg_sec["dist_medium"]:
-                    multiplier = cfg_sec["mult_medium"]
-                elif dist <= cfg_sec["dist_far"]:
-                    multiplier = cfg_sec["mult_far"]
-                else:
-                    multiplier = cfg_sec["color_on_color_mult_mono"] if is_mostly_monochrome else cfg_sec["color_on_color_mult_norm"]
-
-        if multiplier <= 0.0:
-            valid_colors[i]["visual_score"] = 0.0
-            continue
-
-        if cand_color not in achromatic_set:
-            color_data = h_dist.get(cand_color, {})
-            total_hue_pixels = color_data.get('hv', 0) + color_data.get('mv', 0) + color_data.get('lv', 0)
-            if total_hue_pixels > 0:
-                sat_ratio_in_cand = color_data.get('hs', color_data.get('mv', 0)) / total_hue_pixels
-                
-                sat_mult = cfg_sec["hue_sat_multipliers"].get(cand_color, 1.0)
-                effective_sat_ratio = min(1.0, sat_ratio_in_cand * sat_mult)
-                
-                multiplier *= (1.0 + (cfg_sec["color_sat_boost"] * effective_sat_ratio))
-
-        visual_score = cand_weight * multiplier
-        valid_colors[i]["visual_score"] = round(visual_score, 2)
-
-        if visual_score > best_sec_score:
-            best_sec_score = visual_score
-            best_sec_color = cand_color
-
-    # ==========================================
-    # НОВОЕ: ЭТАП 4: РАСЧЕТ TER (ТРЕТЬЕГО ЦВЕТА)
-    # ==========================================
-    best_ter_color = None
-    best_ter_score = -1.0
-    
-    dom_sec_set = {dom_color, best_sec_color}
+def get_original_date(msg):
+    if msg.forward_origin and msg.forward_origin.date:
+        return int(msg.forward_origin.date.timestamp())
+    return int(msg.date.timestamp())
 
-    for color_data in valid_colors:
-        cand_color = color_data['name']
-        cand_visual_score = color_data.get('visual_score', 0.0)
+async def recolor_archive_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Команда /recolor [reset] [fast] [cached]
+    Пересчитывает только цветовой анализ у всех сохранённых постов (без Gemini и пересылки).
+    Прерванный пересчёт продолжается с места остановки; reset — начать заново.
+    cached — только умные цвета по кэшу признаков, без скачивания файлов.
+    """
+    if update.effective_user.id != ALLOWED_USER_ID:
+        await update.message.reply_text("У вас нет доступа к этой команде.")
+        return
 
-        # 1. Третий цвет не может быть dom, sec или ахроматическим (чёрный, белый, серый)
-        if cand_color in dom_sec_set or cand_color in achromatic_set:
-            continue
-            
-        # 2. Отсекаем все цвета со значением visual меньше 10
-        if cand_visual_score < 20.0:
-            continue
-            
-        # 3. Конфликты Blue / Cyan
-        if cand_color == "cyan" and "blue" in dom_sec_set:
-            continue
-        if cand_color == "blue" and "cyan" in dom_sec_set:
-            continue
-            
-        # 4. Выбираем с наибольшим visual_score
-        if cand_visual_score > best_ter_score:
-            best_ter_score = cand_visual_score
-            best_ter_color = cand_color
+    args = [arg.lower() for arg in (context.args or [])]
+    if gpt_helper.is_recolor_running():
+        await update.message.reply_text("⏳ Пересчёт уже идёт.")
+        return
 
-    # Теперь возвращаем 5 параметров!
-    return dom_color, best_sec_color, best_ter_color, valid_colors, dom_weights
+    mode = 'fast' if 'fast' in args else None
+    if 'cached' in args:
+        status_msg = await update.message.reply_text("🎨 Пересчитываю цвета по кэшу признаков...")
+        asyncio.create_task(gpt_helper.recolor_from_cache("anemonn", status_msg, mode=mode))
+        return
 
+    status_msg = await update.message.reply_text("🎨 Запускаю пересчёт цветового анализа...")
+    asyncio.create_task(gpt_helper.reanalyze_art_colors(
+        context.bot, "anemonn", status_msg,
+        restart='reset' in args,
+        mode=mode
+    ))
 
+async def reload_gallery_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Команда /reloadgallery [канал]
+    Сбрасывает кэш постов галереи (без аргумента — всех каналов): следующий запрос
+    перечитает art_posts канала из базы целиком.
+    Обычно не нужна — сохранения патчат кэш на месте.
+    """
+    if update.effective_user.id != ALLOWED_USER_ID:
+        await update.message.reply_text("У вас нет доступа к этой команде.")
+        return
 
-def get_original_date(msg):
-    if msg.forward_origin and msg.forward_origin.date:
-        return int(msg.forward_origin.date.timestamp())
-    return int(msg.date.timestamp())
+    channel_id = context.args[0] if context.args else None
+    if channel_id is not None and not gpt_helper.is_valid_channel_id(channel_id):
+        await update.message.reply_text(
+            "❌ Неверный id канала: нужен @username, username или числовой id чата."
+        )
+        return
+    gpt_helper.reset_posts_cache(channel_id)
+    await update.message.reply_text(
+        f"🔄 Кэш галереи {'канала ' + channel_id if channel_id else 'всех каналов'} сброшен, "
+        "база будет перечитана при следующем запросе."
+    )
 
 async def dump_posts_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
@@ -18922,6 +18205,8 @@ async def dump_posts_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
                     'channel_id': db_channel_id,
                     'message_id': msg_id,
                     'file_id': file_id,
+                    'file_unique_id': photo_obj.file_unique_id,
+                    'analysis_file_id': select_analysis_photo(dumped_msg.photo, 'fast').file_id,
                     'caption': post_caption,
                     'date_timestamp': post_date,
                     'original_link': main_original_link
@@ -19246,6 +18531,8 @@ def main() -> None:
 
     
     application.add_handler(CommandHandler("postid", dump_posts_command))
+    application.add_handler(CommandHandler("recolor", recolor_archive_command))
+    application.add_handler(CommandHandler("reloadgallery", reload_gallery_command))
     application.add_handler(CommandHandler("userid", userid_command))
     application.add_handler(CommandHandler("rec", recognize_test_plant))
     application.add_handler(CommandHandler("testid", handle_testid_command))  
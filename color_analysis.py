@@ -0,0 +1,1523 @@
+import asyncio
+import atexit
+import base64
+import io
+import logging
+import math
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import cached_property
+
+import numpy as np
+from PIL import Image
+
+# Цветовой анализ изображений для сортировки по палитре и фонового анализа постов.
+# Вся попиксельная математика сделана массивами NumPy: одно изображение 150x150
+# обрабатывается за один проход без Python-циклов по 22 500 пикселям.
+
+ANALYSIS_SIZE = (150, 150)
+
+HUE_COLORS = ("red", "orange", "yellow", "green", "cyan", "blue", "purple")
+
+# Границы оттенков (доли круга 0..1), порядок совпадает с HUE_COLORS
+COLOR_BOUNDARIES = {
+    "red": (340 / 360, 5 / 360),
+    "orange": (5 / 360, 45 / 360),
+    "yellow": (45 / 360, 75 / 360),
+    "green": (75 / 360, 170 / 360),
+    "cyan": (170 / 360, 200 / 360),
+    "blue": (200 / 360, 250 / 360),
+    "purple": (250 / 360, 340 / 360),
+}
+
+OVERLAP_MARGIN = 10 / 360  # Граница перекрытия соседних оттенков
+
+# Режимы декодирования для анализа:
+# "exact" — полное декодирование и LANCZOS до 150x150 (эталонный результат);
+# "fast"  — JPEG декодируется сразу в уменьшенном масштабе через Image.draft()
+#           (DCT-масштабирование 1/2..1/8), а с Telegram берётся наименьший
+#           PhotoSize не меньше 150px. Распределения немного отличаются от exact.
+ANALYSIS_MODES = ("exact", "fast")
+COLOR_ANALYSIS_MODE = os.environ.get("COLOR_ANALYSIS_MODE", "exact")
+
+
+def rgb_to_hsv_arrays(rgb):
+    """
+    Векторный аналог colorsys.rgb_to_hsv для массива пикселей (N, 3) uint8.
+    Порядок операций повторяет colorsys, поэтому значения совпадают бит в бит.
+    """
+    rgb = rgb.astype(np.float64) / 255
+    r, g, b = rgb[:, 0], rgb[:, 1], rgb[:, 2]
+
+    maxc = np.maximum(np.maximum(r, g), b)
+    minc = np.minimum(np.minimum(r, g), b)
+    rangec = maxc - minc
+    v = maxc
+
+    chromatic = rangec > 0
+    safe_range = np.where(chromatic, rangec, 1.0)
+    safe_max = np.where(chromatic, maxc, 1.0)
+
+    s = np.where(chromatic, rangec / safe_max, 0.0)
+    rc = (maxc - r) / safe_range
+    gc = (maxc - g) / safe_range
+    bc = (maxc - b) / safe_range
+
+    h = np.where(
+        r == maxc, bc - gc,
+        np.where(g == maxc, 2.0 + rc - bc, 4.0 + gc - rc)
+    )
+    h = np.where(chromatic, np.mod(h / 6.0, 1.0), 0.0)
+    return h, s, v
+
+
+def hue_membership(h):
+    """
+    Матрица (7, N): попадает ли пиксель в диапазон цвета или в зону перекрытия.
+    Один пиксель может относиться сразу к двум соседним цветам.
+    """
+    masks = []
+    for color in HUE_COLORS:
+        lower, upper = COLOR_BOUNDARIES[color]
+        if lower > upper:
+            in_range = (h >= lower) | (h < upper)
+        else:
+            in_range = (lower <= h) & (h < upper)
+        in_overlap = ((lower - OVERLAP_MARGIN <= h) & (h < lower)) | ((upper <= h) & (h < upper + OVERLAP_MARGIN))
+        masks.append(in_range | in_overlap)
+    return np.stack(masks)
+
+
+def compute_color_histograms(rgb):
+    """
+    Считает сырые счётчики по массиву пикселей (N, 3) uint8.
+
+    :return: (counts, total_brightness_sum, hue_counts, descriptor_counts), где
+             counts — словарь счётчиков яркости/насыщенности/ахроматики,
+             hue_counts — матрица (7, 6) со столбцами [hv, mv, lv, hs, ms, ls],
+             descriptor_counts — квантованная HSV-гистограмма (см. DESCRIPTOR_SIZE).
+    """
+    h, s, v = rgb_to_hsv_arrays(rgb)
+
+    dark = v < 0.33
+    bright = v >= 0.75
+    medium = ~dark & ~bright
+    low_sat = s < 0.3
+    high_sat = s >= 0.75
+
+    counts = {
+        "dark": int(np.count_nonzero(dark)),
+        "medium": int(np.count_nonzero(medium)),
+        "bright": int(np.count_nonzero(bright)),
+        "exact_white": int(np.count_nonzero(bright & low_sat)),
+        "exact_black": int(np.count_nonzero(dark)),
+        "exact_gray": int(np.count_nonzero(medium & low_sat)),
+        "dark_high_sat": int(np.count_nonzero(dark & ~low_sat)),
+        "bright_high_sat": int(np.count_nonzero(bright & ~low_sat)),
+        "dark_low_sat": int(np.count_nonzero(dark & low_sat)),
+        "bright_low_sat": int(np.count_nonzero(bright & low_sat)),
+        "gray": int(np.count_nonzero(low_sat)),
+        "medium_sat": int(np.count_nonzero(~low_sat & ~high_sat)),
+        "high_sat": int(np.count_nonzero(high_sat)),
+    }
+
+    # cumsum складывает строго слева направо, как встроенный sum() —
+    # np.sum суммирует попарно и может разойтись в последнем знаке.
+    total_brightness_sum = float(np.cumsum(v)[-1]) if v.size else 0.0
+
+    # Индексы корзин: яркость 0/1/2 (hv/mv/lv), насыщенность 0/1/2 (hs/ms/ls)
+    v_bin = np.where(v >= 0.66, 0, np.where(v >= 0.33, 1, 2))
+    s_bin = np.where(s >= 0.5, 0, np.where(s >= 0.2, 1, 2))
+
+    color_idx, pixel_idx = np.nonzero(hue_membership(h))
+    n_colors = len(HUE_COLORS)
+    v_hist = np.bincount(color_idx * 3 + v_bin[pixel_idx], minlength=n_colors * 3).reshape(n_colors, 3)
+    s_hist = np.bincount(color_idx * 3 + s_bin[pixel_idx], minlength=n_colors * 3).reshape(n_colors, 3)
+    hue_counts = np.hstack([v_hist, s_hist])
+
+    return counts, total_brightness_sum, hue_counts, compute_descriptor_counts(h, s, v)
+
+
+# Квантованная HSV-гистограмма для сравнения постов между собой:
+# хроматические пиксели — 12 оттенков x 2 насыщенности x 2 яркости,
+# ахроматические (серые и почти чёрные) — 4 ступени яркости.
+DESCRIPTOR_HUE_BINS = 12
+DESCRIPTOR_GRAY_BINS = 4
+DESCRIPTOR_SIZE = DESCRIPTOR_HUE_BINS * 4 + DESCRIPTOR_GRAY_BINS
+DESCRIPTOR_MIN_SAT = 0.15
+DESCRIPTOR_MIN_VAL = 0.15
+
+
+def compute_descriptor_counts(h, s, v):
+    """
+    Считает сырые счётчики квантованной HSV-гистограммы длины DESCRIPTOR_SIZE
+    по уже посчитанным массивам h, s, v.
+    """
+    chromatic = (s >= DESCRIPTOR_MIN_SAT) & (v >= DESCRIPTOR_MIN_VAL)
+
+    hue_bin = np.minimum((h * DESCRIPTOR_HUE_BINS).astype(np.int64), DESCRIPTOR_HUE_BINS - 1)
+    color_bin = hue_bin * 4 + (s >= 0.5) * 2 + (v >= 0.5)
+    gray_bin = DESCRIPTOR_HUE_BINS * 4 + np.minimum(
+        (v * DESCRIPTOR_GRAY_BINS).astype(np.int64), DESCRIPTOR_GRAY_BINS - 1
+    )
+
+    bins = np.where(chromatic, color_bin, gray_bin)
+    return np.bincount(bins, minlength=DESCRIPTOR_SIZE)
+
+
+# Порядок счётчиков в компактном векторе признаков
+COUNT_KEYS = (
+    "dark", "medium", "bright",
+    "exact_white", "exact_black", "exact_gray",
+    "dark_high_sat", "bright_high_sat", "dark_low_sat", "bright_low_sat",
+    "gray", "medium_sat", "high_sat",
+)
+
+_HUE_COUNTS_OFFSET = 2 + len(COUNT_KEYS)
+_DESCRIPTOR_OFFSET = _HUE_COUNTS_OFFSET + len(HUE_COLORS) * 6
+FEATURE_VECTOR_SIZE = _DESCRIPTOR_OFFSET + DESCRIPTOR_SIZE
+
+
+def pack_feature_vector(counts, total_brightness_sum, hue_counts, total_pixels, descriptor_counts):
+    """
+    Упаковывает сырые счётчики в вектор float64 длины FEATURE_VECTOR_SIZE:
+    [total_pixels, сумма яркости, счётчики COUNT_KEYS..., гистограмма оттенков 7x6,
+    квантованная HSV-гистограмма].
+    Целые счётчики в float64 хранятся точно, так что распаковка даёт те же распределения.
+    """
+    vector = np.empty(FEATURE_VECTOR_SIZE, dtype=np.float64)
+    vector[0] = total_pixels
+    vector[1] = total_brightness_sum
+    vector[2:_HUE_COUNTS_OFFSET] = [counts[key] for key in COUNT_KEYS]
+    vector[_HUE_COUNTS_OFFSET:_DESCRIPTOR_OFFSET] = np.asarray(hue_counts).ravel()
+    vector[_DESCRIPTOR_OFFSET:] = descriptor_counts
+    return vector
+
+
+def unpack_feature_vector(vector):
+    """Обратная операция к pack_feature_vector — аргументы для build_distributions."""
+    total_pixels = int(vector[0])
+    total_brightness_sum = float(vector[1])
+    counts = {key: int(value) for key, value in zip(COUNT_KEYS, vector[2:_HUE_COUNTS_OFFSET])}
+    hue_counts = vector[_HUE_COUNTS_OFFSET:_DESCRIPTOR_OFFSET].astype(np.int64).reshape(len(HUE_COLORS), 6)
+    return counts, total_brightness_sum, hue_counts, total_pixels
+
+
+def encode_color_descriptor(descriptor):
+    """Упаковывает дескриптор (L1-нормированный) в base64-строку float16 для Firebase."""
+    return base64.b64encode(np.asarray(descriptor, dtype="<f2").tobytes()).decode("ascii")
+
+
+def decode_color_descriptors(values):
+    """
+    Обратная операция к encode_color_descriptor сразу для списка строк (индекс галереи
+    читает color_desc всех постов): (позиции, матрица float32 (len(позиций), DESCRIPTOR_SIZE)),
+    строки матрицы — дескрипторы values с этими позициями; пустые и битые пропущены.
+    """
+    positions = []
+    raw = []
+    for position, encoded in enumerate(values):
+        if not encoded or not isinstance(encoded, (str, bytes)):
+            continue
+        try:
+            data = base64.b64decode(encoded)
+        except (ValueError, TypeError):
+            continue
+        if len(data) == DESCRIPTOR_SIZE * 2:
+            positions.append(position)
+            raw.append(data)
+    matrix = np.frombuffer(b"".join(raw), dtype="<f2").reshape(len(raw), DESCRIPTOR_SIZE)
+    return positions, matrix.astype(np.float32)
+
+
+def build_distributions(counts, total_brightness_sum, hue_counts, total_pixels):
+    """
+    Превращает сырые счётчики в словари распределений (как раньше возвращал
+    analyze_image_colors) и считает итоговый вес tw для каждого оттенка.
+    """
+    brightness_distribution = {
+        "dark": counts["dark"] / total_pixels,
+        "medium": counts["medium"] / total_pixels,
+        "bright": counts["bright"] / total_pixels,
+        "total_bright": 1 - total_brightness_sum / total_pixels,
+        # Точные попиксельные пересечения яркости и насыщенности
+        "exact_white": counts["exact_white"] / total_pixels,
+        "exact_black": counts["exact_black"] / total_pixels,
+        "exact_gray": counts["exact_gray"] / total_pixels,
+        "dark_high_sat": counts["dark_high_sat"] / total_pixels,
+        "bright_high_sat": counts["bright_high_sat"] / total_pixels,
+        "dark_low_sat": counts["dark_low_sat"] / total_pixels,
+        "bright_low_sat": counts["bright_low_sat"] / total_pixels,
+    }
+
+    saturation_distribution = {
+        "gray": counts["gray"] / total_pixels,
+        "medium": counts["medium_sat"] / total_pixels,
+        "high": counts["high_sat"] / total_pixels,
+    }
+
+    hue_distribution = {}
+    for color, row in zip(HUE_COLORS, hue_counts.tolist()):
+        hv, mv, lv, hs, ms, ls = row
+        hue_distribution[color] = {
+            "hv": round(100 * hv / total_pixels, 2),
+            "mv": round(100 * mv / total_pixels, 2),
+            "lv": round(100 * lv / total_pixels, 2),
+            "hs": round(100 * hs / total_pixels, 2),
+            "ms": round(100 * ms / total_pixels, 2),
+            "ls": round(100 * ls / total_pixels, 2),
+        }
+
+    # Расчёт веса
+    brightness_weight = (
+        -3.0 * brightness_distribution["dark"] +
+        2.0 * brightness_distribution["medium"] +
+        0.5 * brightness_distribution["bright"]
+    )
+    for color, data in hue_distribution.items():
+        saturation_weight = (
+            -3.0 * saturation_distribution["gray"] +
+            1.0 * saturation_distribution["medium"] +
+            3.0 * saturation_distribution["high"]
+        )
+
+        if brightness_distribution["bright"] > 0.8:
+            saturation_weight += 1.5 * saturation_distribution["gray"]
+            data["ls"], data["ms"] = -0.2 * data["ls"], 3.0 * data["ms"]
+
+        if saturation_distribution["gray"] > 0.85:
+            if brightness_distribution["dark"] > 0.3 and brightness_distribution["bright"] < 0.7:
+                data["hs"], data["ms"], data["ls"] = (
+                    16.0 * data["hs"],
+                    15.0 * data["ms"],
+                    0.5 * data["ls"]
+                )
+
+        color_mass = data["hs"] + data["ms"] + data["ls"]
+
+        # Порог отсечения мелких деталей — 0.2%
+        if color_mass < 0.2:
+            data["tw"] = 0
+            continue
+
+        global_bonus = (brightness_weight + saturation_weight)
+
+        # Защищаем цвет от влияния серого фона: при депрессивном фоне
+        # даём небольшой бонус за собственную насыщенность (hs, ms)
+        if global_bonus < 0:
+            color_bonus = (data["hs"] * 1.5 + data["ms"] * 0.5)
+        else:
+            color_bonus = global_bonus * (color_mass / 100.0)
+
+        # Мягкий штраф за "тёмность" цвета: шарф в тенях всё ещё красный
+        data["tw"] = round(max(0, (
+            5.0 * data["hs"] + 3.0 * data["ms"] + 0.5 * data["ls"] +
+            2.0 * data["mv"] - 0.5 * data["lv"] +
+            10.0 * color_bonus
+        )), 2)
+
+    # Если все значения tw равны 0 — берём максимальное положительное из hs/ms/ls
+    if all(data["tw"] == 0 for data in hue_distribution.values()):
+        for color, data in hue_distribution.items():
+            values = [data["hs"], data["ms"], data["ls"]]
+            positive_values = [v for v in values if v > 0]
+
+            if positive_values:
+                data["tw"] = max(positive_values)
+            else:
+                # Все значения отрицательные: берём наименьшее по модулю
+                data["tw"] = abs(min(values))
+
+    return brightness_distribution, saturation_distribution, hue_distribution
+
+
+def resolve_analysis_mode(mode=None):
+    mode = mode or COLOR_ANALYSIS_MODE
+    if mode not in ANALYSIS_MODES:
+        raise ValueError(f"Неизвестный режим цветового анализа: {mode}")
+    return mode
+
+
+def prepare_analysis_pixels(image, mode=None):
+    """
+    Приводит изображение к RGB 150x150 и возвращает массив пикселей (N, 3) uint8.
+    В режиме fast JPEG декодируется в уменьшенном масштабе (изображение ещё не
+    должно быть загружено — как после Image.open).
+    """
+    if resolve_analysis_mode(mode) == "fast" and image.format == "JPEG":
+        image.draft('RGB', ANALYSIS_SIZE)
+    img = image.convert('RGB').resize(ANALYSIS_SIZE, Image.Resampling.LANCZOS)
+    return np.asarray(img, dtype=np.uint8).reshape(-1, 3)
+
+
+def select_analysis_photo(photo_sizes, mode=None):
+    """
+    Выбирает PhotoSize из сообщения Telegram для цветового анализа.
+    exact — самый большой вариант, fast — самый маленький, у которого обе
+    стороны не меньше 150px (если такого нет — самый большой).
+    """
+    if not photo_sizes:
+        return None
+    largest = max(photo_sizes, key=lambda p: p.width * p.height)
+    if resolve_analysis_mode(mode) == "exact":
+        return largest
+    min_w, min_h = ANALYSIS_SIZE
+    suitable = [p for p in photo_sizes if p.width >= min_w and p.height >= min_h]
+    if not suitable:
+        return largest
+    return min(suitable, key=lambda p: p.width * p.height)
+
+
+def analyze_image_colors(image, criterion):
+    """
+    Анализирует изображение и возвращает распределения.
+    """
+    rgb = prepare_analysis_pixels(image)
+    counts, total_brightness_sum, hue_counts, _ = compute_color_histograms(rgb)
+    return build_distributions(counts, total_brightness_sum, hue_counts, len(rgb))
+
+
+def hue_finele(hue_distribution, criterion):
+    """
+    Вычисляет итоговый оттенок (hue) изображения на основе данных распределения оттенков.
+
+    :param hue_distribution: Словарь с данными о распределении оттенков.
+    :param criterion: Критерий, к которому будет ближе финальный оттенок.
+    :return: Финальное значение оттенка (hue) изображения.
+    """
+    # Отбираем топ-3 цвета по значению tw
+    top_colors = sorted(
+        ((color, data["tw"]) for color, data in hue_distribution.items() if data["tw"] > 0),
+        key=lambda x: x[1],
+        reverse=True
+    )[:3]
+
+
+    if len(top_colors) < 1:
+        return None  # Если нет данных о цветах, возвращаем None
+
+    # Определение hue для каждого цвета
+    hue_positions = {
+        "red": 0,
+        "orange": 30,
+        "yellow": 60,
+        "green": 130,
+        "cyan": 180,
+        "blue": 230,
+        "purple": 280
+    }
+
+    # Проверка и обработка criterion
+    if criterion in ["dark", "light"]:
+
+        hue_criterion = None  # Устанавливаем в None, чтобы избежать ошибок
+    elif criterion in ["saturated", "desaturated", "warm"]:
+
+        hue_criterion = hue_positions["red"]
+    else:
+        if criterion not in hue_positions:
+            raise ValueError(f"🚫 Неверный критерий сортировки: {criterion}")
+        hue_criterion = hue_positions[criterion]
+
+
+    # Проверяем разницу между первыми двумя цветами
+    if hue_criterion is not None and len(top_colors) > 1 and (
+        abs(top_colors[0][1] - top_colors[1][1]) <= 20 or top_colors[1][1] > 150
+    ):
+        # Определяем ближайший к hue_criterion
+        color1, value1 = top_colors[0]
+        color2, value2 = top_colors[1]
+        hue1 = hue_positions[color1]
+        hue2 = hue_positions[color2]
+
+        # Вычисляем расстояния до hue_criterion
+        dist1 = abs((hue1 - hue_criterion) % 360)
+        dist2 = abs((hue2 - hue_criterion) % 360)
+        if dist1 > 180:
+            dist1 = 360 - dist1
+        if dist2 > 180:
+            dist2 = 360 - dist2
+
+        # Определяем базовый цвет по близости к hue_criterion
+        if dist1 <= dist2:
+            base_color, base_value = color1, value1
+            secondary_color = (color2, value2)
+        else:
+            base_color, base_value = color2, value2
+            secondary_color = (color1, value1)
+
+        # Перемещаем второй цвет в логику обработки дополнительных цветов
+        additional_colors = [secondary_color] + top_colors[2:]
+    else:
+        base_color, base_value = top_colors[0]
+        additional_colors = top_colors[1:]
+
+    base_hue = hue_positions[base_color]
+
+    # Учитываем вес базового цвета на основе значения tw
+    base_weight = base_value / 1000  # Нормализуем вес в диапазоне [0, 1]
+
+
+    # Обработка дополнительных цветов
+    adjustments = []
+    for color, value in additional_colors:
+        if color in hue_positions:
+            delta_hue = (hue_positions[color] - base_hue) % 360
+            if delta_hue > 180:
+                delta_hue -= 360  # Приведение к диапазону [-180, 180]
+
+            # Определяем делитель для расчёта shift_degree
+            divisor = 100 if value > base_value + 100 else 10
+
+            # Рассчитываем градус смещения с учетом tw
+            shift_degree = (value / divisor) * (1 - base_weight * 0.35)  # Вес базового цвета уменьшает влияние других цветов
+            adjustments.append((delta_hue, shift_degree))
+
+    # Если оба смещения направлены в одну сторону, учитываем только первое
+    if len(adjustments) > 1:
+        if all(adj[0] > 0 for adj in adjustments) or all(adj[0] < 0 for adj in adjustments):
+            adjustments = [max(adjustments, key=lambda x: abs(x[1]))]
+
+    # Применяем корректировку
+    final_hue_adjustment = sum(delta * (weight / abs(delta)) for delta, weight in adjustments)
+    final_hue = (base_hue + final_hue_adjustment) % 360
+    return round(final_hue, 2)
+
+
+def calculate_normalized_brightness(brightness_distribution, saturation_distribution):
+    # Веса для распределений яркости
+    brightness_weights = {
+        "dark": 0.3,       # Уменьшаем итоговое значение
+        "medium": 0.2,      # Нейтральное влияние
+        "bright": -0.1      # Увеличиваем итоговое значение
+    }
+    # Веса для распределений насыщенности
+    saturation_weights = {
+        "gray": -0.1,        # Увеличиваем итоговое значение (считаем серость ярче)
+        "medium": 0.2,      # Нейтральное влияние
+        "high": 0.3        # Уменьшаем итоговое значение (высокая насыщенность воспринимается темнее)
+    }
+
+    # Рассчитываем взвешенную сумму яркости
+    weighted_brightness = sum(
+        brightness_distribution[key] * weight
+        for key, weight in brightness_weights.items()
+    )
+    # Рассчитываем взвешенную сумму насыщенности
+    weighted_saturation = sum(
+        saturation_distribution[key] * weight
+        for key, weight in saturation_weights.items()
+    )
+
+    # Сумма всех весов
+    total_weights_sum = sum(brightness_weights.values()) + sum(saturation_weights.values())
+
+    # Итоговая нормализованная яркость
+    raw_brightness = (brightness_distribution["total_bright"] + weighted_brightness + weighted_saturation) * total_weights_sum
+
+    # Применяем логистическую функцию для экспоненциальной нормализации
+    def logistic_function(x):
+        return 1 / (1 + math.exp(-x))
+
+    # Ограничиваем значение в пределах от 0 до 1
+    normalized_brightness = logistic_function(raw_brightness)
+    normalized_brightness = max(0, min(1, normalized_brightness))
+
+    return normalized_brightness
+
+
+def gaussian_weight(hue, target, sigma):
+    return math.exp(-((hue - target) ** 2) / (2 * sigma ** 2))
+
+
+# ==========================================
+# НАСТРОЙКИ get_smart_colors
+# Словари компилируются в массивы один раз (см. _get_smart_color_tables);
+# после правки констант нужно вызвать reset_smart_color_tables().
+# ==========================================
+SMART_ACHROMATIC = ("black", "white", "gray")
+
+# Позиции цветов на круге для расчёта дистанции DOM/SEC
+SMART_HUE_POSITIONS = {
+    "red": 0, "orange": 40, "yellow": 85, "green": 130,
+    "cyan": 180, "blue": 240, "purple": 280, "pink": 320
+}
+
+# НАСТРОЙКИ DOM (ДОМИНАНТНОГО ЦВЕТА) И БАЗОВЫХ ВЕСОВ
+SMART_DOM_CONFIG = {
+    # Базовый множитель для серого. 
+    # Увеличить: серый цвет будет чаще становиться доминантным. Уменьшить: реже.
+    "base_gray_mult": 520.0,
+    
+    # Сила "штрафа" (уменьшения веса) черного цвета на светлых фотографиях.
+    # Увеличить: черный цвет будет быстрее исчезать из кандидатов на светлых фото.
+    "bright_black_penalty": 10.0,
+    
+    # Бонус к весу белого цвета, если на фото много серого (>15%).
+    # Увеличить: белый чаще будет побеждать серый при обилии нейтральных тонов.
+    "white_gray_boost": 10.0,
+    
+    # Штраф цвета за "темноту". Какая доля веса цвета сгорает из-за его темных пикселей.
+    # Увеличить: темные/грязные цвета реже будут становиться DOM. Уменьшить: будут чаще.
+    "color_dark_penalty": 0.7,
+    
+    # Штраф цвета за "светлоту". Какая доля веса сгорает из-за засвеченных пикселей.
+    # Увеличить: пастельные/светлые оттенки реже становятся DOM.
+    "color_bright_penalty": 0.1,
+    
+    # Какая доля от "отрезанного" веса темных цветных пикселей передается в Черный цвет.
+    # Увеличить: Черный быстрее набирает вес от темных синих/зеленых и т.д.
+    "color_to_black_transfer": 0.5,
+    
+    # Какая доля от "отрезанного" веса светлых цветных пикселей передается в Белый цвет.
+    # Увеличить: Белый быстрее набирает вес от светлых пастельных оттенков.
+    "color_to_white_transfer": 0.5,
+
+    # --- НОВЫЙ ПАРАМЕТР ---
+    # Бонус за насыщенность (чистоту) цвета.
+    # Увеличить: сочные/насыщенные цвета будут агрессивно обгонять тусклые и грязные оттенки.
+    # Например, при 0.8: цвет, состоящий на 100% из насыщенных пикселей, получит +80% к весу.        
+    "color_sat_boost": 1.8, 
+    # --- НОВОЕ: Множители чувствительности к насыщенности ---
+    # Значения > 1.0 позволяют цвету получать высокий бонус даже при средней насыщенности.
+    "hue_sat_multipliers": {
+        "purple": 3,
+        "pink": 2.3,
+        "blue": 1.7
+    },
+
+
+    # Минимальный порог веса для того, чтобы цвет вообще рассматривался как кандидат в DOM.
+    # Увеличить: мелкие детали никогда не станут DOM. Уменьшить: больше мусорных кандидатов.
+    # (Если кандидатов выше порога нет, DOM всё равно берётся по максимальному весу.)
+    "min_dom_weight": 0.9
+}
+
+# НАСТРОЙКИ SEC (ВТОРИЧНОГО/VISUAL ЦВЕТА)
+SMART_SEC_CONFIG = {
+    # Минимальный сырой вес для участия в расчете SEC.
+    "min_sec_weight": 0.5,
+    # --- НОВЫЙ ПАРАМЕТР ---
+    # Бонус за индивидуальную насыщенность (чистоту) SEC цвета.
+    # Увеличить: сочные/насыщенные оттенки будут получать множитель к итоговому 
+    # visual_score и легко обгонять тусклые/грязные цвета-кандидаты.
+    "color_sat_boost": 20, 
+    # --- Ч/Б на фоне Ч/Б ---
+    # Порог веса, после которого применяется штрафной множитель (чтобы ч/б было сложнее стать SEC).
+    "achro_weight_threshold": 15.0,
+    # Множитель веса (если вес больше порога выше). 
+    # Увеличить (>0.5): серому/черному будет проще стать SEC на фоне белого/черного.
+    "achro_on_achro_mult": 0.7,
+
+    # --- ЦВЕТ на фоне Ч/Б ---
+    # Множитель для цвета, если фото в основном серое (>55%).
+    # Увеличить: любые цвета на серых фото будут иметь огромный шанс стать SEC.
+    "color_on_achro_mult_mono": 2.0,
+    # Множитель для цвета на фоне ч/б в обычных условиях.
+    # Увеличить: цветные элементы будут еще сильнее доминировать над ч/б фоном.
+    "color_on_achro_mult_norm": 5.0,
+    
+    # Порог веса для определения "маленькой детали" (например, красной кнопки на сером фоне).
+    "small_color_threshold": 15.0,
+    # Доп. буст для маленьких деталей. Увеличить: мелкие яркие детали агрессивнее становятся SEC.
+    "small_color_boost": 1.5,
+    
+    # Порог кол-ва насыщенных пикселей на фото, чтобы применить глобальный буст цвета.
+    "high_sat_threshold": 0.05,
+    # Множитель для высоконасыщенных фото. Увеличить: насыщенные цвета легче перебивают тусклые.
+    "high_sat_boost": 1.2,
+
+    # --- Ч/Б на фоне ЦВЕТА ---
+    # Виртуальный базовый вес черного (умножается на долю темных неярких пикселей).
+    # Увеличить: Черный чаще будет SEC на цветных фотографиях с тенями.
+    "black_on_color_base": 200.0,
+    # Итоговый множитель черного на цветном фоне. Увеличить: черному проще пробиться в SEC.
+    "black_on_color_mult": 0.8,
+    
+    # Виртуальный базовый вес белого (умножается на долю ярких неярких пикселей).
+    # Увеличить: Белый чаще будет SEC на фото с пересветами.
+    "white_on_color_base": 1800.0,
+    # Итоговый множитель белого на цветном фоне.
+    "white_on_color_mult": 1.2,
+    
+    # Множитель серого на фоне цвета. 
+    # Увеличить: серый перестанет игнорироваться и начнет вытеснять цвета из SEC (не рекомендуется).
+    "gray_on_color_mult": 0.3,
+    # --- НОВОЕ: Множители чувствительности для SEC ---
+    # Работает аналогично DOM, помогая фиолетовому спектру пробиваться в SEC.
+    "hue_sat_multipliers": {
+        "purple": 3,
+        "pink": 2.3,
+        "blue": 1.7
+    },
+    # --- ЦВЕТ на фоне ЦВЕТА (дистанции на цветовом круге 0-360) ---
+    # Дистанция 1 (очень близкие цвета). Увеличить: больше похожих оттенков будут игнорироваться.
+    "dist_close": 20,
+    "mult_close": 0.1,   # 0.0 значит, что близкие оттенки полностью сбрасываются.
+    
+    # Дистанция 2 (соседние цвета).
+    "dist_medium": 45,
+    "mult_medium": 0.7,  # Увеличить: соседним оттенкам (например, синему на фоне голубого) легче стать SEC.
+    
+    # Дистанция 3 (средне-далекие цвета).
+    "dist_far": 65,
+    "mult_far": 0.1,    # Штрафная зона, чтобы "грязные" переходы не становились SEC.
+    
+    # Множитель для контрастных цветов (дальше dist_far) на "сером" фото.
+    "color_on_color_mult_mono": 1.0,
+    # Множитель для контрастных цветов на обычных ярких фото.
+    # Увеличить: противоположные цвета (красный-зеленый) будут всегда перебивать остальные.
+    "color_on_color_mult_norm": 2.0,
+}
+
+# Порог visual_score для третьего цвета
+SMART_TER_MIN_SCORE = 20.0
+
+_SMART_TABLES_CACHE = {}
+
+
+def reset_smart_color_tables():
+    """Сбрасывает скомпилированные таблицы (после изменения SMART_*_CONFIG)."""
+    _SMART_TABLES_CACHE.clear()
+
+
+def _get_smart_color_tables(hue_names):
+    """
+    Компилирует SMART_DOM_CONFIG/SMART_SEC_CONFIG в массивы для набора оттенков hue_names.
+    Кандидаты всегда идут в порядке: black, white, gray, затем hue_names.
+    """
+    tables = _SMART_TABLES_CACHE.get(hue_names)
+    if tables is not None:
+        return tables
+
+    dom_cfg, sec_cfg = SMART_DOM_CONFIG, SMART_SEC_CONFIG
+    names = SMART_ACHROMATIC + hue_names
+    n = len(names)
+    achromatic = np.array([name in SMART_ACHROMATIC for name in names])
+
+    # base_mult[mono, dom, cand] — множитель SEC без поправок, зависящих от веса кандидата
+    base_mult = np.zeros((2, n, n), dtype=np.float64)
+    heavy_only = np.zeros((n, n), dtype=bool)       # ч/б на ч/б: множитель только при весе выше порога
+    color_on_achro = np.zeros((n, n), dtype=bool)   # цвет на ч/б: бусты мелких деталей и насыщенных фото
+    weight_source = np.zeros((n, n), dtype=np.int8)  # 0 — вес как есть, 1/2 — виртуальный чёрный/белый
+
+    for d, dom in enumerate(names):
+        for c, cand in enumerate(names):
+            if c == d:
+                continue
+            for mono in (0, 1):
+                if dom in SMART_ACHROMATIC:
+                    if cand in SMART_ACHROMATIC:
+                        if {dom, cand} == {"black", "white"}:
+                            mult = 1.0
+                        else:
+                            mult = sec_cfg["achro_on_achro_mult"]
+                            heavy_only[d, c] = True
+                    else:
+                        mult = sec_cfg["color_on_achro_mult_mono"] if mono else sec_cfg["color_on_achro_mult_norm"]
+                        color_on_achro[d, c] = True
+                elif cand == "black":
+                    mult = sec_cfg["black_on_color_mult"]
+                    weight_source[d, c] = 1
+                elif cand == "white":
+                    mult = sec_cfg["white_on_color_mult"]
+                    weight_source[d, c] = 2
+                elif cand == "gray":
+                    mult = sec_cfg["gray_on_color_mult"]
+                else:
+                    h1 = SMART_HUE_POSITIONS.get(dom, 0)
+                    h2 = SMART_HUE_POSITIONS.get(cand, 0)
+                    dist = abs((h1 - h2) % 360)
+                    if dist > 180:
+                        dist = 360 - dist
+
+                    if dist <= sec_cfg["dist_close"]:
+                        mult = sec_cfg["mult_close"]
+                    elif dist <= sec_cfg["dist_medium"]:
+                        mult = sec_cfg["mult_medium"]
+                    elif dist <= sec_cfg["dist_far"]:
+                        mult = sec_cfg["mult_far"]
+                    else:
+                        mult = sec_cfg["color_on_color_mult_mono"] if mono else sec_cfg["color_on_color_mult_norm"]
+                base_mult[mono, d, c] = mult
+
+    tables = {
+        "names": names,
+        "achromatic": achromatic,
+        "dom_sat_mult": np.array([dom_cfg["hue_sat_multipliers"].get(h, 1.0) for h in hue_names], dtype=np.float64),
+        "sec_sat_mult": np.array([sec_cfg["hue_sat_multipliers"].get(h, 1.0) for h in hue_names], dtype=np.float64),
+        "base_mult": base_mult,
+        "heavy_only": heavy_only,
+        "color_on_achro": color_on_achro,
+        "weight_source": weight_source,
+        "cyan": names.index("cyan") if "cyan" in names else -1,
+        "blue": names.index("blue") if "blue" in names else -1,
+    }
+    _SMART_TABLES_CACHE[hue_names] = tables
+    return tables
+
+
+def smart_color_inputs(b_dists, s_dists, h_dists, norm_brightness, hue_names=HUE_COLORS):
+    """
+    Собирает распределения N изображений в массивы для get_smart_colors_batch.
+    Значения по умолчанию для отсутствующих ключей те же, что у скалярной get_smart_colors.
+    """
+    count = len(b_dists)
+
+    def column(dists, key, default=0):
+        return np.array([d.get(key, default) for d in dists], dtype=np.float64)
+
+    def hue_field(getter):
+        values = [[getter(h.get(hue, {})) for hue in hue_names] for h in h_dists]
+        return np.array(values, dtype=np.float64).reshape(count, len(hue_names))
+
+    gray = column(s_dists, 'gray')
+    return {
+        "dark": column(b_dists, 'dark'),
+        "bright": column(b_dists, 'bright'),
+        "exact_gray": np.array(
+            [b.get('exact_gray', g) for b, g in zip(b_dists, gray.tolist())], dtype=np.float64
+        ),
+        "dark_low_sat": column(b_dists, 'dark_low_sat'),
+        "bright_low_sat": column(b_dists, 'bright_low_sat'),
+        "gray": gray,
+        "high_sat": column(s_dists, 'high'),
+        "norm_brightness": np.asarray(norm_brightness, dtype=np.float64).reshape(count),
+        "hv": hue_field(lambda d: d.get('hv', 0)),
+        "mv": hue_field(lambda d: d.get('mv', 0)),
+        "lv": hue_field(lambda d: d.get('lv', 0)),
+        "hs": hue_field(lambda d: d.get('hs', d.get('mv', 0))),
+        "tw": hue_field(lambda d: d.get('tw', 0)),
+    }
+
+
+def _round2(values):
+    """
+    round(x, 2) встроенного round для массива. np.round (x * 100 -> rint) расходится
+    с ним только рядом с серединой между сотыми — такие значения округляются по одному.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    scaled = values * 100.0
+    result = np.rint(scaled) / 100.0
+    near_half = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    if near_half.any():
+        result[near_half] = [round(value, 2) for value in values[near_half].tolist()]
+    return result
+
+
+def _first_best(scores, order):
+    """
+    Индекс кандидата с максимальным score для каждой строки; при равенстве побеждает
+    более ранний в порядке order. -1, если подходящих кандидатов нет (score = -inf).
+    """
+    ordered = np.take_along_axis(scores, order, axis=1)
+    pos = np.argmax(ordered, axis=1)
+    rows = np.arange(len(scores))
+    best = order[rows, pos]
+    return np.where(np.isneginf(ordered[rows, pos]), -1, best)
+
+
+def _evaluate_smart_colors(inputs, hue_names=HUE_COLORS):
+    """
+    Векторная реализация get_smart_colors для N изображений сразу.
+    Возвращает словарь массивов: индексы dom/sec/ter (-1 — нет цвета),
+    веса DOM, сырые веса и округлённые visual_score кандидатов, их порядок и маску валидности.
+    """
+    tables = _get_smart_color_tables(tuple(hue_names))
+    dom_cfg, sec_cfg = SMART_DOM_CONFIG, SMART_SEC_CONFIG
+    with np.errstate(invalid='ignore'):
+        norm_brightness = inputs["norm_brightness"]
+        exact_gray = inputs["exact_gray"]
+
+        # --- БАЗОВЫЕ ВЕСА АХРОМАТИКИ ---
+        black_weight = inputs["dark"] * 1.0
+        black_weight = np.where(
+            norm_brightness >= 0.65,
+            black_weight + ((0.65 - norm_brightness) / 0.65) * dom_cfg["bright_black_penalty"],
+            black_weight
+        )
+        white_weight = inputs["bright"] * 1.0
+        white_weight = np.where(exact_gray > 0.15, white_weight + dom_cfg["white_gray_boost"], white_weight)
+        gray_weight = exact_gray * dom_cfg["base_gray_mult"]
+
+        # ЭТАП 1: ВЕСА DOM
+        tw = inputs["tw"]
+        total_hue_pixels = inputs["hv"] + inputs["mv"] + inputs["lv"]
+        has_pixels = total_hue_pixels > 0
+        safe_total = np.where(has_pixels, total_hue_pixels, 1.0)
+        dark_ratio_in_color = inputs["lv"] / safe_total
+        bright_ratio_in_color = inputs["hv"] / safe_total
+        sat_ratio_in_color = inputs["hs"] / safe_total
+
+        effective_sat_ratio = np.minimum(1.0, sat_ratio_in_color * tables["dom_sat_mult"])
+        pure_color_weight = tw * (
+            1.0
+            - dom_cfg["color_dark_penalty"] * dark_ratio_in_color
+            - dom_cfg["color_bright_penalty"] * bright_ratio_in_color
+        )
+        pure_color_weight = pure_color_weight * (1.0 + (dom_cfg["color_sat_boost"] * effective_sat_ratio))
+        active = has_pixels & (tw > 0)
+
+        dom_black = black_weight
+        dom_white = white_weight
+        # Перенос веса в чёрный/белый накапливается по оттенкам по порядку, как в скалярной версии
+        for j in range(len(hue_names)):
+            dom_black = dom_black + np.where(
+                active[:, j], tw[:, j] * dom_cfg["color_to_black_transfer"] * dark_ratio_in_color[:, j], 0.0
+            )
+            dom_white = dom_white + np.where(
+                active[:, j], tw[:, j] * dom_cfg["color_to_white_transfer"] * bright_ratio_in_color[:, j], 0.0
+            )
+
+        dom_weights = np.column_stack([dom_black, dom_white, gray_weight, np.where(active, pure_color_weight, tw)])
+        # Первый максимум — как первый элемент устойчивой сортировки по убыванию
+        dom_idx = np.argmax(dom_weights, axis=1)
+
+        # ЭТАП 2: КАНДИДАТЫ SEC
+        raw = np.column_stack([black_weight, white_weight, gray_weight, tw])
+        valid = raw >= sec_cfg["min_sec_weight"]
+        order = np.argsort(-raw, axis=1, kind='stable')
+
+        # ЭТАП 3: VISUAL SCORE
+        mono = (inputs["gray"] > 0.55).astype(np.intp)
+        multiplier = tables["base_mult"][mono, dom_idx]
+        heavy_only = tables["heavy_only"][dom_idx]
+        color_on_achro = tables["color_on_achro"][dom_idx]
+        weight_source = tables["weight_source"][dom_idx]
+
+        multiplier = np.where(heavy_only & ~(raw > sec_cfg["achro_weight_threshold"]), 0.0, multiplier)
+        multiplier = np.where(
+            color_on_achro & (raw < sec_cfg["small_color_threshold"]),
+            multiplier * sec_cfg["small_color_boost"], multiplier
+        )
+        multiplier = np.where(
+            color_on_achro & (inputs["high_sat"] > sec_cfg["high_sat_threshold"])[:, None],
+            multiplier * sec_cfg["high_sat_boost"], multiplier
+        )
+        cand_weight = np.where(
+            weight_source == 1, (inputs["dark_low_sat"] * sec_cfg["black_on_color_base"])[:, None],
+            np.where(
+                weight_source == 2, (inputs["bright_low_sat"] * sec_cfg["white_on_color_base"])[:, None],
+                raw
+            )
+        )
+
+        positive = multiplier > 0.0
+        sec_effective_sat = np.minimum(1.0, sat_ratio_in_color * tables["sec_sat_mult"])
+        sat_boost = np.ones_like(raw)
+        sat_boost[:, len(SMART_ACHROMATIC):] = np.where(
+            has_pixels, 1.0 + (sec_cfg["color_sat_boost"] * sec_effective_sat), 1.0
+        )
+        multiplier = np.where(positive & ~tables["achromatic"], multiplier * sat_boost, multiplier)
+        visual_score = np.where(positive, cand_weight * multiplier, 0.0)
+
+        sec_candidates = valid & positive & (visual_score > -1.0)
+        sec_idx = _first_best(np.where(sec_candidates, visual_score, -np.inf), order)
+
+        # ЭТАП 4: TER — сравнение идёт по округлённому visual_score
+        rounded = np.where(positive, _round2(visual_score), 0.0)
+        cand_index = np.arange(len(tables["names"]))
+        ter_candidates = (
+            valid & ~tables["achromatic"]
+            & (cand_index != dom_idx[:, None]) & (cand_index != sec_idx[:, None])
+            & (rounded >= SMART_TER_MIN_SCORE)
+        )
+        dom_sec_blue = (dom_idx == tables["blue"]) | (sec_idx == tables["blue"])
+        dom_sec_cyan = (dom_idx == tables["cyan"]) | (sec_idx == tables["cyan"])
+        if tables["cyan"] >= 0:
+            ter_candidates[:, tables["cyan"]] &= ~dom_sec_blue
+        if tables["blue"] >= 0:
+            ter_candidates[:, tables["blue"]] &= ~dom_sec_cyan
+        ter_idx = _first_best(np.where(ter_candidates, rounded, -np.inf), order)
+
+    return {
+        "names": tables["names"],
+        "dom": dom_idx,
+        "sec": sec_idx,
+        "ter": ter_idx,
+        "dom_weights": dom_weights,
+        "raw": raw,
+        "valid": valid,
+        "order": order,
+        "visual_score": rounded,
+    }
+
+
+def _color_triples(result):
+    names = result["names"]
+
+    def name(idx):
+        return names[idx] if idx >= 0 else None
+
+    return [
+        (name(d), name(s), name(t))
+        for d, s, t in zip(result["dom"].tolist(), result["sec"].tolist(), result["ter"].tolist())
+    ]
+
+
+def get_smart_colors_batch(inputs, hue_names=HUE_COLORS):
+    """
+    Пакетный расчёт умных цветов: inputs — массивы из smart_color_inputs.
+    Возвращает список из N троек (dom_color, sec_color, ter_color); отсутствующий цвет — None.
+    """
+    return _color_triples(_evaluate_smart_colors(inputs, hue_names))
+
+
+def get_smart_colors(b_dist, s_dist, h_dist, norm_brightness):
+    """
+    Умные цвета одного изображения — обёртка над пакетной версией.
+    Возвращает (dom_color, sec_color, ter_color, valid_colors, dom_weights).
+    """
+    hue_names = tuple(h_dist.keys())
+    inputs = smart_color_inputs([b_dist], [s_dist], [h_dist], [norm_brightness], hue_names)
+    result = _evaluate_smart_colors(inputs, hue_names)
+    names = result["names"]
+    dom_color, sec_color, ter_color = _color_triples(result)[0]
+
+    dom_weights = {name: float(weight) for name, weight in zip(names, result["dom_weights"][0])}
+    valid_colors = [
+        {
+            "name": names[j],
+            "weight": float(result["raw"][0, j]),
+            "visual_score": float(result["visual_score"][0, j]),
+        }
+        for j in result["order"][0].tolist()
+        if result["valid"][0, j]
+    ]
+    return dom_color, sec_color, ter_color, valid_colors, dom_weights
+
+
+# Влияние доминирующих цветов на итоговую яркость (сортировка dark/light)
+BRIGHTNESS_COLOR_WEIGHTS = {
+    'yellow': -0.02,
+    'blue': 0.01,
+    'green': -0.003,
+    'cyan': -0.005,
+    'red': 0.002,
+    'purple': 0.005,
+    'orange': -0.007
+}
+
+WARM_COLORS = ('red', 'orange', 'yellow')
+COLD_COLORS = ('green', 'cyan', 'blue', 'purple')
+
+
+class ImageColorFeatures:
+    """
+    Результат цветового анализа одного изображения.
+    Попиксельная работа выполняется один раз (в from_image), а все производные
+    метрики — яркость, насыщенность, итоговый оттенок, теплота, умные цвета —
+    считаются лениво при первом обращении и запоминаются.
+    Поэтому смена критерия сортировки не требует повторного анализа пикселей.
+
+    Внутри хранится компактный вектор сырых счётчиков (см. pack_feature_vector):
+    из него без потерь восстанавливаются распределения, и именно он кладётся в кэш.
+    """
+
+    def __init__(self, vector):
+        self.vector = vector
+        self._final_hues = {}
+
+    @classmethod
+    def from_pixels(cls, rgb):
+        counts, total_brightness_sum, hue_counts, descriptor_counts = compute_color_histograms(rgb)
+        return cls(pack_feature_vector(counts, total_brightness_sum, hue_counts, len(rgb), descriptor_counts))
+
+    @classmethod
+    def from_image(cls, image, mode=None):
+        return cls.from_pixels(prepare_analysis_pixels(image, mode))
+
+    @classmethod
+    def from_image_bytes(cls, data, mode=None):
+        """Анализ по байтам файла; исходный объект Image вызывающего не затрагивается."""
+        with Image.open(io.BytesIO(data)) as image:
+            return cls.from_image(image, mode)
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(np.frombuffer(data, dtype=np.float64).copy())
+
+    def to_bytes(self):
+        return self.vector.astype(np.float64).tobytes()
+
+    @cached_property
+    def distributions(self):
+        return build_distributions(*unpack_feature_vector(self.vector))
+
+    @property
+    def brightness_distribution(self):
+        return self.distributions[0]
+
+    @property
+    def saturation_distribution(self):
+        return self.distributions[1]
+
+    @property
+    def hue_distribution(self):
+        return self.distributions[2]
+
+    @cached_property
+    def normalized_brightness(self):
+        return calculate_normalized_brightness(self.brightness_distribution, self.saturation_distribution)
+
+    @cached_property
+    def total_saturation(self):
+        s_dist = self.saturation_distribution
+        return s_dist.get('gray', 0) * 0.0 + s_dist.get('medium', 0) * 0.5 + s_dist.get('high', 0) * 1.0
+
+    @cached_property
+    def smart_colors(self):
+        """Результат get_smart_colors: (dom, sec, ter, valid_colors, dom_weights)."""
+        return get_smart_colors(
+            self.brightness_distribution, self.saturation_distribution,
+            self.hue_distribution, self.normalized_brightness
+        )
+
+    @cached_property
+    def top_colors(self):
+        """Топ-3 оттенка по весу tw."""
+        return sorted(
+            ((color, data["tw"]) for color, data in self.hue_distribution.items() if data["tw"] > 0),
+            key=lambda x: x[1],
+            reverse=True
+        )[:3]
+
+    @cached_property
+    def color_descriptor(self):
+        """Квантованная HSV-гистограмма, нормированная на число пикселей (float32)."""
+        counts = self.vector[_DESCRIPTOR_OFFSET:]
+        total = counts.sum()
+        if total <= 0:
+            return np.zeros(DESCRIPTOR_SIZE, dtype=np.float32)
+        return (counts / total).astype(np.float32)
+
+    def encoded_color_descriptor(self):
+        """Поле color_desc для записи поста в art_posts."""
+        return encode_color_descriptor(self.color_descriptor)
+
+    def final_hue(self, criterion):
+        """Итоговый оттенок (hue_finele) с запоминанием по критерию."""
+        if criterion not in self._final_hues:
+            self._final_hues[criterion] = hue_finele(self.hue_distribution, criterion)
+        return self._final_hues[criterion]
+
+    def analysis_record(self, colors=None):
+        """
+        Поле analysis для записи поста в art_posts.
+        colors — готовая тройка (dom, sec, ter), например из recompute_smart_colors.
+        """
+        dom_color, sec_color, ter_color, *_ = colors or self.smart_colors
+        return {
+            "br": round(self.normalized_brightness, 2),
+            "sat": round(self.total_saturation, 2),
+            "dom_color": dom_color,
+            "sec_color": sec_color,
+            "ter_color": ter_color
+        }
+
+    def brightness_score(self, criterion):
+        """
+        Итоговая яркость для сортировки dark/light (чем больше, тем раньше в списке).
+        """
+        brightness_distribution = self.brightness_distribution
+        saturation_distribution = self.saturation_distribution
+        top_colors = self.top_colors
+        normalized_brightness = self.normalized_brightness
+
+        # Корректировка по цветам
+        color_adjustment = 0
+        total_weight = sum(weight for _, weight in top_colors)
+        for color, weight in top_colors:
+            if color in BRIGHTNESS_COLOR_WEIGHTS:
+                influence = BRIGHTNESS_COLOR_WEIGHTS[color] * (weight / total_weight)
+                color_adjustment += influence
+
+        # Ограничение влияния цветов на диапазон [-0.2, +0.2]
+        color_adjustment = max(min(color_adjustment, 0.2), -0.2)
+
+        # Влияние серых пикселей
+        gray_ratio = saturation_distribution['gray']
+        middle_ratio = saturation_distribution['medium']
+        if (gray_ratio > 0.85 or middle_ratio > 0.8) and brightness_distribution['bright'] > 0.85:
+            # Если много серых пикселей или средняя насыщенность при высокой яркости, усиливаем яркость
+            color_adjustment *= (1 - gray_ratio)  # Уменьшаем влияние цветовой корректировки
+            normalized_brightness += 0.2 * gray_ratio  # Усиливаем базовую яркость
+
+        finale_brightness = max(min(normalized_brightness + color_adjustment, 1), 0)
+
+        if criterion == 'light':
+            # Обратная сортировка для 'light'
+            finale_brightness = 1 - finale_brightness
+        return finale_brightness
+
+    def saturation_score(self, criterion):
+        """
+        Итоговая насыщенность для сортировки saturated/desaturated.
+        """
+        brightness_distribution = self.brightness_distribution
+        saturation_distribution = self.saturation_distribution
+        final_hue = self.final_hue(criterion)
+
+        # Вычисляем averaged_saturation
+        gray_weight = -0.8  # Серым придаём больший вес
+        medium_weight = 4.4  # Средние пиксели имеют меньший вес
+        high_weight = 10.7  # Насыщенные пиксели имеют больший вес
+
+        brightness_boost_factor = brightness_distribution['bright']  # Используем яркость напрямую
+        if brightness_boost_factor > 0:
+            medium_weight *= 1.5 + brightness_boost_factor
+            high_weight *= 2 + brightness_boost_factor
+        else:
+            # Для низкой яркости можно оставить исходные значения или уменьшить веса
+            medium_weight *= 0.9
+            high_weight *= 0.9
+
+        averaged_saturation = (
+            saturation_distribution['gray'] * gray_weight +
+            saturation_distribution['medium'] * medium_weight +
+            saturation_distribution['high'] * high_weight
+        ) / (gray_weight + medium_weight + high_weight)
+
+        # Корректируем averaged_saturation в зависимости от яркости
+        bright_boost = 1.2  # Усиление при ярких пикселях
+        middle_boost = 1.1  # Усиление при средних пикселях
+        dark_damp = 0.1  # Ослабление при тёмных пикселях
+
+        # Дополнительный коэффициент нелинейного ослабления для "dark"
+        dark_penalty_scale = 2.0  # Множитель для усиления влияния высокой "dark"
+        dark_adjustment = brightness_distribution['dark'] ** dark_penalty_scale
+
+        brightness_factor = ((
+            brightness_distribution['bright'] * bright_boost +
+            brightness_distribution['medium'] * middle_boost +
+            brightness_distribution['dark'] * (1 - dark_damp) -
+            dark_adjustment  # Учитываем нелинейное влияние "dark"
+        ) / (bright_boost + middle_boost + dark_damp)) - (
+            ((brightness_distribution['bright'] * 2) + brightness_distribution['medium'] + brightness_distribution['dark']) / 6.5
+        )
+
+        # Суммируем значения для учета их в одной переменной
+        combined_value = (saturation_distribution['gray']) + (brightness_distribution['dark']) - (saturation_distribution['medium'] / 2) - (saturation_distribution['high'] / 2)
+
+        # Используем сдвиг для того, чтобы снижение начиналось при значении примерно 1
+        shift_start = 1  # Начало сильного сдвига
+        shift_factor = 4  # Сила сдвига, можно настроить
+        final_brightness_factor = brightness_factor / (1 + math.exp((combined_value - shift_start) * shift_factor))
+
+        averaged_saturation = max(0, min(1, averaged_saturation + final_brightness_factor))
+
+        # Усиление для теплых и холодных оттенков
+        warm_hue_boost = 0.04
+        cold_hue_damp = 0.04
+        max_adjustment = 0.1
+
+        # Стандартное отклонение для гауссовой функции (ширина изменения)
+        sigma = 30  # Чем меньше значение, тем резче спад влияния
+
+        # Рассчитываем вес в зависимости от final_hue
+        if (0 <= final_hue <= 140) or (330 <= final_hue <= 360):  # Тёплые оттенки
+            weight_90 = gaussian_weight(final_hue, 90, sigma) if final_hue <= 140 else 0
+            weight_350 = gaussian_weight(final_hue, 350, sigma) if final_hue >= 330 else 0
+            weight = max(weight_90, weight_350)  # Выбираем наибольшее влияние
+            adjustment = warm_hue_boost * weight
+            finale_Saturation = averaged_saturation + min(max_adjustment, adjustment)
+
+        elif 140 < final_hue < 330:  # Холодные оттенки
+            weight = gaussian_weight(final_hue, 240, sigma)
+            adjustment = cold_hue_damp * weight
+            finale_Saturation = averaged_saturation - min(max_adjustment, adjustment)
+
+        else:  # Предохранитель для значений вне диапазона
+            finale_Saturation = averaged_saturation
+
+        # Ограничиваем результат в пределах [0, 1]
+        finale_Saturation = max(0, min(1, finale_Saturation))
+
+        if criterion == 'desaturated':
+            # Обратная сортировка для 'desaturated'
+            finale_Saturation = 1 - finale_Saturation
+        return finale_Saturation
+
+    @cached_property
+    def warmth_score(self):
+        """
+        Метрика для сортировки от тёплых к холодным.
+        """
+        brightness_distribution = self.brightness_distribution
+        saturation_distribution = self.saturation_distribution
+        hue_distribution = self.hue_distribution
+
+        normalized_brightness = (
+            0.2 * brightness_distribution['dark'] +
+            0.5 * brightness_distribution['medium'] +
+            0.8 * brightness_distribution['bright']
+        )
+
+        normalized_saturation = (
+            0.1 * saturation_distribution['gray'] +
+            0.6 * saturation_distribution['medium'] +
+            0.9 * saturation_distribution['high']
+        )
+
+        warm_tw = sum(hue_distribution[color]['tw'] for color in WARM_COLORS)
+        cold_tw = sum(hue_distribution[color]['tw'] for color in COLD_COLORS)
+        total_tw = sum(hue_distribution[color]['tw'] for color in hue_distribution)
+
+        final_warm = (warm_tw - cold_tw) / total_tw if total_tw > 0 else 0
+
+        return (
+            0.6 * final_warm +  # Влияние цветов
+            0.3 * normalized_brightness +  # Влияние яркости
+            0.1 * (1 - normalized_saturation)  # Влияние насыщенности
+        )
+
+
+def recompute_smart_colors(features_list):
+    """
+    Пересчитывает (dom_color, sec_color, ter_color) для списка ImageColorFeatures
+    одним пакетом — без повторного анализа пикселей (например, после правки SMART_*_CONFIG).
+    """
+    if not features_list:
+        return []
+    distributions = [features.distributions for features in features_list]
+    inputs = smart_color_inputs(
+        [d[0] for d in distributions],
+        [d[1] for d in distributions],
+        [d[2] for d in distributions],
+        [features.normalized_brightness for features in features_list],
+    )
+    return get_smart_colors_batch(inputs)
+
+
+# --- ПУЛ ПРОЦЕССОВ ДЛЯ АНАЛИЗА ---
+# Анализ пикселей — чистая работа CPU. Чтобы не блокировать цикл событий бота,
+# изображения уходят в отдельные процессы в виде байтов файла, а обратно
+# возвращается только компактный вектор признаков.
+# COLOR_POOL_WORKERS=0 — считать в потоке без отдельных процессов.
+# Процессы порождает forkserver, а не fork: в боте уже крутятся потоки (Flask,
+# Firebase, asyncio.to_thread), и fork мог унести в ребёнка захваченную блокировку
+# (logging, sqlite). Сервер заранее импортирует этот модуль; главный модуль
+# (bot.py) рабочие процессы импортируют как __mp_main__, без запуска main().
+
+COLOR_POOL_WORKERS = int(os.environ.get("COLOR_POOL_WORKERS", min(4, os.cpu_count() or 1)))
+
+_COLOR_POOL = None
+_COLOR_POOL_LOCK = threading.Lock()
+
+
+def get_color_pool():
+    """Общий ProcessPoolExecutor (создаётся при первом обращении)."""
+    global _COLOR_POOL
+    with _COLOR_POOL_LOCK:
+        if _COLOR_POOL is None:
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload([__name__])
+            _COLOR_POOL = ProcessPoolExecutor(max_workers=COLOR_POOL_WORKERS, mp_context=context)
+            logging.info(f"[COLOR POOL] Запущен пул из {COLOR_POOL_WORKERS} процессов")
+    return _COLOR_POOL
+
+
+def _reset_color_pool():
+    global _COLOR_POOL
+    with _COLOR_POOL_LOCK:
+        if _COLOR_POOL is not None:
+            _COLOR_POOL.shutdown(wait=False, cancel_futures=True)
+        _COLOR_POOL = None
+
+
+def _analyze_bytes_worker(data, mode):
+    """Выполняется в дочернем процессе: байты файла -> байты вектора признаков."""
+    return ImageColorFeatures.from_image_bytes(data, mode).to_bytes()
+
+
+async def analyze_images_colors_batch(images, mode=None):
+    """
+    Анализирует пачку изображений параллельно в пуле процессов.
+
+    :param images: Список байтов файлов изображений (JPEG/PNG/...).
+    :param mode: Режим декодирования ("exact" или "fast").
+    :return: Список ImageColorFeatures в том же порядке; None для изображений,
+             которые не удалось проанализировать.
+    """
+    if not images:
+        return []
+    mode = resolve_analysis_mode(mode)
+
+    if COLOR_POOL_WORKERS <= 0:
+        tasks = [asyncio.to_thread(_analyze_bytes_worker, data, mode) for data in images]
+    else:
+        loop = asyncio.get_running_loop()
+        pool = get_color_pool()
+        tasks = [loop.run_in_executor(pool, _analyze_bytes_worker, data, mode) for data in images]
+
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    features = []
+    for result in results:
+        if isinstance(result, BaseException):
+            logging.error(f"[COLOR POOL] Ошибка анализа изображения: {result}")
+            if isinstance(result, BrokenProcessPool):
+                _reset_color_pool()
+            features.append(None)
+        else:
+            features.append(ImageColorFeatures.from_bytes(result))
+    return features
+
+
+# --- ПОСТОЯННЫЙ КЭШ ПРИЗНАКОВ ---
+# Ключ — file_unique_id фото из Telegram (или URL, если изображение пришло не из Telegram).
+# Значение — компактный вектор признаков ImageColorFeatures (~0.5 КБ на изображение).
+# При превышении бюджета удаляются давно не использованные записи (LRU).
+
+FEATURE_VERSION = 2  # Увеличить при изменении формата вектора или логики анализа
+
+COLOR_CACHE_PATH = os.environ.get("COLOR_CACHE_PATH", os.path.join(os.getcwd(), "color_cache.sqlite3"))
+COLOR_CACHE_MAX_BYTES = int(os.environ.get("COLOR_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+
+
+class ColorFeatureCache:
+    """
+    Кэш векторов признаков в SQLite с LRU-вытеснением по суммарному размеру.
+    Потокобезопасен: одно соединение защищено блокировкой.
+
+    Методы синхронные (SQLite); из асинхронного кода их вызывают через
+    asyncio.to_thread, чтобы не блокировать цикл событий.
+    Время последнего обращения копится в памяти и пишется пачкой
+    (TOUCH_FLUSH_SIZE записей, раз в TOUCH_FLUSH_SECONDS или перед вытеснением),
+    суммарный размер записей считается на ходу, а не запросом SUM на каждую запись.
+    """
+
+    TOUCH_FLUSH_SIZE = 256
+    TOUCH_FLUSH_SECONDS = 30.0
+    _SELECT_CHUNK = 500  # Ограничение SQLite на число параметров запроса
+
+    def __init__(self, path=COLOR_CACHE_PATH, max_bytes=COLOR_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS features ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS features_last_used ON features(last_used)")
+        self._conn.commit()
+        self._total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM features").fetchone()[0]
+        # Ключ -> время последнего обращения, ещё не записанное в базу
+        self._touched = {}
+        self._last_flush = time.monotonic()
+
+    @staticmethod
+    def _key(key, mode=None):
+        # Признаки режима fast хранятся отдельно, чтобы не подменять эталонные
+        if resolve_analysis_mode(mode) == "fast":
+            return f"v{FEATURE_VERSION}:fast:{key}"
+        return f"v{FEATURE_VERSION}:{key}"
+
+    def get(self, key, mode=None):
+        """Возвращает ImageColorFeatures или None, если записи нет."""
+        return self.get_many([key], mode)[0]
+
+    def get_many(self, keys, mode=None):
+        """Признаки для списка ключей одним запросом на пачку; None там, где записи нет."""
+        db_keys = [self._key(key, mode) if key else None for key in keys]
+        wanted = [db_key for db_key in db_keys if db_key]
+        found = {}
+        try:
+            with self._lock:
+                for start in range(0, len(wanted), self._SELECT_CHUNK):
+                    chunk = wanted[start:start + self._SELECT_CHUNK]
+                    placeholders = ",".join("?" * len(chunk))
+                    found.update(self._conn.execute(
+                        f"SELECT key, vector FROM features WHERE key IN ({placeholders})", chunk
+                    ))
+                now = time.time()
+                for db_key in found:
+                    self._touched[db_key] = now
+                if (len(self._touched) >= self.TOUCH_FLUSH_SIZE
+                        or time.monotonic() - self._last_flush >= self.TOUCH_FLUSH_SECONDS):
+                    self._flush_touched()
+                    self._conn.commit()
+        except sqlite3.Error as e:
+            logging.error(f"[COLOR CACHE] Ошибка чтения {len(wanted)} записей: {e}")
+            return [None] * len(keys)
+        return [
+            ImageColorFeatures.from_bytes(found[db_key]) if db_key in found else None
+            for db_key in db_keys
+        ]
+
+    def put(self, key, features, mode=None):
+        if not key:
+            return
+        db_key = self._key(key, mode)
+        data = features.to_bytes()
+        try:
+            with self._lock:
+                row = self._conn.execute("SELECT size FROM features WHERE key = ?", (db_key,)).fetchone()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO features (key, vector, size, last_used) VALUES (?, ?, ?, ?)",
+                    (db_key, data, len(data), time.time())
+                )
+                self._touched.pop(db_key, None)
+                self._total += len(data) - (row[0] if row else 0)
+                if self._total > self.max_bytes:
+                    self._flush_touched()
+                    self._evict()
+                self._conn.commit()
+        except sqlite3.Error as e:
+            logging.error(f"[COLOR CACHE] Ошибка записи {key}: {e}")
+
+    def flush(self):
+        """Записывает накопленные времена обращений (например, перед остановкой)."""
+        try:
+            with self._lock:
+                self._flush_touched()
+                self._conn.commit()
+        except sqlite3.Error as e:
+            logging.error(f"[COLOR CACHE] Ошибка записи времени обращений: {e}")
+
+    def _flush_touched(self):
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE features SET last_used = ? WHERE key = ?",
+                [(used, db_key) for db_key, used in self._touched.items()]
+            )
+            self._touched.clear()
+        self._last_flush = time.monotonic()
+
+    def _evict(self):
+        excess = self._total - self.max_bytes
+        freed = 0
+        victims = []
+        for key, size in self._conn.execute("SELECT key, size FROM features ORDER BY last_used ASC"):
+            victims.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        self._conn.executemany("DELETE FROM features WHERE key = ?", victims)
+        self._total -= freed
+        logging.info(f"[COLOR CACHE] Вытеснено {len(victims)} записей ({freed} байт)")
+
+
+_FEATURE_CACHE = None
+_FEATURE_CACHE_LOCK = threading.Lock()
+
+
+def get_feature_cache():
+    """Общий экземпляр кэша (создаётся при первом обращении)."""
+    global _FEATURE_CACHE
+    with _FEATURE_CACHE_LOCK:
+        if _FEATURE_CACHE is None:
+            _FEATURE_CACHE = ColorFeatureCache()
+            atexit.register(_FEATURE_CACHE.flush)
+    return _FEATURE_CACHE
+
+
+def feature_cache_key(item):
+    """Ключ кэша для элемента media: file_unique_id, а если его нет — file_id/URL."""
+    return item.get('file_unique_id') or item.get('file_id')
@@ -0,0 +1,1164 @@
+"""
+Поиск по галерее art_posts: нормализация текста, стемминг и инвертированный индекс.
+
+Индекс строится один раз при (пере)загрузке кэша постов в gpt_helper
+и используется эндпоинтом /api/anemone/search вместо посимвольного
+сравнения запроса с каждым постом.
+"""
+import base64
+import bisect
+import copy
+import hashlib
+import json
+import math
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+
+from color_analysis import DESCRIPTOR_SIZE, decode_color_descriptors
+
+# Быстрый JSON-кодировщик необязателен: без него — стандартный json
+HAS_ORJSON = False
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    pass
+
+# Поля поста, по которым идёт текстовый поиск
+TEXT_FIELDS = ('caption', 'ai_des_ru', 'ai_style_ru')
+
+# --- BM25 (режим sort=relevance) ---
+# Веса полей: подпись автора важнее длинного AI-описания
+FIELD_WEIGHTS = {
+    'caption': 2.0,
+    'ai_des_ru': 1.0,
+    'ai_style_ru': 1.5,
+}
+BM25_K1 = 1.2   # Насыщение частоты слова: чем больше, тем дольше растёт вклад повторов
+BM25_B = 0.75   # Нормализация по длине поля: 0 — не учитывать длину, 1 — полностью
+
+# --- Кэш упорядоченных выдач (курсорная пагинация) ---
+RESULT_CACHE_TTL = 300                   # Секунд жизни выдачи (как у кэша постов)
+RESULT_CACHE_MAX_BYTES = 16 * 1024 * 1024  # Потолок памяти на все выдачи
+RESULT_WINDOW = 500   # Сколько первых документов выдачи упорядочивать сразу (окно растёт по мере пролистывания)
+
+# --- Нечёткий поиск (опечатки) ---
+FUZZY_MIN_WORD = 4          # Более короткие слова запроса не исправляются
+FUZZY_MAX_EXPANSIONS = 5    # Сколько ближайших слов словаря подставлять вместо слова с опечаткой
+FUZZY_CACHE_SIZE = 4096     # Сколько исправленных слов помнить на одну сборку индекса
+
+# --- Обновление индекса патчами (GallerySearchIndex.patched) ---
+# Доля документов, изменённых патчами после полной сборки, при которой индекс
+# собирается заново: заодно обновляется статистика BM25
+INDEX_PATCH_MAX_FRACTION = 0.1
+
+# --- Похожие посты (similar_to) ---
+# Вес расстояния между цветовыми дескрипторами (color_desc, L1 от 0 до 2):
+# при 14 оно занимает тот же диапазон 0..28, что и штраф за несовпадение dom/sec/ter
+SIMILAR_DESC_WEIGHT = 14.0
+
+# --- Автодополнение ---
+SUGGEST_LIMIT = 8           # Подсказок по умолчанию
+
+_WORD_RE = re.compile(r'\w+')
+_EMPTY_POSTING = np.empty(0, dtype=np.int32)
+_EMPTY_TF = np.empty(0, dtype=np.float64)
+_ARRAY_OVERHEAD = sys.getsizeof(_EMPTY_POSTING)  # Заголовок объекта numpy-массива
+
+
+def normalize_text(text):
+    """Приводит текст к нижнему регистру и меняет ё на е."""
+    if not text: return ""
+    return str(text).lower().replace('ё', 'е')
+
+
+def get_word_stem(word):
+    """
+    Простой стеммер для русского языка.
+    Отсекает окончания, но бережно относится к коротким словам.
+    """
+    if len(word) <= 3:
+        return word
+
+    # Список основных окончаний (от длинных к коротким, чтобы сначала отрезать 'ая', а не 'а')
+    endings = [
+        'ами', 'ями', 'ов', 'ев', 'ей', 'ом', 'ем', 'ах', 'ях', 'ую', 'юю',
+        'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ый', 'ий', 'ой', 'ся', 'сь',
+        'а', 'я', 'о', 'е', 'ь', 'ы', 'и', 'у', 'ю'
+    ]
+
+    for end in endings:
+        if word.endswith(end):
+            # Проверка: если отрезать окончание, останется ли корень длиннее 2 букв?
+            # Это защищает слова типа "дом" (чтобы не отрезать 'ом' и получить 'д')
+            if len(word) - len(end) >= 2:
+                return word[:-len(end)]
+    return word
+
+
+def tokenize(text):
+    """Слова нормализованного текста: последовательности \\w после normalize_text."""
+    return _WORD_RE.findall(normalize_text(text))
+
+
+def word_trigrams(word):
+    """Символьные триграммы слова с пробелом по краям: 'кот' -> ' ко', 'кот', 'от '."""
+    padded = f" {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a, b, limit):
+    """
+    Расстояние Дамерау-Левенштейна (перестановка соседних букв — одна правка)
+    между a и b, если оно не больше limit; иначе limit + 1.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev_prev = None
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        row = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            row[j] = min(prev[j] + 1, row[j - 1] + 1, prev[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                row[j] = min(row[j], prev_prev[j - 2] + 1)
+        if min(row) > limit:
+            return limit + 1
+        prev_prev, prev = prev, row
+    return min(prev[-1], limit + 1)
+
+
+def post_text_fields(post):
+    return [str(post.get(field, '')) for field in TEXT_FIELDS]
+
+
+def term_key(word, stem_of=None):
+    """
+    Ключ слова для подсчёта BM25: слова длиннее 3 букв сравниваются по основе,
+    короткие — только точно (как при поиске слова в word_postings). Пространства ключей не пересекаются.
+    """
+    if len(word) <= 3:
+        return "=" + word
+    if stem_of is None:
+        return get_word_stem(word)
+    stem = stem_of.get(word)
+    if stem is None:
+        stem = stem_of[word] = get_word_stem(word)
+    return stem
+
+
+# Фасеты галереи: цвет на любой позиции, доминирующий, вторичный (sec или ter —
+# как фильтр sec_color), AI-стиль, год и месяц публикации
+FACET_NAMES = ('color', 'dom_color', 'sec_color', 'style', 'year', 'month')
+# Значения, которые есть в базе, но не показываются в счётчиках фасетов
+_HIDDEN_FACET_VALUES = ('', 'none')
+
+
+def dumps_json(value):
+    """Компактный JSON в bytes (UTF-8, ключи по алфавиту, как у jsonify)."""
+    if HAS_ORJSON:
+        try:
+            return orjson.dumps(value, option=orjson.OPT_SORT_KEYS)
+        except TypeError:
+            pass  # Например, целое больше 64 бит — стандартный json справится
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def post_public_item(post):
+    """Публичное представление поста в выдаче /api/anemone/search."""
+    return {
+        "post_id": post.get('post_id'),
+        "file_id": post.get('file_id'),
+        "caption": post.get('caption'),
+        "post_link": f"https://t.me/{post.get('channel_id', 'anemonn').replace('@', '')}/{post.get('post_id')}",
+        "original_link": post.get('original_link'),
+        "ai_des": post.get('ai_des_ru'),
+        "ai_style": post.get('ai_style_ru'),
+        "date": datetime.fromtimestamp(post.get('date', 0)).strftime('%d.%m.%Y') if post.get('date') else "",
+        "analysis": post.get('analysis')
+    }
+
+
+def _as_float(value, default=0.0):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+# Колонки GalleryColumns по документам и их значения для поста без данных
+_ROW_DEFAULTS = (
+    ('photo_ok', False), ('br', 0.0), ('sat', 0.0), ('date', 0.0), ('date_valid', True),
+    ('dom', -1), ('sec', -1), ('ter', -1), ('caption', -1), ('style', -1),
+    ('has_desc', False), ('color_desc', 0.0),
+)
+
+
+def _resized(values, count, default):
+    """Копия массива длины count: лишнее отрезается, недостающее заполняется default."""
+    if count <= len(values):
+        return values[:count].copy()
+    tail = np.full((count - len(values),) + values.shape[1:], default, dtype=values.dtype)
+    return np.concatenate([values, tail])
+
+
+class GalleryColumns:
+    """
+    Параллельные NumPy-колонки по постам кэша (позиция = документ индекса)
+    для векторной фильтрации в /api/anemone/search.
+
+    Цвета закодированы целыми числами по словарю color_codes
+    (строки нормализованы так же, как в эндпоинте: str(...).lower()).
+    """
+
+    def __init__(self, posts):
+        count = len(posts)
+        self.photo_ok = np.zeros(count, dtype=bool)
+        self.br = np.zeros(count, dtype=np.float64)
+        self.sat = np.zeros(count, dtype=np.float64)
+        self.date = np.zeros(count, dtype=np.float64)
+        # Нечисловая дата: такой пост не отсекается фильтром по датам (как раньше при ошибке сравнения)
+        self.date_valid = np.ones(count, dtype=bool)
+        self.dom = np.full(count, -1, dtype=np.int32)
+        self.sec = np.full(count, -1, dtype=np.int32)
+        self.ter = np.full(count, -1, dtype=np.int32)
+        self.color_codes = {}
+        # Подпись (strip + lower) тоже кодируется целым: одинаковые подписи — один код
+        self.caption = np.full(count, -1, dtype=np.int32)
+        self.caption_codes = {}
+        # str(post_id) -> документы (для поиска поста similar_to без прохода по списку)
+        self.post_docs = {}
+        # AI-стиль (normalize_text + strip), кодируется как подпись
+        self.style = np.full(count, -1, dtype=np.int32)
+        self.style_codes = {}
+        # Цветовой дескриптор поста (поле color_desc): строка матрицы (N, DESCRIPTOR_SIZE)
+        self.has_desc = np.zeros(count, dtype=bool)
+        self.color_desc = np.zeros((count, DESCRIPTOR_SIZE), dtype=np.float32)
+
+        for doc, post in enumerate(posts):
+            if isinstance(post, dict):
+                self._fill_row(doc, post)
+                self.post_docs.setdefault(str(post.get('post_id')), []).append(doc)
+
+        self._fill_descriptors(posts, range(count))
+        self._build_color_weights()
+        self.facets = GalleryFacets(self)
+
+    def _fill_row(self, doc, post):
+        """Значения колонок документа doc по посту (строка уже заполнена значениями по умолчанию)."""
+        self.photo_ok[doc] = post.get('status') == 'ok' and post.get('type') == 'photo'
+
+        analysis = post.get('analysis', {})
+        if not isinstance(analysis, dict):
+            analysis = {}
+        self.br[doc] = _as_float(analysis.get('br', 0))
+        self.sat[doc] = _as_float(analysis.get('sat', 0))
+        self.dom[doc] = self._code(str(analysis.get('dom_color', '')).lower())
+        self.sec[doc] = self._code(str(analysis.get('sec_color', '')).lower())
+        self.ter[doc] = self._code(str(analysis.get('ter_color', '')).lower())
+
+        caption = str(post.get('caption', '')).strip().lower()
+        self.caption[doc] = self.caption_codes.setdefault(caption, len(self.caption_codes))
+        style = normalize_text(post.get('ai_style_ru', '')).strip()
+        self.style[doc] = self.style_codes.setdefault(style, len(self.style_codes))
+
+        date = post.get('date', 0)
+        if isinstance(date, (int, float)) and not isinstance(date, bool):
+            self.date[doc] = date
+        else:
+            self.date_valid[doc] = False
+
+    def _fill_descriptors(self, posts, docs):
+        """Дескрипторы color_desc документов docs, декодированные одним пакетом."""
+        docs = list(docs)
+        values = [posts[doc].get('color_desc') if isinstance(posts[doc], dict) else None for doc in docs]
+        positions, matrix = decode_color_descriptors(values)
+        rows = np.asarray(docs, dtype=np.int64)[positions]
+        self.has_desc[rows] = True
+        self.color_desc[rows] = matrix
+
+    def _build_color_weights(self):
+        """
+        Матрица весов цветов (N, число цветов): dom=3, sec=2, ter=1,
+        цвет, уже занятый более старшей позицией, повторно не учитывается.
+        """
+        count = len(self.dom)
+        rows = np.arange(count)
+        self.color_weights = np.zeros((count, len(self.color_codes)), dtype=np.float64)
+        has_dom = self.dom >= 0
+        self.color_weights[rows[has_dom], self.dom[has_dom]] += 3
+        has_sec = (self.sec >= 0) & (self.sec != self.dom)
+        self.color_weights[rows[has_sec], self.sec[has_sec]] += 2
+        has_ter = (self.ter >= 0) & (self.ter != self.dom) & (self.ter != self.sec)
+        self.color_weights[rows[has_ter], self.ter[has_ter]] += 1
+        # Пустой цвет ('') не считается совпадением
+        if '' in self.color_codes:
+            self.color_weights[:, self.color_codes['']] = 0
+
+    def patched(self, old_posts, posts, docs):
+        """
+        Колонки для posts — копии old_posts (по ним построены self), где документы
+        docs заменены или добавлены; хвост old_posts за концом posts удалён.
+        Пересчитываются только строки docs, self не меняется.
+        """
+        columns = copy.copy(self)
+        count = len(posts)
+        for name, default in _ROW_DEFAULTS:
+            setattr(columns, name, _resized(getattr(self, name), count, default))
+        columns.color_codes = dict(self.color_codes)
+        columns.caption_codes = dict(self.caption_codes)
+        columns.style_codes = dict(self.style_codes)
+        columns.post_docs = dict(self.post_docs)
+
+        # Прежние post_id изменённых и удалённых документов
+        for doc in sorted(set(docs) | set(range(count, len(old_posts)))):
+            old_post = old_posts[doc] if doc < len(old_posts) else None
+            if isinstance(old_post, dict):
+                key = str(old_post.get('post_id'))
+                remaining = [d for d in columns.post_docs.get(key, ()) if d != doc]
+                if remaining:
+                    columns.post_docs[key] = remaining
+                else:
+                    columns.post_docs.pop(key, None)
+
+        for doc in docs:
+            for name, default in _ROW_DEFAULTS:
+                getattr(columns, name)[doc] = default
+            post = posts[doc]
+            if isinstance(post, dict):
+                columns._fill_row(doc, post)
+                key = str(post.get('post_id'))
+                columns.post_docs[key] = sorted(columns.post_docs.get(key, []) + [doc])
+
+        columns._fill_descriptors(posts, docs)
+        columns._build_color_weights()
+        columns.facets = GalleryFacets(columns, base=self.facets, docs=docs)
+        return columns
+
+    def _code(self, value):
+        code = self.color_codes.get(value)
+        if code is None:
+            code = self.color_codes[value] = len(self.color_codes)
+        return code
+
+    def color_code(self, value):
+        """Код цвета из запроса; -1 — такого цвета нет ни у одного поста."""
+        return self.color_codes.get(value, -1)
+
+    def filter_mask(self, color=None, dom_color=None, sec_color=None, style=None,
+                    br_range=None, sat_min=None, sat_max=None, date_from=None, date_to=None):
+        """
+        Булева маска постов (фото со статусом ok), прошедших все заданные фильтры.
+        Цвета и стиль пересекаются готовыми битмапами фасетов.
+        br_range — (min, max) в шкале БД, любая граница может быть None.
+        date_from/date_to — timestamp границ, уже разобранные один раз на запрос.
+        """
+        mask = self.photo_ok.copy()
+        if color:
+            mask &= self.facets.bitmap('color', color)
+        if dom_color:
+            mask &= self.facets.bitmap('dom_color', dom_color)
+        if sec_color:
+            mask &= self.facets.bitmap('sec_color', sec_color)
+        if style:
+            mask &= self.facets.bitmap('style', style)
+        if br_range is not None:
+            br_low, br_high = br_range
+            if br_high is not None:
+                mask &= ~(self.br > br_high)
+            if br_low is not None:
+                mask &= ~(self.br < br_low)
+        if sat_min is not None:
+            mask &= ~(self.sat < sat_min)
+        if sat_max is not None:
+            mask &= ~(self.sat > sat_max)
+        if date_from is not None:
+            mask &= ~self.date_valid | ~(self.date < date_from)
+        if date_to is not None:
+            mask &= ~self.date_valid | ~(self.date > date_to)
+        return mask
+
+
+    def similar_penalties(self, target_doc, similar_to):
+        """
+        Штраф непохожести каждого поста на target_doc одним векторным выражением
+        (меньше — похожее). Те же веса, что были в similar_sort_key:
+        цвета dom/sec/ter (3/2/1), отклонения br и sat, бонус за одинаковую подпись.
+        Если у обоих постов есть color_desc, вместо dom/sec/ter сравниваются
+        дескрипторы (L1-расстояние гистограмм, вес SIMILAR_DESC_WEIGHT).
+        Сам пост similar_to получает -10000, чтобы всегда стоять первым.
+        """
+        # Целевой вектор цветов: dom=3, sec=2, ter=1 (совпадающие цвета складываются)
+        target = np.zeros(len(self.color_codes), dtype=np.float64)
+        empty = self.color_codes.get('')
+        for code, weight in ((self.dom[target_doc], 3), (self.sec[target_doc], 2), (self.ter[target_doc], 1)):
+            if code >= 0 and code != empty:
+                target[code] += weight
+
+        match_score = self.color_weights @ target
+        # Максимальный match_score = (3*3 + 2*2 + 1*1) = 14
+        color_penalty = (14 - match_score) * 2.0
+        if self.has_desc[target_doc]:
+            distance = np.abs(self.color_desc - self.color_desc[target_doc]).sum(axis=1)
+            color_penalty = np.where(self.has_desc, distance * SIMILAR_DESC_WEIGHT, color_penalty)
+        penalties = color_penalty + (
+            np.abs(self.br[target_doc] - self.br) * 20.0 + np.abs(self.sat[target_doc] - self.sat) * 10.0
+        )
+
+        t_caption = self.caption[target_doc]
+        if t_caption != self.caption_codes.get('', -1):
+            penalties = np.where(self.caption == t_caption, penalties - 100.0, penalties)
+
+        penalties[self.post_docs.get(similar_to, [])] = -10000.0
+        return penalties
+
+
+class GalleryFacets:
+    """
+    Битмапы фасетов: для каждого значения фасета — булев массив по документам.
+
+    Фасет хранится как несколько колонок кодов значений (у цвета на любой
+    позиции их три: dom, sec, ter; повтор цвета в посте обнулён в -1), так что
+    пост учитывается в значении не больше одного раза. Строится вместе с
+    GalleryColumns при загрузке кэша постов.
+    """
+
+    def __init__(self, columns, base=None, docs=()):
+        """
+        base — фасеты прежних колонок (см. GalleryColumns.patched): год и месяц
+        пересчитываются только у документов docs, битмапы — только у значений,
+        которые были или стали у этих документов.
+        """
+        count = len(columns.photo_ok)
+        colors = sorted(columns.color_codes, key=columns.color_codes.get)
+        sec = np.where(columns.sec != columns.dom, columns.sec, -1)
+        ter = np.where((columns.ter != columns.dom) & (columns.ter != columns.sec), columns.ter, -1)
+        ter_only = np.where(columns.ter != columns.sec, columns.ter, -1)
+
+        # Год и месяц публикации — по локальному времени, как фильтры date_from/date_to
+        dated = columns.date_valid & (columns.date > 0)
+        if base is None:
+            self.year = np.full(count, -1, dtype=np.int32)
+            self.month = np.full(count, -1, dtype=np.int32)
+            self.year_codes = {}
+            self.month_codes = {}
+            dated_docs = np.flatnonzero(dated).tolist()
+        else:
+            self.year = _resized(base.year, count, -1)
+            self.month = _resized(base.month, count, -1)
+            self.year_codes = dict(base.year_codes)
+            self.month_codes = dict(base.month_codes)
+            self.year[docs] = -1
+            self.month[docs] = -1
+            dated_docs = [doc for doc in docs if dated[doc]]
+        for doc in dated_docs:
+            try:
+                published = datetime.fromtimestamp(columns.date[doc])
+            except (OverflowError, OSError, ValueError):
+                continue
+            self.year[doc] = self.year_codes.setdefault(f"{published.year:04d}", len(self.year_codes))
+            self.month[doc] = self.month_codes.setdefault(
+                f"{published.year:04d}-{published.month:02d}", len(self.month_codes))
+
+        # фасет -> (значения по коду, колонки кодов)
+        self._facets = {
+            'color': (colors, (columns.dom, sec, ter)),
+            'dom_color': (colors, (columns.dom,)),
+            'sec_color': (colors, (columns.sec, ter_only)),
+            'style': (sorted(columns.style_codes, key=columns.style_codes.get), (columns.style,)),
+            'year': (sorted(self.year_codes, key=self.year_codes.get), (self.year,)),
+            'month': (sorted(self.month_codes, key=self.month_codes.get), (self.month,)),
+        }
+        self._empty = np.zeros(count, dtype=bool)
+        self.bitmaps = {}
+        if base is None:
+            for name, (values, code_columns) in self._facets.items():
+                bitmaps = {}
+                for code_column in code_columns:
+                    has_value = code_column >= 0
+                    for code in np.unique(code_column[has_value]).tolist():
+                        bitmap = bitmaps.get(values[code])
+                        if bitmap is None:
+                            bitmap = bitmaps[values[code]] = np.zeros(count, dtype=bool)
+                        bitmap |= code_column == code
+                self.bitmaps[name] = bitmaps
+            return
+
+        old_count = len(base._empty)
+        old_docs = [doc for doc in docs if doc < old_count] + list(range(count, old_count))
+        for name, (values, code_columns) in self._facets.items():
+            old_values, old_columns = base._facets[name]
+            bitmaps = base.bitmaps[name]
+            if count != old_count:
+                bitmaps = {value: _resized(bitmap, count, False) for value, bitmap in bitmaps.items()}
+            else:
+                bitmaps = dict(bitmaps)
+            affected = {
+                old_values[code] for code_column in old_columns
+                for code in code_column[old_docs].tolist() if code >= 0
+            }
+            affected.update(
+                values[code] for code_column in code_columns
+                for code in code_column[docs].tolist() if code >= 0
+            )
+            codes = {value: code for code, value in enumerate(values)}
+            for value in affected:
+                code = codes.get(value)
+                bitmap = np.zeros(count, dtype=bool)
+                if code is not None:
+                    for code_column in code_columns:
+                        bitmap |= code_column == code
+                if bitmap.any():
+                    bitmaps[value] = bitmap
+                else:
+                    bitmaps.pop(value, None)
+            self.bitmaps[name] = bitmaps
+
+    def bitmap(self, facet, value):
+        """Документы со значением value фасета facet (массив только для чтения)."""
+        return self.bitmaps[facet].get(value, self._empty)
+
+    def counts(self, docs):
+        """
+        Число документов из docs на каждое значение каждого фасета — один bincount
+        на колонку кодов. {фасет: [(значение, число), ...]} по убыванию числа.
+        """
+        docs = np.asarray(docs, dtype=np.int64)
+        result = {}
+        for name, (values, code_columns) in self._facets.items():
+            totals = np.zeros(len(values), dtype=np.int64)
+            for code_column in code_columns:
+                codes = code_column[docs]
+                totals += np.bincount(codes[codes >= 0], minlength=len(values))
+            pairs = [
+                (values[code], count) for code, count in enumerate(totals.tolist())
+                if count and values[code] not in _HIDDEN_FACET_VALUES
+            ]
+            pairs.sort(key=lambda pair: (-pair[1], pair[0]))
+            result[name] = pairs
+        return result
+
+
+def top_k_ascending(values, candidates, k):
+    """
+    k кандидатов с наименьшими values в порядке возрастания; при равенстве —
+    в порядке документов (как устойчивая полная сортировка). Через argpartition,
+    без сортировки всего массива.
+    """
+    candidates = np.asarray(candidates)
+    if k <= 0 or not len(candidates):
+        return candidates[:0]
+    values = values[candidates]
+    if k < len(candidates):
+        kth = values[np.argpartition(values, k - 1)[k - 1]]
+        below = np.flatnonzero(values < kth)
+        tied = np.flatnonzero(values == kth)[:k - len(below)]
+        picked = np.sort(np.concatenate([below, tied]))
+    else:
+        picked = np.arange(len(candidates))
+    return candidates[picked[np.argsort(values[picked], kind='stable')]]
+
+
+def top_k_descending(keys, k):
+    """
+    Позиции k элементов с наибольшими ключами keys (список массивов, первый — главный)
+    в порядке убывания; при равенстве всех ключей — в исходном порядке, как
+    sorted(..., reverse=True)[:k]. Главный ключ отсекает лишнее через argpartition,
+    по оставшимся — устойчивый lexsort.
+    """
+    keys = [np.asarray(key, dtype=np.float64) for key in keys]
+    count = len(keys[0])
+    k = min(k, count)
+    if k <= 0:
+        return np.arange(0)
+    if k < count:
+        primary = keys[0]
+        kth = primary[np.argpartition(primary, count - k)[count - k]]
+        picked = np.flatnonzero(primary >= kth)
+    else:
+        picked = np.arange(count)
+    order = np.lexsort([-key[picked] for key in reversed(keys)])
+    return picked[order[:k]]
+
+
+def _post_tokens(post):
+    """Слова текстовых полей поста по полям TEXT_FIELDS; None — не пост (не индексируется)."""
+    if not isinstance(post, dict):
+        return None
+    return [tokenize(text) for text in post_text_fields(post)]
+
+
+def _add_delta(delta, doc, removed, added):
+    for key in removed:
+        delta.setdefault(key, ([], []))[0].append(doc)
+    for key in added:
+        delta.setdefault(key, ([], []))[1].append(doc)
+
+
+def _patched_postings(postings, delta):
+    """Копия postings (ключ -> отсортированный массив документов) с правками delta: ключ -> (убрать, добавить)."""
+    result = dict(postings)
+    for key, (removed, added) in delta.items():
+        docs = result.get(key, _EMPTY_POSTING)
+        if removed:
+            docs = docs[~np.isin(docs, removed)]
+        if added:
+            docs = np.union1d(docs, np.array(added, dtype=np.int32)).astype(np.int32)
+        if len(docs):
+            result[key] = docs
+        else:
+            result.pop(key, None)
+    return result
+
+
+# Сколько рейтингов similar_to держать в памяти на одну сборку индекса
+SIMILAR_CACHE_SIZE = 256
+
+
+class GallerySearchIndex:
+    """
+    Инвертированный индекс по текстовым полям постов.
+
+    Документ — позиция поста в списке posts (порядок кэша сохраняется).
+    words: слово -> отсортированный массив документов, где оно встречается.
+    stems: основа -> отсортированный массив документов, где есть слово длиннее
+           3 букв с этой основой (слова запроса длиннее 3 букв совпадают по корню).
+
+    Для BM25 по ключам term_key хранятся документы, их взвешенная и нормированная
+    по длине полей частота (BM25F) и idf — статистика корпуса считается при полной сборке.
+    vocabulary: отсортированный словарь — по нему же бинарным поиском идёт автодополнение
+                (suggest); слова одной основы объединяются, частота — число документов основы.
+    trigrams: триграмма -> номера слов trigram_words (для исправления опечаток).
+    fragments: готовый JSON (bytes) публичного представления каждого поста;
+               выдача поиска склеивается из них без сериализации на запрос.
+    columns — колонки признаков для фильтров (GalleryColumns).
+    version — версия кэша постов, из которой построен индекс (для ResultSetCache).
+    """
+
+    def __init__(self, posts, version=0):
+        self.posts = posts
+        self.version = version
+        self.columns = GalleryColumns(posts)
+        self._reset_caches()
+        self.fragments = [self._build_fragment(post) for post in posts]
+        # Сколько документов изменено патчами (patched) после полной сборки
+        self.patched_docs = 0
+
+        words = {}
+        stems = {}
+        stem_of = {}
+        field_tokens = []
+        field_lengths = np.zeros((len(posts), len(TEXT_FIELDS)), dtype=np.float64)
+        for doc, post in enumerate(posts):
+            tokens = _post_tokens(post)
+            field_tokens.append(tokens)
+            if tokens is None:
+                continue
+            field_lengths[doc] = [len(t) for t in tokens]
+
+            for word in set().union(*tokens):
+                words.setdefault(word, []).append(doc)
+                if len(word) > 3:
+                    stems.setdefault(term_key(word, stem_of), set()).add(doc)
+
+        # Документы добавлялись по возрастанию, поэтому списки слов уже отсортированы
+        self.words = {word: np.array(docs, dtype=np.int32) for word, docs in words.items()}
+        self.stems = {stem: np.array(sorted(docs), dtype=np.int32) for stem, docs in stems.items()}
+
+        # --- Статистика BM25F (патчи её не пересчитывают) ---
+        self._indexed = sum(1 for tokens in field_tokens if tokens is not None)
+        self._avg_lengths = field_lengths.sum(axis=0) / max(self._indexed, 1)
+
+        term_docs = {}
+        term_tf = {}
+        for doc, tokens in enumerate(field_tokens):
+            if tokens is None:
+                continue
+            for key, tf in self._doc_tf(tokens, stem_of).items():
+                term_docs.setdefault(key, []).append(doc)
+                term_tf.setdefault(key, []).append(tf)
+
+        self.term_docs = {key: np.array(docs, dtype=np.int32) for key, docs in term_docs.items()}
+        self.term_tf = {key: np.array(tf, dtype=np.float64) for key, tf in term_tf.items()}
+        self.idf = {key: self._idf(len(docs)) for key, docs in term_docs.items()}
+
+        self._build_vocabulary(stem_of)
+
+    def _reset_caches(self):
+        # similar_to -> (рейтинг документов, число кандидатов); живёт вместе с индексом
+        self._similar_cache = {}
+        self._similar_lock = threading.Lock()
+        # слово запроса без совпадений -> ближайшие слова словаря
+        self._fuzzy_cache = {}
+        self._fuzzy_lock = threading.Lock()
+
+    def _doc_tf(self, tokens, stem_of):
+        """Взвешенная и нормированная по длине полей частота (BM25F) каждого ключа term_key в документе."""
+        doc_tf = {}
+        for f, field_words in enumerate(tokens):
+            if not field_words:
+                continue
+            norm = 1.0 - BM25_B + BM25_B * len(field_words) / self._avg_lengths[f]
+            step = FIELD_WEIGHTS.get(TEXT_FIELDS[f], 1.0) / norm
+            for word in field_words:
+                key = term_key(word, stem_of)
+                doc_tf[key] = doc_tf.get(key, 0.0) + step
+        return doc_tf
+
+    def _idf(self, df):
+        return math.log(1.0 + (self._indexed - df + 0.5) / (df + 0.5))
+
+    def _build_vocabulary(self, stem_of):
+        """Словарь, триграммы и частоты для автодополнения — по текущим words и term_docs."""
+        # Триграммы словаря: исправление опечатки просматривает только слова
+        # с общими триграммами, а не весь словарь и тем более не весь архив
+        self.vocabulary = sorted(self.words)
+        # Номера слов в триграммах — позиции в trigram_words; патчи только дописывают
+        # в конец новые слова, исчезнувшие остаются до полной сборки
+        self.trigram_words = self.vocabulary
+        trigrams = {}
+        for word_id, word in enumerate(self.vocabulary):
+            for gram in word_trigrams(word):
+                trigrams.setdefault(gram, []).append(word_id)
+        self.trigrams = {gram: np.array(ids, dtype=np.int32) for gram, ids in trigrams.items()}
+
+        # --- Автодополнение: частоты слов словаря и их основ (term_key) ---
+        group_ids = {}
+        self.vocabulary_groups = np.array(
+            [group_ids.setdefault(term_key(word, stem_of), len(group_ids)) for word in self.vocabulary],
+            dtype=np.int32,
+        )
+        self.vocabulary_df = np.array([len(self.words[word]) for word in self.vocabulary], dtype=np.int32)
+        self.group_df = np.zeros(len(group_ids), dtype=np.int32)
+        for key, group in group_ids.items():
+            self.group_df[group] = len(self.term_docs.get(key, _EMPTY_POSTING))
+        self._group_ids = group_ids
+
+    def patched(self, posts, version):
+        """
+        Индекс для posts — копии self.posts, где посты заменены на тех же позициях,
+        добавлены в конец или убраны с конца (так меняет список apply_post_changes).
+        Пересчитываются только изменившиеся документы: постинги их слов, строки
+        колонок и фрагменты, остальное общее с self. Сам self не меняется — по нему
+        могут идти запросы. Статистика BM25 (средние длины полей, число документов
+        для idf) остаётся от полной сборки.
+
+        None — патч не окупается: изменённых после полной сборки документов больше
+        INDEX_PATCH_MAX_FRACTION (например, удаление из середины сдвинуло хвост).
+        """
+        old_posts = self.posts
+        count = len(posts)
+        docs = [doc for doc in range(min(count, len(old_posts))) if posts[doc] is not old_posts[doc]]
+        docs.extend(range(len(old_posts), count))
+        removed = list(range(count, len(old_posts)))
+        patched_docs = self.patched_docs + len(docs) + len(removed)
+        if patched_docs > INDEX_PATCH_MAX_FRACTION * count:
+            return None
+
+        index = copy.copy(self)
+        index.posts = posts
+        index.version = version
+        index.patched_docs = patched_docs
+        index._reset_caches()
+        index.columns = self.columns.patched(old_posts, posts, docs)
+        index.fragments = self.fragments[:count] + [None] * (count - len(self.fragments))
+        for doc in docs:
+            index.fragments[doc] = self._build_fragment(posts[doc])
+
+        # Разница слов, основ и частот BM25 между прежним и новым постом каждого документа
+        stem_of = {}
+        word_delta = {}
+        stem_delta = {}
+        term_delta = {}
+        for doc in docs + removed:
+            old_tokens = _post_tokens(old_posts[doc]) if doc < len(old_posts) else None
+            new_tokens = _post_tokens(posts[doc]) if doc < count else None
+            old_words = set().union(*old_tokens) if old_tokens else set()
+            new_words = set().union(*new_tokens) if new_tokens else set()
+            _add_delta(word_delta, doc, old_words - new_words, new_words - old_words)
+
+            old_stems = {term_key(word, stem_of) for word in old_words if len(word) > 3}
+            new_stems = {term_key(word, stem_of) for word in new_words if len(word) > 3}
+            _add_delta(stem_delta, doc, old_stems - new_stems, new_stems - old_stems)
+
+            old_tf = self._doc_tf(old_tokens, stem_of) if old_tokens else {}
+            new_tf = self._doc_tf(new_tokens, stem_of) if new_tokens else {}
+            for key, tf in old_tf.items():
+                if new_tf.get(key) != tf:
+                    term_delta.setdefault(key, ([], []))[0].append(doc)
+            for key, tf in new_tf.items():
+                if old_tf.get(key) != tf:
+                    term_delta.setdefault(key, ([], []))[1].append((doc, tf))
+
+        index.words = _patched_postings(self.words, word_delta)
+        index.stems = _patched_postings(self.stems, stem_delta)
+        index.term_docs = dict(self.term_docs)
+        index.term_tf = dict(self.term_tf)
+        index.idf = dict(self.idf)
+        for key, (removed_docs, added) in term_delta.items():
+            key_docs = self.term_docs.get(key, _EMPTY_POSTING)
+            key_tf = self.term_tf.get(key, _EMPTY_TF)
+            if removed_docs:
+                keep = ~np.isin(key_docs, removed_docs)
+                key_docs, key_tf = key_docs[keep], key_tf[keep]
+            if added:
+                key_docs = np.concatenate([key_docs, np.array([doc for doc, _ in added], dtype=np.int32)])
+                key_tf = np.concatenate([key_tf, np.array([tf for _, tf in added], dtype=np.float64)])
+                order = np.argsort(key_docs, kind='stable')
+                key_docs, key_tf = key_docs[order], key_tf[order]
+            if len(key_docs):
+                index.term_docs[key] = key_docs
+                index.term_tf[key] = key_tf
+                index.idf[key] = self._idf(len(key_docs))
+            else:
+                del index.term_docs[key], index.term_tf[key], index.idf[key]
+
+        index._patch_vocabulary(self, word_delta, term_delta, stem_of)
+        return index
+
+    def _patch_vocabulary(self, base, word_delta, term_delta, stem_of):
+        """Словарь, триграммы и частоты автодополнения после патча (base — прежний индекс)."""
+        added = sorted(word for word in word_delta if word not in base.words and word in self.words)
+        gone = [word for word in word_delta if word in base.words and word not in self.words]
+
+        vocabulary = base.vocabulary
+        groups = base.vocabulary_groups
+        vocabulary_df = base.vocabulary_df
+        if gone:
+            positions = [bisect.bisect_left(vocabulary, word) for word in gone]
+            gone = set(gone)
+            vocabulary = [word for word in vocabulary if word not in gone]
+            groups = np.delete(groups, positions)
+            vocabulary_df = np.delete(vocabulary_df, positions)
+        self._group_ids = dict(base._group_ids) if added else base._group_ids
+        if added:
+            positions = [bisect.bisect_left(vocabulary, word) for word in added]
+            new_groups = [self._group_ids.setdefault(term_key(word, stem_of), len(self._group_ids)) for word in added]
+            vocabulary = sorted(vocabulary + added)  # Два упорядоченных отрезка — сортировка линейная
+            groups = np.insert(groups, positions, new_groups)
+            vocabulary_df = np.insert(vocabulary_df, positions, 0)
+
+            # Новые слова дописываются в конец нумерации триграмм
+            self.trigram_words = base.trigram_words + added
+            self.trigrams = dict(base.trigrams)
+            for word_id, word in enumerate(added, start=len(base.trigram_words)):
+                for gram in word_trigrams(word):
+                    ids = self.trigrams.get(gram, _EMPTY_POSTING)
+                    self.trigrams[gram] = np.append(ids, np.int32(word_id))
+
+        self.vocabulary = vocabulary
+        self.vocabulary_groups = groups
+        self.vocabulary_df = vocabulary_df.copy() if vocabulary_df is base.vocabulary_df else vocabulary_df
+        for word in word_delta:
+            if word in self.words:
+                self.vocabulary_df[bisect.bisect_left(vocabulary, word)] = len(self.words[word])
+
+        self.group_df = np.zeros(len(self._group_ids), dtype=np.int32)
+        self.group_df[:len(base.group_df)] = base.group_df
+        for key in set(term_delta).union(term_key(word, stem_of) for word in added):
+            group = self._group_ids.get(key)
+            if group is not None:
+                self.group_df[group] = len(self.term_docs.get(key, _EMPTY_POSTING))
+
+    def __len__(self):
+        return len(self.posts)
+
+    @staticmethod
+    def _build_fragment(post):
+        try:
+            # Копия: orjson отдаёт bytes с запасом буфера (от 1 КБ), а фрагменты живут
+            # столько же, сколько индекс
+            return bytes(memoryview(dumps_json(post_public_item(post))))
+        except Exception:
+            return None  # Битый пост (например, нечисловая дата) — сериализуется на запрос
+
+    def item_fragment(self, doc):
+        """JSON-фрагмент поста для выдачи поиска."""
+        fragment = self.fragments[doc]
+        if fragment is None:
+            fragment = dumps_json(post_public_item(self.posts[doc]))
+        return fragment
+
+    def estimated_bytes(self):
+        """
+        Примерный объём памяти индекса (без самих постов): фрагменты, постинги,
+        колонки и битовые маски фасетов. Для бюджета памяти кэша постов.
+        """
+        total = sys.getsizeof(self.fragments) + sum(sys.getsizeof(f) for f in self.fragments if f is not None)
+        for postings in (self.words, self.stems, self.trigrams, self.term_docs, self.term_tf):
+            total += sys.getsizeof(postings) + sum(
+                sys.getsizeof(key) + array.nbytes + _ARRAY_OVERHEAD for key, array in postings.items()
+            )
+        columns = self.columns
+        total += sum(value.nbytes for value in vars(columns).values() if isinstance(value, np.ndarray))
+        total += sys.getsizeof(columns.post_docs) + sum(
+            sys.getsizeof(key) + sys.getsizeof(docs) for key, docs in columns.post_docs.items()
+        )
+        total += sum(
+            bitmap.nbytes for bitmaps in columns.facets.bitmaps.values() for bitmap in bitmaps.values()
+        )
+        return total
+
+    def find_post(self, post_id):
+        """Пост по строковому post_id или None."""
+        docs = self.columns.post_docs.get(str(post_id))
+        return self.posts[docs[0]] if docs else None
+
+    def similar_ranking(self, similar_to, k):
+        """
+        Первые k фото-постов, самых похожих на пост similar_to, и общее число кандидатов.
+        Рейтинг кэшируется до пересборки индекса (то есть до обновления кэша постов);
+        запрос большего k пересчитывает его. None — поста similar_to нет.
+        """
+        cached = self._similar_cache.get(similar_to)
+        if cached is not None and (len(cached[0]) >= k or len(cached[0]) == cached[1]):
+            return cached[0][:k], cached[1]
+
+        target_docs = self.columns.post_docs.get(similar_to)
+        if not target_docs:
+            return None
+
+        candidates = np.flatnonzero(self.columns.photo_ok)
+        penalties = self.columns.similar_penalties(target_docs[0], similar_to)
+        ranked = top_k_ascending(penalties, candidates, k)
+
+        with self._similar_lock:
+            if len(self._similar_cache) >= SIMILAR_CACHE_SIZE:
+                self._similar_cache.pop(next(iter(self._similar_cache)), None)
+            self._similar_cache[similar_to] = (ranked, len(candidates))
+        return ranked, len(candidates)
+
+    def word_postings(self, q_word):
+        """
+        Документы, где слово запроса находится точно или (для слов длиннее
+        3 букв) по совпадению основы со словом поста длиннее 3 букв.
+        """
+        exact = self.words.get(q_word, _EMPTY_POSTING)
+        if len(q_word) <= 3:
+            return exact
+        by_stem = self.stems.get(get_word_stem(q_word), _EMPTY_POSTING)
+        if not len(exact):
+            return by_stem
+        if not len(by_stem):
+            return exact
+        return np.union1d(exact, by_stem)
+
+    def expand_word(self, q_word):
+        """
+        Слова словаря, которыми ищется слово запроса. Если оно находится точно
+        или по корню — только оно само. Иначе (вероятная опечатка) — до
+        FUZZY_MAX_EXPANSIONS ближайших слов: кандидаты берутся по общим триграммам
+        и отбираются по расстоянию редактирования (1 правка для слов до 5 букв,
+        2 — для длинных). Результат запоминается на слово.
+        """
+        if len(q_word) < FUZZY_MIN_WORD or len(self.word_postings(q_word)):
+            return (q_word,)
+        cached = self._fuzzy_cache.get(q_word)
+        if cached is not None:
+            return cached
+
+        max_edits = 1 if len(q_word) <= 5 else 2
+        q_grams = word_trigrams(q_word)
+        postings = [self.trigrams[gram] for gram in q_grams if gram in self.trigrams]
+        expansion = (q_word,)
+        if postings:
+            # Каждая правка портит не больше трёх триграмм слова
+            word_ids, shared = np.unique(np.concatenate(postings), return_counts=True)
+            word_ids = word_ids[shared >= max(1, len(q_grams) - 3 * max_edits)]
+            found = []
+            for word_id in word_ids.tolist():
+                word = self.trigram_words[word_id]
+                if word not in self.words:
+                    continue  # Исчезло после патча индекса
+                distance = edit_distance(q_word, word, max_edits)
+                if distance <= max_edits:
+                    found.append((distance, word))
+            if found:
+                best = min(distance for distance, _ in found)
+                # Слово, исчезнувшее и вернувшееся после патчей, встречается в триграммах дважды
+                expansion = tuple(sorted({word for distance, word in found if distance == best})[:FUZZY_MAX_EXPANSIONS])
+
+        with self._fuzzy_lock:
+            if len(self._fuzzy_cache) >= FUZZY_CACHE_SIZE:
+                self._fuzzy_cache.pop(next(iter(self._fuzzy_cache)), None)
+            self._fuzzy_cache[q_word] = expansion
+        return expansion
+
+    def suggest(self, prefix, limit=SUGGEST_LIMIT):
+        """
+        Слова словаря, начинающиеся с prefix (уже нормализованного), по убыванию
+        числа документов их основы: [(слово, число документов), ...].
+        Из слов одной основы берётся самое частое ('кошка', а не ещё и 'кошки'),
+        так как поиск по нему всё равно найдёт остальные формы.
+        """
+        if not prefix or limit <= 0:
+            return []
+        start = bisect.bisect_left(self.vocabulary, prefix)
+        end = bisect.bisect_left(self.vocabulary, prefix + '\U0010ffff', lo=start)
+        if start == end:
+            return []
+
+        ids = np.arange(start, end)
+        groups = self.vocabulary_groups[ids]
+        # Внутри основы — самое частое слово, при равенстве — первое по алфавиту
+        ids = ids[np.lexsort((ids, -self.vocabulary_df[ids], -self.group_df[groups]))]
+        result = []
+        seen = set()
+        for word_id in ids.tolist():
+            group = int(self.vocabulary_groups[word_id])
+            if group in seen:
+                continue
+            seen.add(group)
+            result.append((self.vocabulary[word_id], int(self.group_df[group])))
+            if len(result) >= limit:
+                break
+        return result
+
+    def fuzzy_postings(self, q_word):
+        """Документы слова запроса с учётом исправления опечатки (expand_word)."""
+        expansion = self.expand_word(q_word)
+        postings = [self.word_postings(word) for word in expansion]
+        if len(postings) == 1:
+            return postings[0]
+        return np.unique(np.concatenate(postings))
+
+    def match(self, query):
+        """
+        Отсортированные документы, в которых найдены ВСЕ слова запроса
+        (слова с опечатками заменяются ближайшими словами словаря).
+        Пустой запрос (нет ни одного слова) — None: подходит всё.
+        """
+        q_words = tokenize(query)
+        if not q_words:
+            return None
+
+        # Пересечение начинаем с самых коротких списков
+        postings = sorted((self.fuzzy_postings(q_word) for q_word in set(q_words)), key=len)
+        result = postings[0]
+        for posting in postings[1:]:
+            if not len(result):
+                break
+            result = np.intersect1d(result, posting, assume_unique=True)
+        return result
+
+    def match_posts(self, query):
+        """Посты, подходящие под запрос, в порядке кэша."""
+        docs = self.match(query)
+        if docs is None:
+            return list(self.posts)
+        return [self.posts[doc] for doc in docs.tolist()]
+
+    def relevance_scores(self, query, docs):
+        """
+        BM25F-оценки запроса для документов docs (массив позиций).
+        Слова с опечатками оцениваются по своим исправлениям (expand_word);
+        слова запроса без совпадений ничего не добавляют.
+        """
+        docs = np.asarray(docs, dtype=np.int32)
+        scores = np.zeros(len(docs), dtype=np.float64)
+        if not len(docs):
+            return scores
+
+        keys = {term_key(word) for q_word in tokenize(query) for word in self.expand_word(q_word)}
+        for key in keys:
+            key_docs = self.term_docs.get(key)
+            if key_docs is None:
+                continue
+            pos = np.minimum(np.searchsorted(key_docs, docs), len(key_docs) - 1)
+            tf = np.where(key_docs[pos] == docs, self.term_tf[key][pos], 0.0)
+            scores += self.idf[key] * tf * (BM25_K1 + 1.0) / (tf + BM25_K1)
+        return scores
+
+
+def signature_digest(signature):
+    """Короткий стабильный хэш сигнатуры запроса (кортежа нормализованных параметров)."""
+    return hashlib.sha1(repr(signature).encode('utf-8')).hexdigest()[:16]
+
+
+def encode_cursor(digest, version, position):
+    """Непрозрачный курсор: выдача (хэш сигнатуры и версия кэша) и позиция в ней."""
+    raw = f"{digest}:{version}:{position}".encode('ascii')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(хэш сигнатуры, версия, позиция) из курсора или None, если курсор битый."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('ascii')
+        digest, version, position = raw.split(':')
+        position = int(position)
+        if position < 0:
+            return None
+        return digest, int(version), position
+    except Exception:
+        return None
+
+
+class ResultSetCache:
+    """
+    LRU-кэш упорядоченных выдач поиска: сигнатура запроса -> первые документы выдачи
+    (окно) и полное число результатов. Окно пересчитывается шире, когда страница
+    выходит за его конец.
+
+    Выдача привязана к версии кэша постов (документ — позиция поста в index.posts),
+    поэтому запись другой версии считается промахом. Записи старше ttl секунд
+    выбрасываются; при превышении max_bytes вытесняются самые давние по обращению.
+    """
+
+    def __init__(self, ttl=RESULT_CACHE_TTL, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # signature -> (version, docs, total, created)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, signature, version):
+        """(упорядоченные документы окна, число результатов) для сигнатуры или None."""
+        with self._lock:
+            entry = self._entries.get(signature)
+            if entry is None:
+                return None
+            entry_version, docs, total, created = entry
+            if entry_version != version or time.time() - created > self.ttl:
+                self._drop(signature)
+                return None
+            self._entries.move_to_end(signature)
+            return docs, total
+
+    def put(self, signature, version, docs, total=None):
+        docs = np.asarray(docs, dtype=np.int32)
+        total = len(docs) if total is None else total
+        if docs.nbytes > self.max_bytes:
+            return docs, total
+        with self._lock:
+            if signature in self._entries:
+                self._drop(signature)
+            self._entries[signature] = (version, docs, total, time.time())
+            self._bytes += docs.nbytes
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+        return docs, total
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Число выдач и занятая ими память (байт)."""
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes}
+
+    def _drop(self, signature):
+        _, docs, _, _ = self._entries.pop(signature)
+        self._bytes -= docs.nbytes
@@ -1,10 +1,12 @@
 import logging
 import io
-from collections import deque
+from collections import OrderedDict, deque
 from PIL import Image
 import base64
 import json
 import os
+import pickle
+import sys
 import firebase_admin
 from firebase_admin import credentials, db
 import random
@@ -26,12 +28,15 @@ from google.genai.types import CreateCachedContentConfig, GenerateContentConfig,
 import re
 import time
 import tempfile
+import threading
 import os
 import requests
 import pathlib
 from io import BytesIO
 from PIL import Image
 import asyncio
+from gallery_search import GallerySearchIndex
+from art_posts_feed import PostsChangeFeed, apply_post_changes, posts_from_data
 from telegram.ext import CallbackContext, ContextTypes
 from telegram import Update
 from tempfile import NamedTemporaryFile
@@ -383,10 +388,25 @@ def save_art_post(channel_id, post_id, data):
         chan_key = channel_id.replace('@', '') if channel_id else "default"
         ref = db.reference(f'art_posts/{chan_key}/{post_id}')
         ref.set(data)
-        return True
     except Exception as e:
         logging.info(f"Error saving art post {post_id}: {e}")
         return False
+    # Кэш галереи патчится на месте, без перекачки всего art_posts
+    upsert_cached_art_post(channel_id, post_id, data)
+    return True
+
+def delete_art_post(channel_id, post_id):
+    """
+    Удаляет пост из art_posts/CHANNEL_ID/post_id и из кэша галереи.
+    """
+    try:
+        chan_key = channel_id.replace('@', '') if channel_id else "default"
+        db.reference(f'art_posts/{chan_key}/{post_id}').delete()
+    except Exception as e:
+        logging.info(f"Error deleting art post {post_id}: {e}")
+        return False
+    remove_cached_art_post(channel_id, post_id)
+    return True
 
 def get_art_post(channel_id, post_id):
     """
@@ -402,83 +422,684 @@ def get_art_post(channel_id, post_id):
 
 
 
-# Глобальные переменные кэша
-_ALL_POSTS_CACHE = None
-_LAST_CACHE_UPDATE = 0
+# --- Кэш art_posts по каналам ---
+# Каждый канал кэшируется отдельно (_ChannelPostsCache). Каналы лежат в порядке
+# последнего обращения; самые давние вытесняются, когда оценка памяти всех каналов
+# превышает POSTS_CACHE_MAX_BYTES или каналов больше POSTS_CACHE_MAX_CHANNELS.
+POSTS_CACHE_MAX_BYTES = int(os.environ.get("ART_POSTS_CACHE_MAX_MB", "512")) * 1024 * 1024
+POSTS_CACHE_MAX_CHANNELS = int(os.environ.get("ART_POSTS_CACHE_MAX_CHANNELS", "64"))
+# Допустимый id канала: @username, username или числовой id чата Telegram.
+# Ключ канала попадает в путь Firebase art_posts/<ключ> и в имя файла снимка,
+# поэтому только ASCII и совпадение целиком (fullmatch: без хвостового \n).
+CHANNEL_ID_RE = re.compile(r'@?[A-Za-z0-9_]{1,64}|-[0-9]{1,20}')
+# Через сколько секунд кэш канала считается устаревшим и обновляется в фоне
+POSTS_CACHE_TTL = 300
 
-# --- ДОБАВИТЬ ЭТУ ФУНКЦИЮ ---
-def reset_posts_cache():
-    """Сбрасывает кэш постов, заставляя сервер перечитать базу при следующем запросе."""
-    global _ALL_POSTS_CACHE
-    _ALL_POSTS_CACHE = None
-    logging.info("[CACHE] Кэш постов сброшен принудительно.")
-# -----------------------------
 
+def _parse_channel_ttls(spec):
+    """Свои TTL каналов из строки вида "anemonn=300,otherchannel=3600"."""
+    ttls = {}
+    for item in spec.split(","):
+        chan_key, _, seconds = item.strip().partition("=")
+        try:
+            ttls[chan_key.strip().replace('@', '')] = int(seconds)
+        except ValueError:
+            continue
+    return ttls
+
+
+POSTS_CACHE_TTLS = _parse_channel_ttls(os.environ.get("ART_POSTS_CACHE_TTLS", ""))
+# Снимки кэша на диске (по файлу на канал): после рестарта посты берутся из них
+# мгновенно, а база перечитывается в фоне
+POSTS_SNAPSHOT_DIR = os.environ.get("ART_POSTS_SNAPSHOT_DIR", os.getcwd())
+POSTS_SNAPSHOT_FORMAT = 1
+# Режим потока изменений: кэш подписан на art_posts/<канал> и патчится по событиям,
+# опрос базы по TTL не нужен (см. start_posts_change_feed)
+POSTS_CHANGE_FEED = os.environ.get("ART_POSTS_CHANGE_FEED", "0") == "1"
+
+# Каналы в порядке обращения (последний — самый свежий). Сам словарь и поля
+# записей posts/index/version/loaded_at меняются только под _POSTS_CACHE_LOCK
+_POSTS_CACHES = OrderedDict()
+_POSTS_CACHE_LOCK = threading.Lock()
+# Общий счётчик версий: у перезагруженного после вытеснения канала версия не повторится,
+# и закэшированные выдачи поиска по старым данным не подойдут
+_POSTS_CACHE_VERSION = 0
+_POSTS_CACHE_EVICTIONS = 0
+
+
+def _new_cache_metrics():
+    """Счётчики канала для get_posts_cache_metrics()."""
+    return {
+        "snapshot_loads": 0,
+        "last_snapshot_seconds": None,
+        "snapshot_saved_at": None,
+        "loads": 0,
+        "load_errors": 0,
+        "last_load_seconds": None,
+        "last_load_at": None,
+        "stale_served": 0,
+        "cold_waits": 0,
+        "index_builds": 0,
+        "last_index_seconds": None,
+        "index_patches": 0,
+        "last_index_patch_ms": None,
+        "stale_index_served": 0,
+        "feed_syncs": 0,
+    }
 
-def get_all_art_posts_cached(channel_id):
-    global _ALL_POSTS_CACHE, _LAST_CACHE_UPDATE
 
-    # 1. Нормализация ID канала
+class _ChannelPostsCache:
+    """
+    Кэш постов одного канала: список, поисковый индекс и состояние загрузки.
+    Загрузку из базы и сборку индекса single-flight выполняет один поток —
+    у каждого канала свои refresh_lock и index_lock.
+    """
+
+    def __init__(self, chan_key):
+        self.chan_key = chan_key
+        self.posts = None
+        # Индекс по posts; пока собирается новый, запросы получают прежний
+        self.index = None
+        # Меняется при каждой загрузке, сбросе и патче: по ней устаревают выдачи поиска
+        self.version = 0
+        self.loaded_at = 0
+        # Патчи, пришедшие во время полной загрузки из базы (None — загрузки нет)
+        self.load_journal = None
+        self.refresh_lock = threading.Lock()
+        self.index_lock = threading.Lock()
+        # Патчи канала применяются по одному (см. _patch_posts_cache)
+        self.patch_lock = threading.Lock()
+        # Снимок на диске читается только при первом холодном старте канала (после сброса — база)
+        self.snapshot_checked = False
+        # Оценка памяти: посты (по выборке) и индекс
+        self.post_bytes = 0
+        self.posts_bytes = 0
+        self.index_bytes = 0
+        self.feed = None
+        self.metrics = _new_cache_metrics()
+
+    @property
+    def nbytes(self):
+        return self.posts_bytes + self.index_bytes
+
+    @property
+    def ttl(self):
+        return POSTS_CACHE_TTLS.get(self.chan_key, POSTS_CACHE_TTL)
+
+    @property
+    def feed_live(self):
+        return self.feed is not None and self.feed.live
+
+
+def is_valid_channel_id(channel_id):
+    """id канала из запроса годится для ключа кэша, пути в базе и имени снимка."""
+    return isinstance(channel_id, str) and CHANNEL_ID_RE.fullmatch(channel_id) is not None
+
+
+def _channel_key(channel_id):
+    """
+    Ключ канала в art_posts: без @; default_world — мир основного канала.
+    ValueError — id не похож на канал (см. CHANNEL_ID_RE).
+    """
     if channel_id == 'default_world':
         channel_id = '@anemonn'
-    
-    # 2. ВАЖНОЕ ИЗМЕНЕНИЕ: Если это не anemonn, мы не используем базу вообще.
-    # Возвращаем пустой список, чтобы логика дальше поняла, что базы нет.
-    if channel_id != '@anemonn':
-        return []
+    if not channel_id:
+        return "default"
+    channel_id = str(channel_id)
+    if not is_valid_channel_id(channel_id):
+        raise ValueError(f"Недопустимый id канала: {channel_id[:80]!r}")
+    return channel_id.replace('@', '')
 
-    # --- Дальше стандартная логика для anemonn ---
-    current_time = time.time()
 
-    if _ALL_POSTS_CACHE is None or (current_time - _LAST_CACHE_UPDATE) > 300:
-        try:
-            if 'db' not in globals():
-                logging.error("CRITICAL: 'db' variable is not found!")
-                return []
+def _next_cache_version():
+    """Новая версия кэша (вызывать под _POSTS_CACHE_LOCK)."""
+    global _POSTS_CACHE_VERSION
+    _POSTS_CACHE_VERSION += 1
+    return _POSTS_CACHE_VERSION
+
 
-            chan_key = channel_id.replace('@', '')
-            ref = db.reference(f'art_posts/{chan_key}')
-            data = ref.get()
+def _get_channel_cache(chan_key):
+    """
+    Запись кэша канала (создаётся пустой); обращение делает канал самым свежим для LRU.
+    Новая запись сразу вытесняет давние каналы сверх POSTS_CACHE_MAX_CHANNELS —
+    иначе каналы, загрузка которых не удалась, копились бы без ограничений.
+    """
+    evicted = []
+    with _POSTS_CACHE_LOCK:
+        entry = _POSTS_CACHES.get(chan_key)
+        if entry is None:
+            entry = _POSTS_CACHES[chan_key] = _ChannelPostsCache(chan_key)
+            evicted = _evict_channels(keep=chan_key)
+        else:
+            _POSTS_CACHES.move_to_end(chan_key)
+    _log_evictions(evicted)
+    return entry
 
-            posts_list = []
 
-            if isinstance(data, dict):
-                for pid, pdata in data.items():
-                    if isinstance(pdata, dict):
-                        try:
-                            pdata['post_id'] = int(pid)
-                            posts_list.append(pdata)
-                        except ValueError:
-                            continue 
-            elif isinstance(data, list):
-                for idx, pdata in enumerate(data):
-                    if isinstance(pdata, dict) and pdata:
-                        pdata['post_id'] = idx
-                        posts_list.append(pdata)
-
-            _ALL_POSTS_CACHE = posts_list
-            _LAST_CACHE_UPDATE = current_time
-            logging.info(f"[CACHE] Loaded {len(posts_list)} posts for {channel_id}")
+def _deep_sizeof(value, seen):
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_deep_sizeof(k, seen) + _deep_sizeof(v, seen) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(_deep_sizeof(v, seen) for v in value)
+    return size
 
-        except Exception as e:
-            logging.error(f"[CACHE ERROR] {e}")
-            return []
 
-    return _ALL_POSTS_CACHE
+def _estimate_post_bytes(posts, sample_size=200):
+    """Средний размер поста в памяти по равномерной выборке (строки-дубликаты считаются один раз)."""
+    if not posts:
+        return 0
+    sample = posts[::max(1, len(posts) // sample_size)]
+    seen = set()
+    return sum(_deep_sizeof(post, seen) for post in sample) // len(sample)
 
 
-def get_valid_ids_list(channel_id):
+def _publish_posts(entry, posts_list, loaded_at, post_bytes):
+    """Новый список постов канала (под _POSTS_CACHE_LOCK); прежний индекс остаётся до сборки нового."""
+    entry.version = _next_cache_version()
+    entry.posts = posts_list
+    entry.loaded_at = loaded_at
+    entry.post_bytes = post_bytes
+    entry.posts_bytes = sys.getsizeof(posts_list) + post_bytes * len(posts_list)
+
+
+def _evict_channels(keep=None):
     """
-    Возвращает список ID только для @anemonn.
-    Для остальных возвращает пустой список (сигнал для генератора использовать математику).
+    Вытесняет давно не использованные каналы, пока кэш не уложится в бюджет
+    (под _POSTS_CACHE_LOCK). Не трогает keep (канал текущего запроса), каналы
+    с потоком изменений и каналы, которые прямо сейчас загружаются.
+    Возвращает [(ключ, байты)] вытесненных каналов.
     """
-    if channel_id == 'default_world':
-        channel_id = '@anemonn'
+    global _POSTS_CACHE_EVICTIONS
+    evicted = []
+    used = sum(entry.nbytes for entry in _POSTS_CACHES.values())
+    count = len(_POSTS_CACHES)
+    for chan_key, entry in list(_POSTS_CACHES.items()):
+        if used <= POSTS_CACHE_MAX_BYTES and count <= POSTS_CACHE_MAX_CHANNELS:
+            break
+        if chan_key == keep or entry.feed is not None or entry.refresh_lock.locked():
+            continue
+        del _POSTS_CACHES[chan_key]
+        used -= entry.nbytes
+        count -= 1
+        evicted.append((chan_key, entry.nbytes))
+    _POSTS_CACHE_EVICTIONS += len(evicted)
+    return evicted
+
+
+def _log_evictions(evicted):
+    for chan_key, nbytes in evicted:
+        logging.info(f"[CACHE] Канал {chan_key} вытеснен из кэша ({nbytes / 1048576:.1f} МБ)")
+
+
+def _enforce_posts_budget(keep=None):
+    """Вытесняет давние каналы после загрузки или сборки индекса (см. _evict_channels)."""
+    with _POSTS_CACHE_LOCK:
+        evicted = _evict_channels(keep)
+        used = sum(entry.nbytes for entry in _POSTS_CACHES.values())
+    _log_evictions(evicted)
+    if used > POSTS_CACHE_MAX_BYTES:
+        logging.warning(
+            f"[CACHE] Кэш постов {used / 1048576:.1f} МБ больше бюджета "
+            f"{POSTS_CACHE_MAX_BYTES / 1048576:.0f} МБ: вытеснять больше нечего"
+        )
+
+
+def reset_posts_cache(channel_id=None):
+    """
+    Сбрасывает кэш постов канала (None — всех каналов),
+    заставляя сервер перечитать базу при следующем запросе.
+    """
+    with _POSTS_CACHE_LOCK:
+        if channel_id is None:
+            entries = list(_POSTS_CACHES.values())
+        else:
+            entries = [_POSTS_CACHES[key] for key in (_channel_key(channel_id),) if key in _POSTS_CACHES]
+        for entry in entries:
+            entry.posts = None
+            entry.index = None
+            entry.posts_bytes = entry.index_bytes = 0
+            entry.version = _next_cache_version()
+            entry.snapshot_checked = True
+    logging.info(f"[CACHE] Кэш постов сброшен принудительно ({channel_id or 'все каналы'}).")
+
+
+def _patch_posts_cache(channel_id, changes, merge=False):
+    """
+    Применяет изменения отдельных постов к кэшу канала без обращения к базе (см. apply_post_changes).
+
+    Список копируется (copy-on-write): запросы, уже взявшие старый список и индекс,
+    дорабатывают по ним. Поисковый индекс обновляется на месте только для изменённых
+    постов (GallerySearchIndex.patched); если патч не окупается, индекс пересобирается
+    при следующем запросе галереи. Полная перезагрузка из базы — только по TTL или reset_posts_cache().
+    Если перезагрузка идёт прямо сейчас, патч запоминается и накатывается на её результат.
+    Канала нет в кэше — ничего не делает: при загрузке всё придёт из базы.
+
+    Патчи канала идут по одному (entry.patch_lock), а сама работа — вне общего
+    _POSTS_CACHE_LOCK: под ним только чтение и публикация. Если канал за это время
+    перезагрузили, изменения накатываются заново на новые посты.
+    """
+    if not changes:
+        return False
+
+    with _POSTS_CACHE_LOCK:
+        entry = _POSTS_CACHES.get(_channel_key(channel_id))
+    if entry is None:
+        return False
+
+    with entry.patch_lock:
+        with _POSTS_CACHE_LOCK:
+            if entry.load_journal is not None:
+                entry.load_journal.append((changes, merge))
+        while True:
+            with _POSTS_CACHE_LOCK:
+                posts = entry.posts
+                index = entry.index
+                version = _next_cache_version()
+            if posts is None:
+                return False
+
+            updated = apply_post_changes(posts, changes, merge)
+            if updated is posts:
+                return True  # Ничего не изменилось (например, эхо своей записи из потока изменений)
+
+            patched = None
+            if index is not None and index.posts is posts:
+                started = time.perf_counter()
+                patched = index.patched(updated, version)
+                if patched is not None:
+                    entry.metrics['index_patches'] += 1
+                    entry.metrics['last_index_patch_ms'] = round((time.perf_counter() - started) * 1000, 3)
+
+            with _POSTS_CACHE_LOCK:
+                if entry.posts is not posts:
+                    continue  # Пока считали, канал перезагрузили или сбросили
+                entry.posts = updated
+                entry.posts_bytes = sys.getsizeof(updated) + entry.post_bytes * len(updated)
+                entry.version = version
+                # Без патча прежний индекс не сбрасывается: пока новый собирается, запросы получают его
+                if patched is not None and entry.index is index:
+                    entry.index = patched
+            return True
+
+
+def upsert_cached_art_post(channel_id, post_id, data):
+    """Добавляет или заменяет пост в кэше галереи (после записи в базу)."""
+    if not isinstance(data, dict):
+        return False
+    return _patch_posts_cache(channel_id, {post_id: data})
+
+
+def remove_cached_art_post(channel_id, post_id):
+    """Убирает пост из кэша галереи (после удаления из базы)."""
+    return _patch_posts_cache(channel_id, {post_id: None})
+
+
+def _snapshot_path(chan_key):
+    return os.path.join(POSTS_SNAPSHOT_DIR, f"art_posts_{chan_key}.pkl")
+
+
+def save_posts_snapshot(chan_key, posts):
+    """
+    Пишет снимок постов канала на диск: сначала заголовок (формат, канал, время),
+    затем сам список — заголовок проверяется без чтения всего файла.
+    Запись через временный файл, чтобы обрыв не оставил битый снимок.
+    Возвращает время снимка или None.
+    """
+    header = {"format": POSTS_SNAPSHOT_FORMAT, "channel": chan_key, "saved_at": time.time(), "count": len(posts)}
+    path = _snapshot_path(chan_key)
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(posts, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        return header["saved_at"]
+    except Exception as e:
+        logging.error(f"[CACHE] Не удалось записать снимок постов {chan_key}: {e}")
+        return None
+
+
+def load_posts_snapshot(chan_key):
+    """(посты, время снимка) из снимка канала на диске или None, если его нет или он не подходит."""
+    try:
+        with open(_snapshot_path(chan_key), "rb") as f:
+            header = pickle.load(f)
+            if (not isinstance(header, dict) or header.get("format") != POSTS_SNAPSHOT_FORMAT
+                    or header.get("channel") != chan_key):
+                logging.info(f"[CACHE] Снимок постов {chan_key} другого формата или канала — пропускаем.")
+                return None
+            posts = pickle.load(f)
+        if not isinstance(posts, list):
+            return None
+        return posts, header.get("saved_at", 0)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.error(f"[CACHE] Не удалось прочитать снимок постов {chan_key}: {e}")
+        return None
+
+
+def _save_channel_snapshot(entry, posts_list):
+    # Пустые каналы не сохраняются: иначе каждый запрошенный чужой канал оставит файл
+    if posts_list:
+        saved_at = save_posts_snapshot(entry.chan_key, posts_list)
+        if saved_at:
+            entry.metrics['snapshot_saved_at'] = saved_at
+
+
+def _publish_posts_snapshot(entry):
+    """
+    Холодный старт канала из снимка на диске (под entry.refresh_lock). Кэш помечается
+    устаревшим, чтобы его сразу перепроверили по базе в фоне. True — снимок загружен.
+    """
+    entry.snapshot_checked = True
+    started = time.perf_counter()
+    snapshot = load_posts_snapshot(entry.chan_key)
+    if snapshot is None:
+        return False
+    posts_list, saved_at = snapshot
+    post_bytes = _estimate_post_bytes(posts_list)
+
+    with _POSTS_CACHE_LOCK:
+        if entry.posts is not None:
+            return True
+        _publish_posts(entry, posts_list, 0, post_bytes)  # Сразу устаревший: база перечитается в фоне
+    _build_posts_index(entry, blocking=True)
+
+    elapsed = time.perf_counter() - started
+    entry.metrics['snapshot_loads'] += 1
+    entry.metrics['last_snapshot_seconds'] = round(elapsed, 3)
+    logging.info(
+        f"[CACHE] Loaded {len(posts_list)} posts for {entry.chan_key} from snapshot in {elapsed:.2f}s "
+        f"(snapshot age {time.time() - saved_at:.0f}s), revalidating in background"
+    )
+    return True
+
+
+def _load_art_posts(entry):
+    """
+    Полная загрузка art_posts канала из базы и публикация в кэш (вместе с индексом).
+    Вызывается только под entry.refresh_lock — одна загрузка канала за раз.
+    Возвращает True, если кэш обновлён; при ошибке прежние данные остаются.
+    """
+    started = time.perf_counter()
+    load_time = time.time()
+    try:
+        if 'db' not in globals():
+            logging.error("CRITICAL: 'db' variable is not found!")
+            return False
+
+        with _POSTS_CACHE_LOCK:
+            entry.load_journal = []
+
+        posts_list = posts_from_data(db.reference(f'art_posts/{entry.chan_key}').get())
+        post_bytes = _estimate_post_bytes(posts_list)
+
+        with _POSTS_CACHE_LOCK:
+            # Сохранения, прошедшие пока качался снимок, могли в него не попасть
+            for changes, merge in entry.load_journal or ():
+                posts_list = apply_post_changes(posts_list, changes, merge)
+            entry.load_journal = None
+            _publish_posts(entry, posts_list, load_time, post_bytes)
+        load_seconds = time.perf_counter() - started
+
+        # Пока строится новый индекс, запросы получают прежний (см. get_art_posts_index)
+        search_index = _build_posts_index(entry, blocking=True)
+        _save_channel_snapshot(entry, posts_list)
+        entry.metrics['loads'] += 1
+        entry.metrics['last_load_seconds'] = round(load_seconds, 3)
+        entry.metrics['last_load_at'] = load_time
+        logging.info(
+            f"[CACHE] Loaded {len(posts_list)} posts for {entry.chan_key} in {load_seconds:.2f}s "
+            f"({len(search_index.words) if search_index else 0} words indexed)"
+        )
+        return True
+
+    except Exception as e:
+        with _POSTS_CACHE_LOCK:
+            entry.load_journal = None
+        entry.metrics['load_errors'] += 1
+        logging.error(f"[CACHE ERROR] {entry.chan_key}: {e}")
+        return False
+
+
+def _refresh_art_posts_background(entry):
+    """Фоновое обновление устаревшего кэша; entry.refresh_lock уже захвачен вызывающим."""
+    try:
+        _load_art_posts(entry)
+    finally:
+        entry.refresh_lock.release()
+
+
+def _start_background_refresh(entry):
+    """Запускает фоновую загрузку канала, если её ещё никто не запустил."""
+    if entry.refresh_lock.acquire(blocking=False):
+        threading.Thread(
+            target=_refresh_art_posts_background, args=(entry,),
+            name=f"art-posts-refresh-{entry.chan_key}", daemon=True,
+        ).start()
+
+
+def _replace_posts_cache(entry, data):
+    """
+    Полный снимок канала из потока изменений (первое событие подписки или put в корень).
+    Под entry.refresh_lock: начатая раньше загрузка из базы не перезапишет более новые данные.
+    """
+    posts_list = posts_from_data(data)
+    post_bytes = _estimate_post_bytes(posts_list)
+    with entry.refresh_lock:
+        with _POSTS_CACHE_LOCK:
+            _publish_posts(entry, posts_list, time.time(), post_bytes)
+        _build_posts_index(entry, blocking=True)
+    _save_channel_snapshot(entry, posts_list)
+    entry.metrics['feed_syncs'] += 1
+    logging.info(f"[FEED] Synced {len(posts_list)} posts for {entry.chan_key} from change feed")
+
+
+def start_posts_change_feed(channel_id='@anemonn', reference=None):
+    """
+    Подписывает кэш постов канала на поток изменений art_posts/<канал>: правки из любого
+    процесса приходят событиями и накатываются на месте, без перекачки всего канала.
+    Такой канал не вытесняется из кэша. reference — для подмены
+    (FakeFirebase.reference(...)), по умолчанию db.reference.
+    """
+    chan_key = _channel_key(channel_id)
+    entry = _get_channel_cache(chan_key)
+    if entry.feed is not None:
+        return entry.feed
+    if reference is None:
+        reference = db.reference(f'art_posts/{chan_key}')
+    entry.feed = PostsChangeFeed(
+        reference,
+        on_replace=lambda data: _replace_posts_cache(entry, data),
+        on_changes=lambda changes, merge: _patch_posts_cache(chan_key, changes, merge),
+    ).start()
+    logging.info(f"[FEED] Подписка на art_posts/{chan_key} запущена")
+    return entry.feed
+
+
+def stop_posts_change_feed(channel_id=None):
+    """Отключает поток изменений канала (None — всех); кэш снова обновляется опросом по TTL."""
+    with _POSTS_CACHE_LOCK:
+        if channel_id is None:
+            entries = list(_POSTS_CACHES.values())
+        else:
+            entries = [_POSTS_CACHES[key] for key in (_channel_key(channel_id),) if key in _POSTS_CACHES]
+    for entry in entries:
+        feed, entry.feed = entry.feed, None
+        if feed is not None:
+            feed.close()
+
+
+def _channel_posts(entry):
+    """
+    Посты канала из кэша. Загрузка из базы — single-flight: качает один поток.
+    Холодный старт: остальные потоки ждут его; первый старт канала в процессе берёт
+    посты из снимка на диске. Устаревший кэш (старше TTL канала) обновляется
+    в фоновом потоке, а запросы тем временем получают прежние данные.
+    """
+    with _POSTS_CACHE_LOCK:
+        posts = entry.posts
+        age = time.time() - entry.loaded_at
+
+    if posts is not None:
+        # При живом потоке изменений кэш и так актуален — опрос по TTL не нужен
+        if age > entry.ttl and not entry.feed_live:
+            # Stale-while-revalidate: обновление запускает только первый заметивший
+            _start_background_refresh(entry)
+            entry.metrics['stale_served'] += 1
+        return posts
+
+    # Холодный старт (или сброс): один поток грузит, остальные ждут его результат.
+    # При первом старте канала — из снимка на диске, база перепроверяется в фоне.
+    from_snapshot = False
+    with entry.refresh_lock:
+        with _POSTS_CACHE_LOCK:
+            posts = entry.posts
+        if posts is None:
+            from_snapshot = not entry.snapshot_checked and _publish_posts_snapshot(entry)
+            if not from_snapshot:
+                _load_art_posts(entry)
+            with _POSTS_CACHE_LOCK:
+                posts = entry.posts
+        else:
+            entry.metrics['cold_waits'] += 1
+    # С подпиской свежий канал целиком придёт первым событием потока — вторая загрузка не нужна
+    if from_snapshot and entry.feed is None:
+        _start_background_refresh(entry)
+    return posts
+
+
+def get_all_art_posts_cached(channel_id):
+    """
+    Посты канала из кэша (см. _channel_posts). Пустой список — у канала нет
+    записей в art_posts или база недоступна.
+    """
+    posts = _channel_posts(_get_channel_cache(_channel_key(channel_id)))
+    return posts if posts is not None else []
 
-    # Если канал чужой — базы нет, список ID пуст
-    if channel_id != '@anemonn':
-        return []
 
+def _build_posts_index(entry, blocking):
+    """
+    Single-flight сборка индекса по текущему кэшу канала. Если индекс уже
+    собирает другой поток и blocking=False — None. Возвращает актуальный индекс.
+    """
+    if not entry.index_lock.acquire(blocking=blocking):
+        return None
+    try:
+        with _POSTS_CACHE_LOCK:
+            posts = entry.posts
+            version = entry.version
+            index = entry.index
+        if posts is None:
+            return None
+        if index is not None and index.posts is posts:
+            return index  # Собран другим потоком, пока ждали
+
+        started = time.perf_counter()
+        index = GallerySearchIndex(posts, version=version)
+        index_bytes = index.estimated_bytes()
+        entry.metrics['index_builds'] += 1
+        entry.metrics['last_index_seconds'] = round(time.perf_counter() - started, 3)
+        with _POSTS_CACHE_LOCK:
+            if posts is entry.posts:
+                entry.index = index
+                entry.index_bytes = index_bytes
+    finally:
+        entry.index_lock.release()
+    _enforce_posts_budget(keep=entry.chan_key)
+    return index
+
+
+def get_art_posts_index(channel_id):
+    """
+    Поисковый индекс (GallerySearchIndex) по кэшу постов канала.
+    Посты доступны как index.posts; у каналов без записей в базе индекс пустой.
+    index.version — версия кэша постов, из которой индекс построен.
+
+    После загрузки (или патча, который не удалось применить к индексу на месте)
+    индекс пересобирает один поток; остальные тем временем получают прежний
+    индекс (если он есть) вместо параллельной сборки.
+    """
+    entry = _get_channel_cache(_channel_key(channel_id))
+    posts = _channel_posts(entry)
+    with _POSTS_CACHE_LOCK:
+        index = entry.index
+        current = entry.posts
+    if current is None:
+        # База недоступна — пустой индекс, версия -1
+        return GallerySearchIndex(posts or [], version=-1)
+    if index is not None and index.posts is current:
+        return index
+
+    fresh = _build_posts_index(entry, blocking=index is None)
+    if fresh is not None:
+        return fresh
+    if index is not None:
+        entry.metrics['stale_index_served'] += 1
+        return index
+    # Кэш сбросили прямо сейчас — отдаём то, что получили
+    return GallerySearchIndex(posts or [], version=-1)
+
+
+def get_cached_art_post(channel_id, post_id):
+    """
+    Пост канала из кэша art_posts или None, если у канала нет записей в базе.
+    Поста нет в кэше, но канал в базе есть (пост мог появиться после загрузки) —
+    он читается из базы напрямую.
+    """
+    index = get_art_posts_index(channel_id)
+    post = index.find_post(post_id)
+    if post is None and len(index):
+        post = get_art_post(_channel_key(channel_id), post_id)
+    return post
+
+
+def get_posts_cache_metrics():
+    """Состояние кэша постов: бюджет памяти и по каждому каналу — возраст, версия, загрузки, сборки индекса."""
+    now = time.time()
+    with _POSTS_CACHE_LOCK:
+        entries = [
+            (entry, entry.posts, entry.index, entry.version, entry.loaded_at)
+            for entry in _POSTS_CACHES.values()
+        ]
+        evictions = _POSTS_CACHE_EVICTIONS
+    channels = {}
+    for entry, posts, index, version, loaded_at in entries:
+        metrics = dict(entry.metrics)
+        saved_at = metrics['snapshot_saved_at']
+        metrics.update({
+            "posts": len(posts) if posts is not None else None,
+            "version": version,
+            "age_seconds": round(now - loaded_at, 1) if posts is not None else None,
+            "ttl_seconds": entry.ttl,
+            "refreshing": entry.refresh_lock.locked(),
+            "index_current": index is not None and index.posts is posts,
+            "posts_mb": round(entry.posts_bytes / 1048576, 2),
+            "index_mb": round(entry.index_bytes / 1048576, 2),
+            "feed": entry.feed.stats() if entry.feed is not None else None,
+            "snapshot_path": _snapshot_path(entry.chan_key),
+            "snapshot_age_seconds": round(now - saved_at, 1) if saved_at else None,
+        })
+        channels[entry.chan_key] = metrics
+    return {
+        "used_mb": round(sum(entry.nbytes for entry, *_ in entries) / 1048576, 2),
+        "max_mb": round(POSTS_CACHE_MAX_BYTES / 1048576, 2),
+        "max_channels": POSTS_CACHE_MAX_CHANNELS,
+        "evictions": evictions,
+        "channels": channels,
+    }
+
+
+def get_valid_ids_list(channel_id):
+    """
+    Возвращает отсортированный список ID фото-постов канала из кэша art_posts.
+    Пустой список — у канала нет записей в базе (сигнал для генератора использовать математику).
+    """
     posts = get_all_art_posts_cached(channel_id)
     
     if not posts:
@@ -497,20 +1118,6 @@ def get_valid_ids_list(channel_id):
     return valid_ids
 
 
-
-
-
-
-
-
-
-
-
-
-
-
-
-
 def save_ozon_tracking_to_firebase(user_id: int, item_data: dict):
     """Сохраняет товар для отслеживания в Firebase."""
     try:
@@ -4697,7 +5304,9 @@ async def process_background_queue(bot, queue_data, status_msg=None, text_count=
                 file_id=item['file_id'],
                 caption=item['caption'],
                 date_timestamp=item['date_timestamp'],
-                original_link=item['original_link']
+                original_link=item['original_link'],
+                file_unique_id=item.get('file_unique_id'),
+                analysis_file_id=item.get('analysis_file_id')
             )
             
             # Подсчет статистики на основе ответа от функции
@@ -4733,13 +5342,13 @@ async def process_background_queue(bot, queue_data, status_msg=None, text_count=
             pass
 
 # === ОБНОВЛЕННАЯ ФУНКЦИЯ АНАЛИЗА ===
-async def analyze_and_save_background(bot, channel_id, message_id, file_id, caption, date_timestamp, original_link=None):
+async def analyze_and_save_background(bot, channel_id, message_id, file_id, caption, date_timestamp, original_link=None, file_unique_id=None, analysis_file_id=None, mode=None):
     """
     Фоновая задача для анализа изображения и сохранения в Firebase.
     Реализована устойчивость к ошибкам: если AI падает, пост все равно сохраняется.
+    mode — режим декодирования для цветового анализа ("exact"/"fast"), по умолчанию COLOR_ANALYSIS_MODE.
     """
-    # ОБЯЗАТЕЛЬНО: Добавьте импорт get_smart_colors оттуда же, откуда импортируете остальное
-    from bot import analyze_image_colors, calculate_normalized_brightness, get_smart_colors 
+    from color_analysis import analyze_images_colors_batch, get_feature_cache
     
     logging.info(f"Background: Обработка поста {message_id} для {channel_id}...")
 
@@ -4747,6 +5356,7 @@ async def analyze_and_save_background(bot, channel_id, message_id, file_id, capt
     ai_des = ""
     ai_style = ""
     analysis_data = {"error": "analysis_pending"}
+    color_desc = None
     
     # 1. Скачивание и Цветовой анализ
     img_byte_arr = io.BytesIO()
@@ -4756,22 +5366,21 @@ async def analyze_and_save_background(bot, channel_id, message_id, file_id, capt
         img_byte_arr.seek(0)
         image = Image.open(img_byte_arr)
 
-        # === ОБНОВЛЕННЫЙ ЦВЕТОВОЙ АНАЛИЗ (КАК В /updcolor) ===
+        # === ЦВЕТОВОЙ АНАЛИЗ (один проход по пикселям, см. ImageColorFeatures) ===
+        # При повторной обработке того же фото признаки берутся из кэша по file_unique_id
         try:
-            b_dist, s_dist, h_dist = analyze_image_colors(image, 'neutral')
-            norm_brightness = calculate_normalized_brightness(b_dist, s_dist)
-            total_saturation = (s_dist.get('gray', 0) * 0.0 + s_dist.get('medium', 0) * 0.5 + s_dist.get('high', 0) * 1.0)
-            
-            # Вызываем умный алгоритм (распаковываем 5 возвращаемых значений, последние 2 игнорируем)
-            dom_color, sec_color, ter_color, *_ = get_smart_colors(b_dist, s_dist, h_dist, norm_brightness)
-            
-            analysis_data = {
-                "br": round(norm_brightness, 2),
-                "sat": round(total_saturation, 2),
-                "dom_color": dom_color,
-                "sec_color": sec_color,
-                "ter_color": ter_color  # <-- ДОБАВЛЕН ТРЕТИЙ ЦВЕТ
-            }
+            feature_cache = get_feature_cache()
+            features = await asyncio.to_thread(feature_cache.get, file_unique_id, mode)
+            if features is None:
+                # Анализ по копии байтов в пуле процессов: цикл событий не блокируется,
+                # а image остаётся нетронутым (нужен целиком для Gemini)
+                features = (await analyze_images_colors_batch([img_byte_arr.getvalue()], mode))[0]
+                if features is None:
+                    raise RuntimeError("color analysis worker failed")
+                await asyncio.to_thread(feature_cache.put, file_unique_id, features, mode)
+            analysis_data = features.analysis_record()
+            # Компактный HSV-дескриптор из того же прохода — для similar_to на сайте
+            color_desc = features.encoded_color_descriptor()
         except Exception as color_e:
             logging.error(f"Background: Ошибка анализа цвета (игнорируем): {color_e}")
             analysis_data = {"error": "color_failed"}
@@ -4878,10 +5487,13 @@ async def analyze_and_save_background(bot, channel_id, message_id, file_id, capt
             "ai_des_ru": ai_des,
             "ai_style_ru": ai_style,
             "analysis": analysis_data,
+            "color_desc": color_desc,
             "caption": caption,
             "channel_id": channel_id,
             "date": date_timestamp,
             "file_id": file_id,
+            "file_unique_id": file_unique_id,
+            "analysis_file_id": analysis_file_id,
             "post_id": message_id,
             "status": "ok",
             "type": "photo",
@@ -4891,11 +5503,8 @@ async def analyze_and_save_background(bot, channel_id, message_id, file_id, capt
         save_success = save_art_post(channel_id, message_id, final_data)
         
         if save_success:
+            # Кэш галереи уже пропатчен в save_art_post — полная перезагрузка не нужна
             logging.info(f"Background: Пост {message_id} успешно сохранен (AI desc: {'Yes' if ai_des else 'No'}).")
-            try:
-                reset_posts_cache()
-            except:
-                pass
             
             # ВОЗВРАЩАЕМ СТАТУС ДЛЯ ПРОГРЕСС-БАРА
             return "success" if gemini_success else "no_ai"
@@ -4908,3 +5517,328 @@ async def analyze_and_save_background(bot, channel_id, message_id, file_id, capt
         return "error"
 
 
+# === МАССОВЫЙ ПЕРЕСЧЁТ ЦВЕТОВОГО АНАЛИЗА (/recolor) ===
+# Пересчитывает только поля analysis и color_desc у уже сохранённых постов:
+# без пересылки, без Gemini и без пауз. Файлы берутся по сохранённым file_id,
+# запись идёт пачками через один multi-path update на пачку.
+# После каждой пачки прогресс сохраняется в локальный JSON, поэтому
+# после перезапуска бота команда продолжит с места остановки.
+# /recolor cached (recolor_from_cache) пересчитывает только умные цвета
+# по распределениям из кэша признаков, без скачивания файлов.
+RECOLOR_BATCH_SIZE = 50
+RECOLOR_DOWNLOAD_CONCURRENCY = 8
+RECOLOR_CHECKPOINT_DIR = os.environ.get("RECOLOR_CHECKPOINT_DIR", os.getcwd())
+
+_RECOLOR_RUNNING = False
+
+
+def is_recolor_running():
+    return _RECOLOR_RUNNING
+
+
+def _recolor_checkpoint_path(chan_key):
+    return os.path.join(RECOLOR_CHECKPOINT_DIR, f"recolor_checkpoint_{chan_key}.json")
+
+
+def load_recolor_checkpoint(chan_key):
+    try:
+        with open(_recolor_checkpoint_path(chan_key), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logging.error(f"[RECOLOR] Не удалось прочитать чекпоинт: {e}")
+        return {}
+
+
+def save_recolor_checkpoint(chan_key, data):
+    # Запись через временный файл, чтобы обрыв не оставил битый JSON
+    path = _recolor_checkpoint_path(chan_key)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def clear_recolor_checkpoint(chan_key):
+    try:
+        os.remove(_recolor_checkpoint_path(chan_key))
+    except FileNotFoundError:
+        pass
+
+
+def update_art_posts_fields(channel_id, updates):
+    """
+    Обновляет отдельные поля сразу у многих постов одним запросом.
+    updates: {post_id: {"field": value, ...}}
+    """
+    chan_key = channel_id.replace('@', '') if channel_id else "default"
+    payload = {
+        f"{post_id}/{field}": value
+        for post_id, fields in updates.items()
+        for field, value in fields.items()
+    }
+    if payload:
+        db.reference(f'art_posts/{chan_key}').update(payload)
+        _patch_posts_cache(chan_key, updates, merge=True)
+
+
+def _format_eta(seconds):
+    seconds = int(seconds)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours} ч {minutes} мин"
+    if minutes:
+        return f"{minutes} мин {seconds} сек"
+    return f"{seconds} сек"
+
+
+async def reanalyze_art_colors(bot, channel_id="anemonn", status_msg=None, restart=False, mode=None):
+    """
+    Пересчитывает цветовой анализ для всех фото-постов art_posts/CHANNEL_ID.
+    restart=True — игнорировать сохранённый чекпоинт и начать сначала.
+    Посты, которые не удалось обработать (ошибка загрузки или анализа), остаются
+    в чекпоинте и пересчитываются повторным /recolor.
+    mode — режим цветового анализа ("exact"/"fast"), по умолчанию COLOR_ANALYSIS_MODE.
+    """
+    global _RECOLOR_RUNNING
+    from color_analysis import analyze_images_colors_batch, get_feature_cache, resolve_analysis_mode
+
+    if _RECOLOR_RUNNING:
+        return
+    _RECOLOR_RUNNING = True
+
+    chan_key = channel_id.replace('@', '') if channel_id else "default"
+
+    async def report(text):
+        if status_msg:
+            try:
+                await status_msg.edit_text(text)
+            except Exception:
+                pass  # Текст не изменился или сообщение удалено
+
+    try:
+        mode = resolve_analysis_mode(mode)
+        if restart:
+            clear_recolor_checkpoint(chan_key)
+        checkpoint = load_recolor_checkpoint(chan_key)
+        last_post_id = checkpoint.get("last_post_id", -1)
+        done_before = checkpoint.get("done", 0)
+        failed_before = set(checkpoint.get("failed_ids", []))
+
+        data = await asyncio.to_thread(db.reference(f'art_posts/{chan_key}').get)
+        if isinstance(data, dict):
+            items = []
+            for pid, pdata in data.items():
+                try:
+                    items.append((int(pid), pdata))
+                except ValueError:
+                    continue
+        elif isinstance(data, list):
+            items = list(enumerate(data))
+        else:
+            items = []
+
+        # Как в get_valid_ids_list: только фото со статусом ok (старые записи без type — тоже фото)
+        todo = sorted(
+            (pid, pdata) for pid, pdata in items
+            if isinstance(pdata, dict)
+            and pdata.get('status', 'ok') == 'ok'
+            and pdata.get('type', 'photo') == 'photo'
+            and pdata.get('file_id')
+            and (pid > last_post_id or pid in failed_before)
+        )
+        total = len(todo)
+        # Прошлые неудачи идут первыми; удалённые с тех пор посты из списка выпадают
+        failed = {pid for pid, _ in todo if pid in failed_before}
+        logging.info(
+            f"[RECOLOR] {chan_key}: к пересчёту {total} постов (после ID {last_post_id}, "
+            f"повторно {len(failed)}), режим {mode}"
+        )
+
+        if not total:
+            clear_recolor_checkpoint(chan_key)
+            await report("✅ Пересчитывать нечего: все посты уже обработаны.")
+            return
+
+        feature_cache = get_feature_cache()
+        semaphore = asyncio.Semaphore(RECOLOR_DOWNLOAD_CONCURRENCY)
+
+        async def fetch(post):
+            # В режиме fast хватает уменьшенной копии, сохранённой при загрузке поста
+            use_small = mode == "fast" and bool(post.get('analysis_file_id'))
+            file_id = post['analysis_file_id'] if use_small else post['file_id']
+            async with semaphore:
+                file_info = await bot.get_file(file_id)
+                key = file_info.file_unique_id
+                features = await asyncio.to_thread(feature_cache.get, key, mode)
+                if features is not None:
+                    return key, features, None, use_small
+                return key, None, bytes(await file_info.download_as_bytearray()), use_small
+
+        done = 0
+        started = time.monotonic()
+
+        for start in range(0, total, RECOLOR_BATCH_SIZE):
+            batch = todo[start:start + RECOLOR_BATCH_SIZE]
+
+            fetched = await asyncio.gather(*(fetch(post) for _, post in batch), return_exceptions=True)
+
+            # Анализ всех скачанных файлов пачки в пуле процессов
+            to_analyze = [i for i, res in enumerate(fetched) if not isinstance(res, Exception) and res[1] is None]
+            analyzed = await analyze_images_colors_batch([fetched[i][2] for i in to_analyze], mode)
+            results = {}
+            for i, res in enumerate(fetched):
+                if not isinstance(res, Exception):
+                    results[i] = res[1]
+            for i, features in zip(to_analyze, analyzed):
+                results[i] = features
+                if features is not None:
+                    await asyncio.to_thread(feature_cache.put, fetched[i][0], features, mode)
+
+            updates = {}
+            for i, (pid, _) in enumerate(batch):
+                features = results.get(i)
+                if features is None:
+                    failed.add(pid)
+                    if isinstance(fetched[i], Exception):
+                        logging.error(f"[RECOLOR] Пост {pid}: ошибка загрузки файла: {fetched[i]}")
+                    continue
+                updates[pid] = {
+                    "analysis": features.analysis_record(),
+                    "color_desc": features.encoded_color_descriptor(),
+                }
+                # Ключ кэша признаков — чтобы /recolor cached обходился без Telegram
+                key_field = "analysis_file_unique_id" if fetched[i][3] else "file_unique_id"
+                if batch[i][1].get(key_field) != fetched[i][0]:
+                    updates[pid][key_field] = fetched[i][0]
+
+            try:
+                await asyncio.to_thread(update_art_posts_fields, chan_key, updates)
+            except Exception as e:
+                logging.error(f"[RECOLOR] Ошибка записи пачки в Firebase: {e}")
+                await report(
+                    f"❌ **Пересчёт остановлен:** ошибка записи в БД.\n"
+                    f"Обработано: `{done_before + done}`. Повторите /recolor, чтобы продолжить."
+                )
+                return
+
+            done += len(updates)
+            failed.difference_update(updates)
+            last_post_id = max(last_post_id, batch[-1][0])
+            save_recolor_checkpoint(chan_key, {
+                "last_post_id": last_post_id,
+                "done": done_before + done,
+                "failed_ids": sorted(failed),
+            })
+
+            processed = start + len(batch)
+            elapsed = time.monotonic() - started
+            rate = processed / elapsed if elapsed > 0 else 0.0
+            eta = (total - processed) / rate if rate > 0 else 0
+            await report(
+                f"🎨 **Пересчёт цветового анализа...**\n\n"
+                f"⏳ Обработано: `{processed}` из `{total}`\n"
+                f"👉 Последний ID: `{last_post_id}`\n"
+                f"⚡ Скорость: `{rate:.1f}` постов/сек\n"
+                f"🕒 Осталось: ~{_format_eta(eta)}\n\n"
+                f"✅ Обновлено: `{done_before + done}`\n"
+                f"❌ Ошибок: `{len(failed)}`"
+            )
+
+        # С неудачными постами чекпоинт остаётся: следующий /recolor пересчитает только их
+        if not failed:
+            clear_recolor_checkpoint(chan_key)
+        elapsed = time.monotonic() - started
+        await report(
+            f"✅ **Пересчёт цветового анализа завершён!**\n\n"
+            f"🖼 Обновлено постов: `{done_before + done}`\n"
+            f"❌ Ошибок: `{len(failed)}`"
+            + (" — повторите /recolor, чтобы пересчитать их" if failed else "") + "\n"
+            f"⏱ Время: {_format_eta(elapsed)} (`{total / elapsed if elapsed > 0 else 0:.1f}` постов/сек)"
+        )
+    except Exception as e:
+        logging.error(f"[RECOLOR] Критическая ошибка: {e}")
+        await report(f"❌ Пересчёт прерван: {e}\nПовторите /recolor, чтобы продолжить с места остановки.")
+    finally:
+        _RECOLOR_RUNNING = False
+
+
+async def recolor_from_cache(channel_id="anemonn", status_msg=None, mode=None):
+    """
+    Пересчёт умных цветов всего архива по распределениям из кэша признаков (/recolor cached) —
+    например, после правки SMART_*_CONFIG. Без Telegram и без анализа пикселей:
+    признаки читаются из ColorFeatureCache по file_unique_id поста, цвета считаются
+    одним пакетом recompute_smart_colors, в базу пишутся только изменившиеся записи.
+    Посты без ключа или без признаков в кэше остаются как есть — для них нужен обычный /recolor.
+    """
+    global _RECOLOR_RUNNING
+    from color_analysis import get_feature_cache, recompute_smart_colors, resolve_analysis_mode
+
+    if _RECOLOR_RUNNING:
+        return
+    _RECOLOR_RUNNING = True
+
+    chan_key = channel_id.replace('@', '') if channel_id else "default"
+
+    async def report(text):
+        if status_msg:
+            try:
+                await status_msg.edit_text(text)
+            except Exception:
+                pass
+
+    try:
+        mode = resolve_analysis_mode(mode)
+        started = time.monotonic()
+        data = await asyncio.to_thread(db.reference(f'art_posts/{chan_key}').get)
+        posts = [
+            post for post in posts_from_data(data)
+            if post.get('status', 'ok') == 'ok' and post.get('type', 'photo') == 'photo'
+        ]
+        keyed = []
+        no_key = 0
+        for post in posts:
+            key = (mode == "fast" and post.get('analysis_file_unique_id')) or post.get('file_unique_id')
+            if key:
+                keyed.append((post, key))
+            else:
+                no_key += 1
+
+        feature_cache = get_feature_cache()
+        features_list = await asyncio.to_thread(feature_cache.get_many, [key for _, key in keyed], mode)
+        found = [(post, features) for (post, _), features in zip(keyed, features_list) if features is not None]
+        missing = no_key + len(keyed) - len(found)
+
+        # Один векторный расчёт на весь архив — в потоке, чтобы не держать цикл событий
+        triples = await asyncio.to_thread(recompute_smart_colors, [features for _, features in found])
+
+        updates = {}
+        for (post, features), colors in zip(found, triples):
+            record = features.analysis_record(colors)
+            if post.get('analysis') != record:
+                updates[post['post_id']] = {"analysis": record}
+
+        items = list(updates.items())
+        for start in range(0, len(items), RECOLOR_BATCH_SIZE):
+            await asyncio.to_thread(update_art_posts_fields, chan_key, dict(items[start:start + RECOLOR_BATCH_SIZE]))
+
+        elapsed = time.monotonic() - started
+        logging.info(
+            f"[RECOLOR] {chan_key}: из кэша пересчитано {len(found)}, изменилось {len(updates)}, "
+            f"без признаков {missing}, {elapsed:.1f} с"
+        )
+        await report(
+            f"✅ **Цвета пересчитаны по кэшу признаков**\n\n"
+            f"🖼 Проверено постов: `{len(found)}`\n"
+            f"🎨 Изменилось: `{len(updates)}`\n"
+            f"⚠️ Нет в кэше: `{missing}` (для них нужен /recolor)\n"
+            f"⏱ Время: {_format_eta(elapsed)}"
+        )
+    except Exception as e:
+        logging.error(f"[RECOLOR] Ошибка пересчёта по кэшу: {e}")
+        await report(f"❌ Пересчёт по кэшу прерван: {e}")
+    finally:
+        _RECOLOR_RUNNING = False
@@ -600,6 +600,7 @@ export function initGallery() {
     let state = {
         offset: 0,
         limit: 20,
+        cursor: null, // Курсор следующей страницы из ответа сервера
         isLoading: false,
         hasMore: true,
         query: '',
@@ -633,6 +634,7 @@ export function initGallery() {
         if (reset) {
             galleryLoader.style.display = 'block';
             state.offset = 0;
+            state.cursor = null;
             state.hasMore = true;
             columns.forEach(col => col.innerHTML = '');
         }
@@ -652,6 +654,8 @@ export function initGallery() {
             if (state.filters.sat_max < 1) url += `&sat_max=${state.filters.sat_max}`;
             if (state.filters.date_from) url += `&date_from=${state.filters.date_from}`;
             if (state.filters.date_to) url += `&date_to=${state.filters.date_to}`;
+            // Курсор: сервер отдаёт следующую страницу срезом закэшированной выдачи
+            if (state.cursor) url += `&cursor=${encodeURIComponent(state.cursor)}`;
 
             const res = await fetch(url, { signal: state.activeController.signal });
             const data = await res.json();
@@ -665,8 +669,9 @@ export function initGallery() {
             } else {
                 renderMasonry(data.items, columns); // Передаем columns
                 state.offset += data.items.length;
+                state.cursor = data.cursor || null;
                 
-                if (data.items.length < state.limit) {
+                if (data.items.length < state.limit || !data.cursor) {
                     state.hasMore = false;
                     observer.unobserve(sentinel);
                 } else {
@@ -766,13 +771,56 @@ export function initGallery() {
         if (clearBtn) clearBtn.style.display = (val.length > 0 || state.similar_to) ? 'flex' : 'none';
     };
 
+    // Подсказки: дешёвый запрос к /suggest на каждый ввод, а полный поиск —
+    // только после паузы, по Enter или при выборе подсказки
+    const suggestList = document.createElement('datalist');
+    suggestList.id = 'g-search-suggest';
+    document.body.appendChild(suggestList);
+    searchInput.setAttribute('list', suggestList.id);
+    searchInput.setAttribute('autocomplete', 'off');
+    let suggestDebounce;
+    let suggestController = null;
+    let lastSuggestions = [];
+
+    const loadSuggestions = async (val) => {
+        if (suggestController) suggestController.abort();
+        suggestController = new AbortController();
+        try {
+            const res = await fetch(`/api/anemone/suggest?q=${encodeURIComponent(val)}`, { signal: suggestController.signal });
+            const data = await res.json();
+            lastSuggestions = (data.suggestions || []).map(s => s.text);
+            suggestList.innerHTML = '';
+            lastSuggestions.forEach(text => {
+                const option = document.createElement('option');
+                option.value = text;
+                suggestList.appendChild(option);
+            });
+        } catch (e) {
+            if (e.name !== 'AbortError') console.error(e);
+        }
+    };
+
     searchInput.addEventListener('input', (e) => {
         if (state.similar_to) return; // Игнорируем ввод, если активен поиск по картинке
         const val = e.target.value;
         if (clearBtn) clearBtn.style.display = val.length > 0 ? 'flex' : 'none';
         
         clearTimeout(debounce);
-        debounce = setTimeout(() => handleSearch(val), 300);
+        clearTimeout(suggestDebounce);
+        // Выбрана подсказка из списка — ищем сразу
+        if (lastSuggestions.includes(val)) {
+            handleSearch(val);
+            return;
+        }
+        suggestDebounce = setTimeout(() => loadSuggestions(val), 120);
+        debounce = setTimeout(() => handleSearch(val), 700);
+    });
+
+    searchInput.addEventListener('keydown', (e) => {
+        if (e.key !== 'Enter' || state.similar_to) return;
+        clearTimeout(debounce);
+        clearTimeout(suggestDebounce);
+        handleSearch(searchInput.value);
     });
 
     // Событие включения поиска по картинке